@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+"""
+Rule based alarm engine for streaming breath parameters
+
+Limits are checked incrementally as each sample or breath arrives so the
+cost of an evaluation is fixed by the number of rules, not by the amount
+of data seen.  Every alarm carries the latency (ms) from the arrival of
+the value that raised it to the moment the event was emitted.
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+import time
+from collections import deque
+from random import uniform
+
+#
+# Notes on Alarms
+#
+# Each rule is [parameter, low limit, high limit, debounce] where a limit of
+# None is not checked.  Debounce is the number of consecutive violations
+# (breaths for breath rules, samples for the pressure rule) needed before the
+# alarm is raised, this keeps a single noisy breath from alarming.
+#
+# Once raised the priority escalates LOW -> MEDIUM -> HIGH every "escalate"
+# further consecutive violations.  The alarm clears on the first value that
+# is back inside the limits.  A nan (sensor dropout) is not a value, it
+# leaves the violation count and any raised alarm as they are.
+#
+# PEEPi build-up - a debounce of several breaths means PEEPi has to stay
+# high breath after breath, which is the breath stacking pattern described
+# in monitor2.py that leads to barotrauma.
+#
+# Apnea - no breath seen within "apnea" seconds.  Breaths are either reported
+# with check_breath() or found with a rising threshold crossing in
+# check_sample() so apnea works even when no cycle analysis is running.
+#
+
+PRIORITY = ["LOW", "MEDIUM", "HIGH"]
+
+
+class ALARMS:
+
+    # parameter: [low, high, debounce]
+    limits = {
+        "Ppeak": [None, 35, 2],   # high peak pressure
+        "PEEPi": [None, 2, 3],    # intrinsic PEEP build-up
+        "RR": [8, 35, 2],         # respiration rate out of range
+    }
+    pressure_limit = [None, 40, 3]  # per sample pressure limit
+    apnea = 20          # seconds without a breath
+    escalate = 3        # violations between priority steps
+    threshold = 0       # trigger level for apnea breath detection
+    latency_budget = 5  # ms, events slower than this are counted
+    history = 1000      # events kept in self.events
+
+    def __init__(self, limits=None, pressure_limit=None, apnea=20,
+                 escalate=3, threshold=0, history=1000):
+        """
+        Setup alarm rules
+
+        limits (dict): {parameter: [low, high, debounce]} breath rules
+        pressure_limit (list): [low, high, debounce] rule for each sample
+        apnea (float): seconds without a breath before alarming, 0 disables
+        escalate (int): further violations before priority steps up
+        threshold (float): pressure level used to detect breaths in samples
+        history (int): latest events kept in self.events, self.raised
+                       counts them all so memory stays fixed
+        """
+        if limits is not None:
+            self.limits = limits
+        if pressure_limit is not None:
+            self.pressure_limit = pressure_limit
+        self.apnea = apnea
+        self.escalate = escalate
+        self.threshold = threshold
+        self.history = history
+        self.reset()
+
+    def reset(self):
+        """ clear all alarm state and latency counters """
+        self.count = {}    # consecutive violations per rule
+        self.active = {}   # currently raised alarms {rule: priority index}
+        self.events = deque(maxlen=self.history)  # latest events raised
+        self.raised = 0    # events raised since reset
+        self.last_breath = None
+        self.above = False  # sample state for threshold crossing
+        self.max_latency = 0
+        self.late = 0      # events that exceeded latency_budget
+        self.checks = 0
+
+    def check_sample(self, sample_time, pressure, arrival=None):
+        """
+        Evaluate one pressure sample
+
+        sample_time (float): time of sample in seconds
+        pressure (float): cm H2O
+        arrival (float): time.perf_counter() when sample arrived, defaults
+                         to now
+
+        Returns:
+        list: alarm events raised by this sample
+        """
+        if arrival is None:
+            arrival = time.perf_counter()
+        events = []
+
+        if self.last_breath is None:
+            self.last_breath = sample_time  # apnea counts from the first sample
+        if not math.isfinite(pressure):
+            # dropout, nothing to compare but time still runs for apnea
+            self._check_apnea(sample_time, events, arrival)
+            return events
+        # breath detection for apnea, rising edge through threshold
+        if self.threshold:
+            if pressure > self.threshold and not self.above:
+                self._breath_seen(sample_time, events, arrival)
+            self.above = pressure > self.threshold
+
+        self._rule("Pressure", pressure, self.pressure_limit, sample_time,
+                   events, arrival)
+        self._check_apnea(sample_time, events, arrival)
+        return events
+
+    def check_breath(self, stats, arrival=None):
+        """
+        Evaluate one breath worth of stats
+
+        stats (dict): stats dictionary from MONITOR/MONITOR2 contours
+        arrival (float): time.perf_counter() when the breath was computed
+
+        Returns:
+        list: alarm events raised by this breath
+        """
+        if arrival is None:
+            arrival = time.perf_counter()
+        events = []
+        breath_time = stats.get("End", 0)
+        # the gap before this breath, when only breaths are reported
+        self._check_apnea(stats.get("Start", breath_time), events, arrival)
+        self._breath_seen(breath_time, events, arrival)
+        for key, rule in self.limits.items():
+            if key in stats:
+                self._rule(key, stats[key], rule, breath_time, events,
+                           arrival)
+        return events
+
+    def check_time(self, now, arrival=None):
+        """ Evaluate apnea alone, use when no samples are arriving """
+        if arrival is None:
+            arrival = time.perf_counter()
+        events = []
+        self._check_apnea(now, events, arrival)
+        return events
+
+    def _breath_seen(self, breath_time, events, arrival):
+        if self.active.pop("Apnea", None) is not None:
+            self._emit(events, "Apnea", "CLEAR", breath_time, 0,
+                       self.apnea, arrival)
+        self.count["Apnea"] = 0
+        self.last_breath = breath_time
+
+    def _check_apnea(self, now, events, arrival):
+        if not self.apnea or self.last_breath is None:
+            return
+        elapsed = now - self.last_breath
+        if elapsed < self.apnea:
+            return
+        # escalate once for every further apnea period without a breath
+        level = min(int(elapsed // self.apnea) - 1, len(PRIORITY) - 1)
+        if self.active.get("Apnea", -1) < level:
+            self.active["Apnea"] = level
+            self._emit(events, "Apnea", PRIORITY[level], now, elapsed,
+                       self.apnea, arrival)
+
+    def _rule(self, key, value, rule, event_time, events, arrival):
+        low, high, debounce = rule
+        self.checks += 1
+        if value is None or not math.isfinite(value):
+            return  # missing, neither a violation nor back inside limits
+        if low is not None and value < low:
+            limit = low
+        elif high is not None and value > high:
+            limit = high
+        else:
+            # back inside limits
+            self.count[key] = 0
+            if self.active.pop(key, None) is not None:
+                self._emit(events, key, "CLEAR", event_time, value, None,
+                           arrival)
+            return
+
+        count = self.count.get(key, 0) + 1
+        self.count[key] = count
+        if count < debounce:
+            return
+        level = min((count - debounce) // self.escalate, len(PRIORITY) - 1)
+        if self.active.get(key, -1) < level:
+            self.active[key] = level
+            self._emit(events, key, PRIORITY[level], event_time, value, limit,
+                       arrival)
+
+    def _emit(self, events, key, priority, event_time, value, limit, arrival):
+        latency = (time.perf_counter() - arrival) * 1000
+        if latency > self.max_latency:
+            self.max_latency = latency
+        if latency > self.latency_budget:
+            self.late += 1
+        event = {
+            "Alarm": key,
+            "Priority": priority,
+            "Time": event_time,
+            "Value": value,
+            "Limit": limit,
+            "Latency": latency  # ms from arrival to event
+        }
+        events.append(event)
+        self.events.append(event)
+        self.raised += 1
+
+    def print(self):
+        for item in self.events:
+            print("{:>8} {:>6} @{:1.2f}s value={} limit={} ({:1.3f} ms)".format(
+                item["Alarm"], item["Priority"], item["Time"], item["Value"],
+                item["Limit"], item["Latency"]))
+
+
+if __name__ == "__main__":
+
+    # Throughput test, many patients evaluated on one core
+    patients = 2000
+    breaths = 20
+    engines = [ALARMS(apnea=20) for i in range(patients)]
+
+    print("Evaluating {} patients x {} breaths".format(patients, breaths))
+    elapsed = time.perf_counter()
+    for n in range(breaths):
+        for engine in engines:
+            stats = {
+                "End": n * 3.0,
+                "Ppeak": uniform(25, 40),
+                "PEEPi": uniform(0, 3),
+                "RR": uniform(10, 30)
+            }
+            engine.check_breath(stats)
+    elapsed = time.perf_counter() - elapsed
+
+    raised = sum(engine.raised for engine in engines)
+    worst = max(engine.max_latency for engine in engines)
+    print("{:1.0f} breaths/s, {} events, worst latency {:1.4f} ms".format(
+        patients * breaths / elapsed, raised, worst))
+    engines[0].print()
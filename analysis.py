@@ -0,0 +1,379 @@
+#!/usr/bin/python3
+"""
+One analysis core for every sample source and both detectors
+
+Sources give blocks of [time, pressure] rows through read(n):
+    TEMPLATE - the scaled template breath of model.BREATH
+    REPLAY   - a csv_raw recording or .vpa archive through model2.BREATH2
+    LIVE     - a sensor function sampled on a sampler.SAMPLER thread
+
+ANALYSIS keeps the samples in a buffer.SAMPLES, finds breaths with the
+vectorized find_cycles() below (also used by MONITOR, MONITOR2, chunked
+and parallel) and runs the contours of the selected strategy on each:
+    'monitor2' - MONITOR2.contours, post-peak skip and slope bracketing
+    'monitor'  - MONITOR.contours, with the large-peak special case
+compute() analyzes everything read so far, run() streams a source of any
+length in chunks, chunked.CHUNKED is a thin wrapper over it.
+
+python3 analysis.py --source replay --file <csv or vpa> --strategy monitor
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import time
+import argparse
+import model
+import model2
+import buffer
+import sampler
+
+
+def find_cycles(pressure, threshold, state=0, start=0, first=1):
+    """
+    Breath start/end indices with the find_cycles state machine
+
+    The machine only moves on the first sample of the sign it is waiting
+    for (0: negative, 1: positive = start, 2: negative, 3: positive = end),
+    so it jumps from event to event with searchsorted instead of visiting
+    every sample.  state/start/first let a caller resume on a longer buffer.
+
+    pressure (np.array): samples
+    threshold (float): trigger level
+    state (int): machine state to resume from
+    start (int): start index of an unfinished breath (state 2 and 3)
+    first (int): first sample to look at, find_cycles skips sample 0
+
+    Returns:
+    cycles, state, start: (breaths, 2) array of [start, end] indices, the
+                          final state and the start of an unfinished breath
+    """
+    xar = np.asarray(pressure) - threshold
+    pos = np.nonzero(xar > 0)[0]
+    neg = np.nonzero(xar < 0)[0]
+    cycles = []
+    i = first
+    while True:
+        events = neg if state in (0, 2) else pos
+        k = np.searchsorted(events, i)
+        if k >= len(events):
+            break
+        i = int(events[k])
+        if state == 1:
+            start = i  # start of inhalation
+        elif state == 3:
+            cycles.append([start, i])  # end of cycle
+        state = state + 1 if state < 3 else 1
+        i += 1
+    return np.array(cycles, dtype=int).reshape(-1, 2), state, start
+
+
+def trigger(pressure, factor=1.25, percentile=0):
+    """
+    MONITOR2.compute threshold rule, PEEP floor times threshold_factor
+
+    percentile (float): the floor is this percentile of the pressure, 0 for
+                        the lowest sample (MONITOR2.threshold_percentile),
+                        5 ignores dips and glitches in recordings
+    """
+    floor = np.percentile(pressure, percentile) if percentile else np.amin(pressure)
+    return floor * factor
+
+
+class TEMPLATE:
+    """ model.BREATH template simulator as a source """
+
+    live = False
+
+    def __init__(self, rate=100, bpm=30, peak=31, peep=5, random=[0, 0, 0]):
+        self.models = model.BREATH()
+        self.models.scale(bpm, peak, peep)
+        self.rate = rate
+        self.random = random
+        self.n = 0
+
+    def read(self, n):
+        t = (self.n + np.arange(n)) / self.rate
+        self.n += n
+        if all(x == 0 for x in self.random):
+            # no per breath regeneration, sample the template directly
+            breath = self.models.breath
+            values = np.interp(t % self.models.max_time, breath[:, 0], breath[:, 1])
+        else:
+            values = np.array([self.models.get_simulated_data(x, self.random)
+                               for x in t])
+        return np.column_stack((t, values))
+
+
+class REPLAY:
+    """ recorded csv_raw file or .vpa archive through model2.BREATH2 """
+
+    live = False
+
+    def __init__(self, filename, type='press', rate=50):
+        """ rate (float): samples per second of csv_raw files, archives store theirs """
+        self.models = model2.BREATH2(filename=filename, type=type, rate=rate)
+        self.rate = self.models.rate
+        self.n = 0
+
+    def read(self, n):
+        vpa = self.models.archive
+        if vpa is not None:
+            # whole blocks at a time instead of sample by sample
+            rows = np.column_stack((vpa.times(self.n, self.n + n),
+                                    vpa.read(self.n, self.n + n)[:, self.models.channel]))
+            self.n += len(rows)
+            return rows
+        rows = []
+        while len(rows) < n:
+            point = self.models.get_simulated_data()
+            if point is None:
+                break
+            rows.append(point)
+        self.n += len(rows)
+        return np.array(rows, dtype=float).reshape(-1, 2)
+
+    def rewind(self):
+        self.models.rewind()
+        self.n = 0
+
+
+class LIVE:
+    """ sensor read on a sampler.SAMPLER thread """
+
+    live = True
+
+    def __init__(self, sensor, period=0.01, capacity=6000):
+        """
+        sensor (function): sensor(t) returns the pressure at time t
+        period (float): seconds between samples
+        capacity (int): samples the ring holds before overrunning
+        """
+        self.rate = 1 / period
+        self.thread = sampler.SAMPLER(sensor, period, sampler.RING(capacity))
+        self.thread.start()
+
+    def read(self, n):
+        return self.thread.ring.read(limit=n)
+
+    def stop(self):
+        self.thread.stop()
+
+    def report(self):
+        return self.thread.report()
+
+
+def detector(strategy='monitor2', smooth=None, window=7, slope_factor=10):
+    """ MONITOR or MONITOR2 used only for its contours, no model or plots """
+    if strategy == 'monitor':
+        import monitor
+        mon = monitor.MONITOR.__new__(monitor.MONITOR)
+    elif strategy == 'monitor2':
+        import monitor2
+        mon = monitor2.MONITOR2.__new__(monitor2.MONITOR2)
+        mon.smooth = smooth
+        mon.slope_factor = slope_factor
+        mon.smooth_window = window
+    else:
+        raise ValueError("unknown strategy {}".format(strategy))
+    mon.cycle_stats = []
+    mon.stats = {}
+    return mon
+
+
+class ANALYSIS:
+
+    margin = 8  # samples kept before a breath for the slope
+
+    def __init__(self, source, strategy='monitor2', threshold=0,
+                 threshold_factor=1.25, smooth=None, window=7, slope_factor=10):
+        """
+        source: TEMPLATE, REPLAY, LIVE or anything with read(n) and rate
+        strategy (str): 'monitor2' or 'monitor' contours
+        threshold (float): trigger level, 0 takes PEEP * threshold_factor
+        """
+        self.source = source
+        self.strategy = strategy
+        self.threshold = threshold
+        self.threshold_factor = threshold_factor
+        self.mon = detector(strategy, smooth, window, slope_factor)
+        self.data = buffer.SAMPLES(rate=source.rate if source is not None else None)
+        self.cycle_stats = []
+        self.cycle_start = []  # sample index of the start of each cycle_stats breath
+        self.skipped = 0  # breaths the detector could not analyze
+
+    def read(self, seconds):
+        """ append seconds of samples from the source, less at end of file """
+        want = int(round(seconds * self.source.rate))
+        got = 0
+        while got < want:
+            rows = self.source.read(want - got)
+            if len(rows) == 0:
+                if not self.source.live:
+                    break
+                time.sleep(0.05)  # wait for the sampler
+                continue
+            self.data.extend(rows)
+            got += len(rows)
+        return got
+
+    def trigger(self, pressure):
+        if self.threshold == 0:
+            self.threshold = trigger(pressure, self.threshold_factor)
+        return self.threshold
+
+    def analyze(self, cycles, base=0):
+        """
+        contours of the selected strategy on cycles of self.data, the start
+        of every analyzed breath is kept in cycle_start as base + index
+        """
+        mon = self.mon
+        data = self.data.view()
+        mon.data = self.data  # the buffer, contours takes the rate from it
+        mon.datanp = data
+        mon.captured_idx = cycles.ravel().tolist()
+        mon.captured = [data[i].tolist() for i in mon.captured_idx]
+        stats = []
+        for i in range(len(cycles)):
+            mon.stats = {}
+            mon.contours(i, self.threshold, plot=False, quiet=True)
+            if len(mon.stats) == 0:
+                self.skipped += 1
+                continue
+            stats.append(mon.stats)
+            self.cycle_start.append(base + int(cycles[i, 0]))
+        return stats
+
+    def compute(self):
+        """
+        Stats of every complete breath read so far
+
+        Returns:
+        list: stats dictionaries, also appended to cycle_stats
+        """
+        data = self.data.view()
+        if len(data) < 2:
+            return []
+        threshold = self.trigger(data[:, 1])
+        cycles = find_cycles(data[:, 1], threshold)[0]
+        stats = self.analyze(cycles)
+        self.cycle_stats.extend(stats)
+        return stats
+
+    def run(self, seconds=None, chunk=5000, callback=None):
+        """
+        Stream the source through the analysis, memory stays about one chunk
+
+        seconds (float): how much to analyze, None for all of a recording
+        chunk (int): samples read at a time
+        callback (function): called with each stats dictionary
+
+        Returns:
+        list: stats of every breath, same as compute() on the whole source
+              for a fixed threshold; a threshold of 0 is taken from the
+              first chunk read, not from the whole source
+        """
+        total = None if seconds is None else int(round(seconds * self.source.rate))
+        self.data.clear()
+        base = 0       # absolute index of data[0]
+        scanned = 1    # next absolute index for find_cycles
+        state = 0
+        start = 0      # absolute start of an unfinished breath
+        pending = np.empty((0, 2), dtype=int)  # complete, not yet analyzed
+        done = 0
+        eof = False
+        while not eof:
+            want = chunk if total is None else min(chunk, total - done)
+            rows = self.source.read(want) if want > 0 else np.empty((0, 2))
+            if len(rows) == 0 and self.source.live and want > 0:
+                time.sleep(0.05)
+                continue
+            done += len(rows)
+            if self.source.live:
+                eof = total is not None and done >= total  # reads can be short
+            else:
+                eof = len(rows) < want or want == 0
+            self.data.extend(rows)
+            data = self.data.view()
+            if len(data) == 0:
+                break
+            threshold = self.trigger(data[:, 1])
+            top = base + len(data)
+
+            cycles, state, start = find_cycles(data[:, 1], threshold, state,
+                                               start - base, scanned - base)
+            start += base
+            pending = np.concatenate((pending, cycles + base))
+            scanned = top
+
+            # breaths with the samples after them the slope needs
+            ready = len(pending) if eof else \
+                int(np.searchsorted(pending[:, 1] + self.margin, top))
+            if ready:
+                stats = self.analyze(pending[:ready] - base, base)
+                self.cycle_stats.extend(stats)
+                if callback is not None:
+                    for item in stats:
+                        callback(item)
+                pending = pending[ready:]
+
+            # drop samples no breath needs any more
+            keep = pending[0, 0] if len(pending) else \
+                (start if state in (2, 3) else scanned)
+            keep = max(keep - self.margin, base)
+            self.data.keep(top - keep)
+            base = keep
+        return self.cycle_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Unified breath analysis over any sample source',
+        epilog='replay needs --file, template simulates 60 s')
+    parser.add_argument('--source', type=str, default='template',
+                        choices=['template', 'replay', 'live'])
+    parser.add_argument('--file', type=str, default='', help="csv_raw or .vpa file")
+    parser.add_argument('--strategy', type=str, default='monitor2',
+                        choices=['monitor2', 'monitor'])
+    parser.add_argument('--threshold', type=float, default=0)
+    parser.add_argument('--seconds', type=float, default=None)
+    parser.add_argument('--rate', type=float, default=50,
+                        help="samples per second of csv_raw files")
+    args = parser.parse_args()
+
+    if args.source == 'replay':
+        source = REPLAY(args.file, rate=args.rate)
+    elif args.source == 'live':
+        template = TEMPLATE()
+        source = LIVE(lambda t: template.models.get_simulated_data(t))
+    else:
+        source = TEMPLATE()
+    seconds = args.seconds
+    if seconds is None and args.source != 'replay':
+        seconds = 10 if args.source == 'live' else 60
+
+    core = ANALYSIS(source, args.strategy, args.threshold)
+    elapsed = time.perf_counter()
+    stats = core.run(seconds)
+    elapsed = time.perf_counter() - elapsed
+    if args.source == 'live':
+        source.stop()
+        print(source.report())
+    print("{}: {} breaths ({} skipped) in {:1.2f}s, threshold {:1.2f}".format(
+        args.strategy, len(stats), core.skipped, elapsed, core.threshold))
+    for key in ["PEEP", "Ppeak", "Pplat", "PEEPi", "RR"]:
+        values = np.array([item[key] for item in stats], dtype=float)
+        if len(values):
+            print("{:>6}: median {:1.2f} [{:1.2f} - {:1.2f}]".format(
+                key, np.nanmedian(values), np.nanmin(values), np.nanmax(values)))
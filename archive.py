@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+"""
+Compact archive format for pressure/flow recordings (.vpa)
+
+The csv_raw files spend most of their bytes on the time column, which is
+redundant for a fixed sample rate, and on writing two decimal values as
+text.  A .vpa file keeps an implicit time base and stores each channel as
+int16 fixed point (value = int * scale, -32768 for a missing nan value),
+delta encoded and zlib compressed in blocks.  A block index at the end of the file allows any block to be
+decoded on its own, so readers can stream or jump around.
+
+Layout (little endian):
+    header  - magic "VPA1", channels, rate, scale, block size, samples,
+              t0, index offset, channel names
+    blocks  - zlib(int16 deltas of channel 0, then channel 1, ...)
+              the first delta of each block is from 0 so blocks decode alone,
+              deltas wrap around in int16 so any step is exact
+    index   - [offset, length] uint64 pair per block
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import struct
+import zlib
+import time
+import os
+import argparse
+from pathlib import Path
+
+MAGIC = b"VPA1"
+HEADER = struct.Struct("<4sHHddIQdQ")  # magic, version, channels, rate, scale,
+                                       # block, samples, t0, index offset
+NAME = struct.Struct("<8s")            # channel name after header
+VERSION = 2                            # 2 reserves MISSING for nan
+MISSING = -32768                       # int16 of a nan sample
+
+
+class WRITER:
+
+    def __init__(self, filename, channels=('press', 'flow'), rate=50,
+                 scale=0.01, block=4096, t0=0, level=6):
+        """
+        filename (str): output .vpa file
+        channels (list): channel names, up to 8 characters each
+        rate (float): samples per second
+        scale (float): value of one int16 step, 0.01 keeps two decimals
+        block (int): samples per block
+        t0 (float): time of the first sample
+        level (int): zlib compression level
+        """
+        self.fp = open(filename, "wb")
+        self.channels = list(channels)
+        self.rate = rate
+        self.scale = scale
+        self.block = block
+        self.t0 = t0
+        self.level = level
+        self.samples = 0
+        self.clipped = 0
+        self.index = []
+        self.pending = np.empty((0, len(self.channels)), dtype=np.int16)
+        self.write_header(0)
+        for name in self.channels:
+            self.fp.write(NAME.pack(name.encode()[:8]))
+
+    def write_header(self, index_offset):
+        self.fp.seek(0)
+        self.fp.write(HEADER.pack(MAGIC, VERSION, len(self.channels),
+                                  self.rate, self.scale, self.block,
+                                  self.samples, self.t0, index_offset))
+
+    def append(self, values):
+        """
+        Add samples
+
+        values (np.array): shape (n, channels) or a single row, nan is
+                           stored as MISSING and read back as nan
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        fixed = np.round(values / self.scale)
+        missing = np.isnan(fixed)
+        low, high = MISSING + 1, np.iinfo(np.int16).max
+        outside = (fixed < low) | (fixed > high)
+        if outside.any():
+            self.clipped += int(outside.sum())
+            fixed = np.clip(fixed, low, high)
+        if missing.any():
+            fixed[missing] = MISSING
+        self.pending = np.concatenate((self.pending, fixed.astype(np.int16)))
+        while len(self.pending) >= self.block:
+            self.write_block(self.pending[:self.block])
+            self.pending = self.pending[self.block:]
+
+    def write_block(self, fixed):
+        # int16 wrap around keeps deltas exact even for full scale steps
+        deltas = np.diff(fixed, axis=0, prepend=np.zeros((1, fixed.shape[1]),
+                                                         dtype=np.int16))
+        payload = zlib.compress(deltas.T.astype('<i2').tobytes(), self.level)
+        self.index.append([self.fp.tell(), len(payload)])
+        self.fp.write(payload)
+        self.samples += len(fixed)
+
+    def close(self):
+        if len(self.pending):
+            self.write_block(self.pending)
+            self.pending = self.pending[:0]
+        index_offset = self.fp.tell()
+        self.fp.write(np.array(self.index, dtype='<u8').reshape(-1, 2).tobytes())
+        self.write_header(index_offset)
+        self.fp.close()
+        if self.clipped:
+            print("*** WARNING {} values clipped to int16 range".format(self.clipped))
+
+
+class ARCHIVE:
+
+    def __init__(self, filename):
+        self.fp = open(filename, "rb")
+        (magic, self.version, channels, self.rate, self.scale, self.block,
+         self.samples, self.t0, index_offset) = HEADER.unpack(
+             self.fp.read(HEADER.size))
+        if magic != MAGIC:
+            raise IOError("{} is not a .vpa archive".format(filename))
+        self.channels = []
+        for i in range(channels):
+            self.channels.append(
+                NAME.unpack(self.fp.read(NAME.size))[0].rstrip(b"\0").decode())
+        self.fp.seek(index_offset)
+        self.index = np.frombuffer(self.fp.read(), dtype='<u8').reshape(-1, 2)
+        self.blocks = len(self.index)
+
+    def channel(self, name):
+        """ column of a channel name, 'pres'/'press' both match press """
+        for i in range(len(self.channels)):
+            if self.channels[i].startswith(name[:4]):
+                return i
+        raise KeyError(name)
+
+    def read_block(self, i):
+        """
+        Decode one block, random access
+
+        Returns:
+        np.array: shape (samples in block, channels) of float values, nan
+                  where the sample was missing
+        """
+        offset, length = self.index[i]
+        self.fp.seek(int(offset))
+        raw = np.frombuffer(zlib.decompress(self.fp.read(int(length))),
+                            dtype='<i2')
+        deltas = raw.reshape(len(self.channels), -1)
+        fixed = np.cumsum(deltas, axis=1, dtype=np.int16).T  # wraps like encode
+        values = fixed * self.scale
+        if self.version >= 2:
+            values[fixed == MISSING] = np.nan
+        return values
+
+    def read(self, start=0, stop=None):
+        """ samples [start, stop) decoding only the blocks they touch """
+        if stop is None or stop > self.samples:
+            stop = self.samples
+        if start >= stop:
+            return np.empty((0, len(self.channels)))
+        first = start // self.block
+        last = (stop - 1) // self.block
+        data = np.concatenate([self.read_block(i) for i in range(first, last + 1)])
+        offset = first * self.block
+        return data[start - offset:stop - offset]
+
+    def times(self, start=0, stop=None):
+        """ implicit time base of samples [start, stop) """
+        if stop is None or stop > self.samples:
+            stop = self.samples
+        return self.t0 + np.arange(start, stop) / self.rate
+
+    def stream(self):
+        """ generator of decoded blocks in order """
+        for i in range(self.blocks):
+            yield self.read_block(i)
+
+    def close(self):
+        self.fp.close()
+
+
+def pack_csv(pres_file, out_file=None, rate=50, scale=0.01, block=4096):
+    """
+    Pack a csv_raw pressure file and its matching flow file into a .vpa,
+    both cut to the shorter of the two
+
+    Returns:
+    str: archive filename
+    """
+    pres_file = Path(pres_file)
+    flow_file = pres_file.with_name(pres_file.name.replace("-pres-", "-flow-", 1))
+    if out_file is None:
+        out_file = pres_file.with_name(
+            pres_file.name.replace("-pres-", "-", 1)).with_suffix(".vpa")
+    pres = np.loadtxt(str(pres_file), delimiter=',', ndmin=2)
+    columns = [pres[:, 1]]
+    channels = ['press']
+    if flow_file.exists():
+        flow = np.loadtxt(str(flow_file), delimiter=',', ndmin=2)
+        count = min(len(pres), len(flow))
+        columns = [pres[:count, 1], flow[:count, 1]]
+        channels.append('flow')
+    t0 = pres[0, 0] if len(pres) else 0
+    writer = WRITER(str(out_file), channels, rate, scale, block, t0)
+    writer.append(np.column_stack(columns))
+    writer.close()
+    return str(out_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Pack csv_raw pressure/flow files into .vpa archives',
+        epilog='Prints size and decode speed against the csv files')
+    parser.add_argument('files', type=str, nargs='+',
+                        help="csv_raw pressure files (-pres-)")
+    args = parser.parse_args()
+
+    for name in args.files:
+        if os.path.getsize(name) == 0:
+            continue
+        flow = name.replace("-pres-", "-flow-", 1)
+        csv_size = os.path.getsize(name) + (os.path.getsize(flow) if os.path.exists(flow) else 0)
+        out = pack_csv(name)
+
+        elapsed = time.perf_counter()
+        np.loadtxt(name, delimiter=',')
+        csv_time = time.perf_counter() - elapsed
+        elapsed = time.perf_counter()
+        vpa = ARCHIVE(out)
+        data = vpa.read()
+        vpa_time = time.perf_counter() - elapsed
+        print("{}: {} samples, csv {:1.1f} MB -> {:1.2f} MB ({:1.1f}x), "
+              "decode {:1.1f} ms vs csv parse {:1.0f} ms".format(
+                  Path(out).name, len(data), csv_size / 1e6,
+                  os.path.getsize(out) / 1e6, csv_size / os.path.getsize(out),
+                  vpa_time * 1000, csv_time * 1000))
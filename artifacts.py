@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+"""
+Sensor artifacts added to clean [time, pressure] samples
+
+model.BREATH is noiseless template interpolation and the csv_raw recordings
+are only as messy as they happen to be.  ARTIFACTS corrupts any block of
+samples, a whole recording or the chunks of a stream, with every artifact
+drawn for the whole block at once from a seeded numpy generator:
+
+    noise    - gaussian sensor noise, cmH2O standard deviation
+    spikes   - single sample spikes per second, +/- spike_size cmH2O
+    dropouts - gaps per second, exponential length around dropout_length s,
+               the samples are removed (gap='drop') or set to nan (gap='nan')
+    drift    - baseline random walk, cmH2O per square root of a second
+    clip     - (low, high) sensor range, values saturate outside it
+    quantum  - ADC resolution, values are rounded to a multiple of it
+
+Drift and a dropout running past the end of a block carry over to the next
+apply(), so a stream corrupted chunk by chunk is the same kind of signal as
+a recording corrupted at once.
+
+python3 artifacts.py --minutes 10 --noise 0.3 --spikes 0.1 --dropouts 0.02
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import io
+import time
+import contextlib
+import argparse
+import model
+import analysis
+
+
+class ARTIFACTS:
+
+    def __init__(self, rate=50, noise=0, spikes=0, spike_size=10, dropouts=0,
+                 dropout_length=0.5, gap='drop', drift=0, clip=None, quantum=0,
+                 seed=None):
+        """
+        rate (float): samples per second of the input
+        noise (float): standard deviation of the sensor noise, cmH2O
+        spikes (float): spikes per second
+        spike_size (float): largest spike, cmH2O either way
+        dropouts (float): gaps per second
+        dropout_length (float): mean gap length, s
+        gap (str): 'drop' removes the samples of a gap, 'nan' keeps the times
+        drift (float): baseline random walk, cmH2O per square root of a second
+        clip (tuple): (low, high) sensor range, None for no saturation
+        quantum (float): ADC step, cmH2O, 0 for none
+        seed (int): numpy random seed, the same seed corrupts the same way
+        """
+        if gap not in ('drop', 'nan'):
+            raise ValueError("unknown gap {}".format(gap))
+        self.rate = rate
+        self.noise = noise
+        self.spikes = spikes
+        self.spike_size = spike_size
+        self.dropouts = dropouts
+        self.dropout_length = dropout_length
+        self.gap = gap
+        self.drift = drift
+        self.clip = clip
+        self.quantum = quantum
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        self.baseline = 0.0   # drift level at the end of the last block
+        self.missing = 0      # samples of a dropout still to come
+        self.counts = {"Samples": 0, "Spikes": 0, "Dropped": 0}
+
+    def apply(self, rows):
+        """
+        Corrupt a block of samples
+
+        rows (np.array): [time, value] rows, the following block of the stream
+
+        Returns:
+        np.array: corrupted copy, fewer rows when gaps are dropped
+        """
+        rows = np.array(rows, dtype=float).reshape(-1, 2)
+        n = len(rows)
+        if n == 0:
+            return rows
+        values = rows[:, 1]
+        rng = self.rng
+
+        if self.noise:
+            values += rng.normal(0, self.noise, n)
+        if self.drift:
+            walk = np.cumsum(rng.normal(0, self.drift / np.sqrt(self.rate), n))
+            values += self.baseline + walk
+            self.baseline += walk[-1]
+        if self.spikes:
+            at = np.flatnonzero(rng.random(n) < self.spikes / self.rate)
+            values[at] += rng.uniform(-self.spike_size, self.spike_size, len(at))
+            self.counts["Spikes"] += len(at)
+        if self.clip is not None:
+            np.clip(values, self.clip[0], self.clip[1], out=values)
+        if self.quantum:
+            values[:] = np.round(values / self.quantum) * self.quantum
+
+        keep = np.ones(n, dtype=bool)
+        if self.dropouts or self.missing:
+            # +1 where a gap starts, -1 where it ends, inside where the sum > 0
+            edges = np.zeros(n + 1, dtype=int)
+            carry = min(self.missing, n)  # dropout left over from the last block
+            if carry:
+                edges[0] += 1
+                edges[carry] -= 1
+            starts = np.flatnonzero(rng.random(n) < self.dropouts / self.rate)
+            lengths = np.maximum(np.round(rng.exponential(
+                self.dropout_length * self.rate, len(starts))).astype(int), 1)
+            ends = starts + lengths
+            np.add.at(edges, starts, 1)
+            np.add.at(edges, np.minimum(ends, n), -1)
+            keep = np.cumsum(edges[:n]) <= 0
+            self.missing = max(self.missing - n,
+                               int(np.amax(ends)) - n if len(ends) else 0, 0)
+            self.counts["Dropped"] += int(n - np.sum(keep))
+        self.counts["Samples"] += n
+
+        if self.gap == 'nan':
+            values[~keep] = np.nan
+            return rows
+        return rows[keep]
+
+
+def corrupt(rows, rate=50, seed=None, **options):
+    """ one recording through ARTIFACTS, options as ARTIFACTS() """
+    return ARTIFACTS(rate, seed=seed, **options).apply(rows)
+
+
+def stats_of(rows, threshold):
+    """ contours of every breath, with the breath count and skipped breaths """
+    core = analysis.ANALYSIS(None, 'monitor2', threshold)
+    core.data.extend(rows[~np.isnan(rows[:, 1])])
+    stats = core.compute()  # contours run quiet
+    return stats, core.skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Artifact injection throughput and detector robustness',
+        epilog='corrupts a synthesized model.BREATH waveform and compares contours')
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=50)
+    parser.add_argument('--noise', type=float, default=0.3)
+    parser.add_argument('--spikes', type=float, default=0.1)
+    parser.add_argument('--dropouts', type=float, default=0.02)
+    parser.add_argument('--drift', type=float, default=0.05)
+    parser.add_argument('--quantum', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    options = dict(noise=args.noise, spikes=args.spikes, dropouts=args.dropouts,
+                   drift=args.drift, clip=(0, 60), quantum=args.quantum)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        br = model.BREATH()
+        br.scale(20, 30, 10)
+    clean, breaths = br.synthesize(args.minutes * 60, args.rate, [10, 5, 5], args.seed)
+
+    # throughput on a long block and chunk by chunk as a stream
+    big = np.tile(clean, (max(int(2e6 // len(clean)), 1), 1))
+    elapsed = time.perf_counter()
+    corrupt(big, args.rate, args.seed, **options)
+    elapsed = time.perf_counter() - elapsed
+    print("block: {:1.1f} M samples/s".format(len(big) / elapsed / 1e6))
+    stream = ARTIFACTS(args.rate, seed=args.seed, **options)
+    elapsed = time.perf_counter()
+    for i in range(0, len(big), 500):
+        stream.apply(big[i:i + 500])
+    elapsed = time.perf_counter() - elapsed
+    print("stream, 500 samples per apply(): {:1.1f} M samples/s".format(
+        len(big) / elapsed / 1e6))
+
+    injector = ARTIFACTS(args.rate, seed=args.seed, **options)
+    dirty = injector.apply(clean)
+    print("{} breaths, {} spikes, {} samples dropped".format(
+        len(breaths["Start"]), injector.counts["Spikes"], injector.counts["Dropped"]))
+    threshold = br.peep_sim * 1.25
+    print("{:>8} {:>7} {:>7} {:>7} {:>7} {:>7}".format(
+        "", "breaths", "skipped", "Ppeak", "PEEP", "s"))
+    for name, rows in (("clean", clean), ("corrupt", dirty)):
+        elapsed = time.perf_counter()
+        stats, skipped = stats_of(rows, threshold)
+        elapsed = time.perf_counter() - elapsed
+        if len(stats) == 0:
+            print("{:>8} no breaths".format(name))
+            continue
+        print("{:>8} {:>7} {:>7} {:>7.2f} {:>7.2f} {:>7.2f}".format(
+            name, len(stats), skipped,
+            np.median([item["Ppeak"] for item in stats]) - np.median(breaths["Ppeak"]),
+            np.median([item["PEEP"] for item in stats]) - np.median(breaths["PEEP"]),
+            elapsed))
+    print("Ppeak and PEEP are median errors against the synthesized truth")
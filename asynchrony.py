@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+"""
+Patient-ventilator asynchrony labels from paired pressure and flow
+
+Breaths are cut with analysis.find_cycles on the pressure, like every other
+path, and the flow of all breaths is checked at once with numpy segment
+operations, so a whole recording costs a few array passes and a single
+breath is cheap enough to check live as it ends.
+
+    DoubleTrigger     - the expiration after the breath is shorter than
+                        half the reference inspiratory time, the next
+                        breath was triggered before exhaling (Thille 2006)
+    IneffectiveEffort - during expiration the flow rises towards zero and
+                        falls back by more than "effort" L/min without
+                        reaching +"expire", a patient effort that did not
+                        trigger a breath
+    MissedTrigger     - during expiration the flow rises above +"expire"
+                        L/min and falls below -"expire" again, an
+                        inspiration the pressure threshold did not split
+                        into a breath of its own
+    PrematureCycling  - the inspiration is shorter than half the reference
+                        inspiratory time, the ventilator cycled off early
+
+A breath needs inspiratory flow above +"expire" L/min to be labelled at all,
+pressure re-crossing the threshold during expiration gives breaths without
+one and these are marked not Valid instead.  Inspiration ends at the first
+sample after that with flow below -"expire" L/min.  The reference
+inspiratory time is the median of the recording, or of the last breaths
+when run live (DETECTOR).
+
+python3 asynchrony.py --directory models/csv_raw --jobs 4
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import os
+import time
+import argparse
+from collections import deque
+from multiprocessing import Pool
+from pathlib import Path
+import analysis
+
+LABELS = ("DoubleTrigger", "IneffectiveEffort", "MissedTrigger", "PrematureCycling")
+
+
+def segments(cycles):
+    """
+    Sample indices of every breath laid end to end
+
+    cycles (np.array): (breaths, 2) [start, end] indices
+
+    Returns:
+    idx, breath, offsets: sample index and breath number of every position,
+                          and where each breath starts in idx
+    """
+    lengths = np.maximum(cycles[:, 1] - cycles[:, 0], 1)
+    offsets = np.cumsum(lengths) - lengths
+    breath = np.repeat(np.arange(len(cycles)), lengths)
+    idx = np.arange(lengths.sum()) - offsets[breath] + cycles[breath, 0]
+    return idx, breath, offsets
+
+
+def first(mask, breath, count):
+    """ position of the first True of every breath in mask, -1 if none """
+    at = np.flatnonzero(mask)
+    if len(at) == 0:
+        return np.full(count, -1)
+    k = np.searchsorted(breath[at], np.arange(count))
+    k = np.minimum(k, len(at) - 1)
+    return np.where(breath[at[k]] == np.arange(count), at[k], -1)
+
+
+def detect(flow, cycles, rate=50, ti_ref=None, expire=5, effort=10,
+           settle=0.3, double=0.5, premature=0.5):
+    """
+    Asynchrony labels of every breath at once
+
+    flow (np.array): flow samples (L/min), same time base as the pressure
+    cycles (np.array): (breaths, 2) [start, end] from analysis.find_cycles
+    rate (float): samples per second
+    ti_ref (float): reference inspiratory time (s), None for the median
+    expire (float): flow (L/min) below -expire ends inspiration
+    effort (float): flow rise (L/min) during expiration counted as an effort
+    settle (float): seconds after peak expiratory flow before efforts count
+    double, premature (float): fractions of ti_ref for the two time rules
+
+    Returns:
+    dict: np.arrays per breath - Start, End (indices), Ti, Te (s), Effort
+          (L/min), Valid (inspiratory flow found) and one bool array per
+          name in LABELS, all False where not Valid
+    """
+    flow = np.asarray(flow, dtype=float)
+    cycles = np.asarray(cycles, dtype=int).reshape(-1, 2)
+    count = len(cycles)
+    result = {"Start": cycles[:, 0], "End": cycles[:, 1]}
+    if count == 0:
+        for key in ("Ti", "Te", "Effort"):
+            result[key] = np.empty(0)
+        for key in ("Valid",) + LABELS:
+            result[key] = np.zeros(0, dtype=bool)
+        return result
+    idx, breath, offsets = segments(cycles)
+    values = flow[np.minimum(idx, len(flow) - 1)]
+
+    # inspiration, first strongly positive flow of each breath
+    inspiration = first(values > expire, breath, count)
+    valid = inspiration >= 0
+    # end of inspiration, first strongly negative flow after it
+    after_in = np.arange(len(idx)) >= np.where(valid, inspiration, len(idx))[breath]
+    pos = first((values < -expire) & after_in, breath, count)
+    found = pos >= 0
+    expiration = np.where(found, idx[pos], cycles[:, 1])
+    ti = (expiration - cycles[:, 0]) / rate
+    te = (cycles[:, 1] - expiration) / rate
+    if ti_ref is None:
+        ti_ref = np.median(ti[found]) if np.any(found) else np.median(ti)
+
+    # ineffective effort: largest rise of expiratory flow that falls back,
+    # flow at a sample minus the lowest flow after it in the same breath
+    peak = np.minimum.reduceat(np.where(idx >= expiration[breath], values, np.inf),
+                               offsets)
+    pos = first((values == peak[breath]) & (idx >= expiration[breath]), breath, count)
+    start = np.where(pos >= 0, idx[pos], expiration) + int(round(settle * rate))
+    # flow reaching +expire is inspiration, not an effort, and efforts are
+    # only looked for before it; when the flow then falls below -expire
+    # again it was a breath the pressure did not trigger on, otherwise
+    # the next triggered breath starting a little early
+    pos = first((idx >= start[breath]) & (values > expire), breath, count)
+    limit = np.where(pos >= 0, idx[np.maximum(pos, 0)], cycles[:, 1])
+    missed = first((values < -expire) & (idx > limit[breath]), breath, count) >= 0
+    window = (idx >= start[breath]) & (idx < limit[breath])
+    capped = np.where(window, values, np.amax(values))
+    span = np.ptp(values) * 2 + 1
+    # shifting each breath below the next resets the running minimum
+    shifted = capped + breath * span
+    after = np.minimum.accumulate(shifted[::-1])[::-1] - breath * span
+    rise = np.where(window, values - after, 0)
+    result["Effort"] = np.maximum.reduceat(rise, offsets)
+
+    result["Ti"] = ti
+    result["Te"] = te
+    result["Valid"] = valid
+    result["DoubleTrigger"] = found & (te < double * ti_ref)
+    result["IneffectiveEffort"] = valid & (result["Effort"] > effort)
+    result["MissedTrigger"] = valid & missed
+    result["PrematureCycling"] = found & (ti < premature * ti_ref)
+    return result
+
+
+def labels(result, i):
+    """ names of the asynchronies found in breath i """
+    return [key for key in LABELS if result[key][i]]
+
+
+class DETECTOR:
+    """ per breath labels for the live path, reference Ti of recent breaths """
+
+    def __init__(self, rate=50, history=20, **options):
+        """
+        rate (float): samples per second
+        history (int): breaths in the running reference inspiratory time
+        options: detect() keyword arguments
+        """
+        self.rate = rate
+        self.ti = deque(maxlen=history)
+        self.options = options
+
+    def breath(self, flow, start, end):
+        """
+        Labels of one breath as soon as it has ended
+
+        flow (np.array): flow samples holding the breath
+        start, end (int): breath indices in flow
+
+        Returns:
+        list: names from LABELS
+        """
+        ti_ref = np.median(self.ti) if len(self.ti) else None
+        result = detect(flow, np.array([[start, end]]), self.rate, ti_ref,
+                        **self.options)
+        if result["Valid"][0] and result["Te"][0] > 0:
+            self.ti.append(result["Ti"][0])
+        return labels(result, 0)
+
+
+def load(filename):
+    """ [time, value] samples of a csv_raw file, empty if there are none """
+    if os.path.getsize(filename) == 0:
+        return np.empty((0, 2))
+    return np.loadtxt(filename, delimiter=',', ndmin=2)
+
+
+def recording(args):
+    """
+    Worker - label every breath of one pres/flow pair
+
+    args (tuple): (pressure filename, flow filename, threshold factor, rate)
+
+    Returns:
+    tuple: (pressure filename, breaths, count per label and of breaths
+           without inspiration (Invalid), seconds spent finding and
+           labelling the breaths, loading not included)
+    """
+    pres_file, flow_file, factor, rate = args
+    pressure = load(pres_file)
+    flow = load(flow_file)
+    count = min(len(pressure), len(flow))
+    if count == 0:
+        return pres_file, 0, {key: 0 for key in LABELS + ("Invalid",)}, 0
+    elapsed = time.perf_counter()
+    pressure = pressure[:count, 1]
+    threshold = analysis.trigger(pressure, factor, 5)
+    cycles = analysis.find_cycles(pressure, threshold)[0]
+    result = detect(flow[:count, 1], cycles, rate)
+    found = {key: int(np.sum(result[key])) for key in LABELS}
+    found["Invalid"] = int(np.sum(~result["Valid"]))
+    return pres_file, len(cycles), found, time.perf_counter() - elapsed
+
+
+def pairs(directory):
+    """ (pressure, flow) csv_raw files of the same recording """
+    found = []
+    for pres in sorted(Path(directory).glob("*-pres-*.csv")):
+        flow = pres.with_name(pres.name.replace("-pres-", "-flow-", 1))
+        if flow.exists():
+            found.append((str(pres), str(flow)))
+    return found
+
+
+def corpus(directory='./models/csv_raw', factor=1.25, rate=50, jobs=None):
+    """ label every recording in directory on all cores """
+    with Pool(jobs) as pool:
+        return pool.map(recording, [(pres, flow, factor, rate)
+                                    for pres, flow in pairs(directory)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Patient-ventilator asynchrony over pressure and flow recordings',
+        epilog='labels: ' + ", ".join(LABELS))
+    parser.add_argument('--directory', type=str, default='./models/csv_raw')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="worker processes, default one per core")
+    args = parser.parse_args()
+
+    elapsed = time.perf_counter()
+    results = corpus(args.directory, jobs=args.jobs)
+    elapsed = time.perf_counter() - elapsed
+
+    print("{:>4} {:>7} {:>7} {:>7} {:>7} {:>7} {:>7} {:>8}".format(
+        "file", "breaths", "invalid", "double", "effort", "missed", "early", "ms"))
+    total = 0
+    for name, breaths, found, seconds in results:
+        if breaths == 0:
+            continue
+        total += breaths
+        print("{:>4} {:>7} {:>7} {:>7} {:>7} {:>7} {:>7} {:>8.1f}".format(
+            os.path.basename(name).split("-")[0], breaths, found["Invalid"],
+            found["DoubleTrigger"], found["IneffectiveEffort"],
+            found["MissedTrigger"], found["PrematureCycling"], seconds * 1000))
+    print("{} recordings, {} breaths in {:1.2f}s on {} workers".format(
+        len(results), total, elapsed, args.jobs or os.cpu_count()))
+
+    # one breath at a time, as the live path would call it
+    for pres_file, flow_file in pairs(args.directory):
+        pressure, flow = load(pres_file), load(flow_file)
+        if len(pressure) and len(flow):
+            break
+    cycles = analysis.find_cycles(pressure[:, 1], analysis.trigger(pressure[:, 1], 1.25, 5))[0]
+    live = DETECTOR()
+    elapsed = time.perf_counter()
+    for start, end in cycles:
+        live.breath(flow[:, 1], start, end)
+    elapsed = time.perf_counter() - elapsed
+    print("live: {:1.1f} us per breath".format(elapsed / max(len(cycles), 1) * 1e6))
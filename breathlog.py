@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+"""
+Crash safe append-only log of per-breath stats (.vbl)
+
+Every breath is one fixed size record, so appending never rewrites what is
+already on disk and record i is always at the same offset.  Writes are
+flushed and fsync'ed in batches (every "batch" breaths or "interval"
+seconds) so a monitor can log every breath for days for a few syscalls a
+minute.  Each record carries a sequence number and a CRC32, and a reopened
+log is cut back to the last complete record, which is all that is lost
+when the process dies mid write.  A clean close appends a small footer
+index (Start time of every "stride"th record) that is stripped again when
+the log is reopened for appending.  READER memory maps the records as a
+numpy structured array and can refresh() while the log is still growing.
+
+Layout (little endian):
+    header  - magic "VBL1", version, record size, fields, field names
+    records - seq (uint32), crc32 (uint32), one float64 per field
+    footer  - [record, Start] float64 pairs, then magic "VBLF",
+              records, footer offset (only after a clean close)
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import struct
+import zlib
+import mmap
+import os
+import time
+import argparse
+
+MAGIC = b"VBL1"
+FOOTER_MAGIC = b"VBLF"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")      # magic, version, fields, record size
+NAMES = 256                           # bytes of comma separated field names
+TRAILER = struct.Struct("<4sQQ")      # magic, records, footer offset
+
+# MONITOR2.stats keys kept in the log, I:E is stored as the ratio
+FIELDS = ("Start", "End", "PEEP", "PEEPi", "Ppeak", "Pplat", "dP", "P01",
+          "PTP", "RR", "FlowI", "Ipause", "FlowE", "Epause", "I:E", "Vt", "Pl")
+
+
+def record_dtype(fields):
+    return np.dtype([("seq", "<u4"), ("crc", "<u4")] +
+                    [(name, "<f8") for name in fields])
+
+
+def header_size():
+    return HEADER.size + NAMES
+
+
+def read_header(fp):
+    """ fields and record dtype of an open log, None if not a log """
+    fp.seek(0)
+    raw = fp.read(header_size())
+    if len(raw) < header_size():
+        return None
+    magic, version, count, size = HEADER.unpack(raw[:HEADER.size])
+    if magic != MAGIC:
+        return None
+    fields = raw[HEADER.size:].rstrip(b"\0").decode().split(",")[:count]
+    dtype = record_dtype(fields)
+    if dtype.itemsize != size:
+        return None
+    return fields, dtype
+
+
+def valid(record):
+    """ CRC check of one record (np.void of record_dtype) """
+    raw = record.tobytes()
+    return zlib.crc32(raw[8:], int(record["seq"])) & 0xffffffff == record["crc"]
+
+
+def value_of(stats, key):
+    """ stats value as float, I:E text '1:0.5' becomes 0.5 """
+    value = stats.get(key, np.nan)
+    if isinstance(value, str):
+        try:
+            value = float(value.split(":")[-1])
+        except ValueError:
+            value = np.nan
+    return float(value)
+
+
+class WRITER:
+
+    def __init__(self, filename, fields=FIELDS, batch=50, interval=10, stride=64):
+        """
+        filename (str): log file, appended to (after recovery) if it exists
+        fields (list): stats keys stored in each record
+        batch (int): records between fsyncs
+        interval (float): most seconds between fsyncs
+        stride (int): records per footer index entry
+        """
+        self.filename = filename
+        self.batch = batch
+        self.interval = interval
+        self.stride = stride
+        self.pending = 0
+        self.synced = time.monotonic()
+        self.syncs = 0
+        self.recovered = 0  # bytes cut off a damaged tail on open
+
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self.fp = open(filename, "r+b" if exists else "w+b")
+        header = read_header(self.fp) if exists else None
+        if header is None:
+            if exists:
+                raise IOError("{} is not a breath log".format(filename))
+            self.fields = list(fields)
+            self.dtype = record_dtype(self.fields)
+            names = ",".join(self.fields).encode()
+            if len(names) > NAMES:
+                raise ValueError("field names longer than {} bytes".format(NAMES))
+            self.fp.write(HEADER.pack(MAGIC, VERSION, len(self.fields),
+                                      self.dtype.itemsize))
+            self.fp.write(names.ljust(NAMES, b"\0"))
+            self.records = 0
+            self.sync()
+        else:
+            self.fields, self.dtype = header
+            self.records = recover(self.fp, self.dtype)
+            end = header_size() + self.records * self.dtype.itemsize
+            self.recovered = os.fstat(self.fp.fileno()).st_size - end
+            self.fp.truncate(end)  # drop footer or partial record
+            self.sync()
+        self.fp.seek(0, os.SEEK_END)
+        self.record = np.zeros(1, dtype=self.dtype)
+
+    def append(self, stats):
+        """ write one breath, fsync when the batch is full or old """
+        record = self.record
+        for key in self.fields:
+            record[key] = value_of(stats, key)
+        record["seq"] = self.records & 0xffffffff
+        raw = record.tobytes()
+        record["crc"] = zlib.crc32(raw[8:], int(record["seq"][0])) & 0xffffffff
+        self.fp.write(record.tobytes())
+        self.records += 1
+        self.pending += 1
+        if self.pending >= self.batch or time.monotonic() - self.synced > self.interval:
+            self.sync()
+
+    def sync(self):
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.pending = 0
+        self.synced = time.monotonic()
+        self.syncs += 1
+
+    def close(self):
+        """ sync and append the footer index """
+        self.sync()
+        offset = self.fp.tell()
+        if self.records:
+            starts = READER.map_records(self.fp, self.dtype, self.records)["Start"]
+            rows = np.arange(0, self.records, self.stride)
+            index = np.column_stack((rows, starts[rows])).astype("<f8")
+            self.fp.write(index.tobytes())
+        self.fp.write(TRAILER.pack(FOOTER_MAGIC, self.records, offset))
+        self.sync()
+        self.fp.close()
+
+
+def recover(fp, dtype):
+    """
+    Number of complete records in an open log
+
+    A clean footer is trusted, otherwise the tail is checked backwards
+    until a record with the right sequence number and CRC is found.
+    """
+    size = os.fstat(fp.fileno()).st_size
+    body = size - header_size()
+    if body >= TRAILER.size:
+        fp.seek(size - TRAILER.size)
+        magic, records, offset = TRAILER.unpack(fp.read(TRAILER.size))
+        if magic == FOOTER_MAGIC and offset == header_size() + records * dtype.itemsize:
+            return records
+    records = max(body, 0) // dtype.itemsize
+    while records > 0:
+        fp.seek(header_size() + (records - 1) * dtype.itemsize)
+        record = np.frombuffer(fp.read(dtype.itemsize), dtype=dtype)[0]
+        if record["seq"] == (records - 1) & 0xffffffff and valid(record):
+            break
+        records -= 1
+    return records
+
+
+class READER:
+
+    def __init__(self, filename):
+        """ memory map a log, it may still be being written """
+        self.filename = filename
+        self.fp = open(filename, "rb")
+        header = read_header(self.fp)
+        if header is None:
+            raise IOError("{} is not a breath log".format(filename))
+        self.fields, self.dtype = header
+        self.index = None
+        self.refresh()
+
+    @staticmethod
+    def map_records(fp, dtype, records):
+        """ records of an open log as a read-only structured array """
+        if records == 0:
+            return np.zeros(0, dtype=dtype)
+        mm = mmap.mmap(fp.fileno(), header_size() + records * dtype.itemsize,
+                       access=mmap.ACCESS_READ)
+        return np.frombuffer(mm, dtype=dtype, count=records, offset=header_size())
+
+    def refresh(self):
+        """ pick up records appended since the last refresh """
+        size = os.fstat(self.fp.fileno()).st_size
+        self.fp.seek(max(size - TRAILER.size, 0))
+        magic, records, offset = TRAILER.unpack(self.fp.read(TRAILER.size).rjust(
+            TRAILER.size, b"\0"))
+        closed = magic == FOOTER_MAGIC and \
+            offset == header_size() + records * self.dtype.itemsize
+        if not closed:
+            # still being written, the last record may be half written
+            records = max(size - header_size(), 0) // self.dtype.itemsize
+            while records > 0:
+                self.fp.seek(header_size() + (records - 1) * self.dtype.itemsize)
+                if valid(np.frombuffer(self.fp.read(self.dtype.itemsize),
+                                       dtype=self.dtype)[0]):
+                    break
+                records -= 1
+        self.records = self.map_records(self.fp, self.dtype, records)
+        if closed and records:
+            self.fp.seek(offset)
+            entries = (size - TRAILER.size - offset) // 16
+            self.index = np.frombuffer(self.fp.read(entries * 16),
+                                       dtype="<f8").reshape(-1, 2)
+        return len(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def column(self, key):
+        return self.records[key]
+
+    def find(self, start):
+        """ record of the breath starting at or after start seconds """
+        if self.index is not None and len(self.index):
+            # footer narrows the search to one stride
+            k = max(np.searchsorted(self.index[:, 1], start, side='right') - 1, 0)
+            first = int(self.index[k, 0])
+            last = int(self.index[k + 1, 0]) + 1 if k + 1 < len(self.index) else len(self.records)
+            return first + int(np.searchsorted(self.records["Start"][first:last], start))
+        return int(np.searchsorted(self.records["Start"], start))
+
+    def stats(self, i):
+        """ record i as a stats dictionary """
+        record = self.records[i]
+        return {key: float(record[key]) for key in self.fields}
+
+    def close(self):
+        self.records = None
+        self.fp.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Append-only per-breath stats log, write speed and recovery test')
+    parser.add_argument('--file', type=str, default='/tmp/breaths.vbl')
+    parser.add_argument('--breaths', type=int, default=200000,
+                        help="breaths to write, 200000 is ~4 days at 30 bpm")
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    if os.path.exists(args.file):
+        os.remove(args.file)
+    stats = {"PEEP": 5, "PEEPi": 0.2, "Ppeak": 31, "Pplat": 24, "dP": 19,
+             "P01": 16, "PTP": 24, "RR": 30, "I:E": "1:0.5"}
+    log = WRITER(args.file, batch=args.batch)
+    elapsed = time.perf_counter()
+    for i in range(args.breaths):
+        stats["Start"] = i * 2.0
+        stats["End"] = i * 2.0 + 2
+        log.append(stats)
+    elapsed = time.perf_counter() - elapsed
+    log.close()
+    print("{} breaths in {:1.2f}s ({:1.1f} us/breath), {} fsyncs, {:1.1f} MB".format(
+        args.breaths, elapsed, elapsed / args.breaths * 1e6, log.syncs,
+        os.path.getsize(args.file) / 1e6))
+
+    reader = READER(args.file)
+    elapsed = time.perf_counter()
+    i = reader.find(args.breaths)
+    print("mapped {} records, breath at {}s is #{} ({:1.3f} ms), mean Ppeak {:1.1f}".format(
+        len(reader), args.breaths, i, (time.perf_counter() - elapsed) * 1000,
+        reader.column("Ppeak").mean()))
+    reader.close()
+
+    # crash: half a record written after the footer was stripped
+    log = WRITER(args.file)
+    log.append(stats)
+    log.sync()
+    log.fp.write(b"\x01" * (log.dtype.itemsize // 2))
+    log.fp.flush()
+    reader = READER(args.file)
+    print("while writing: reader sees {} records".format(len(reader)))
+    reader.close()
+    log.fp.close()  # die without close()
+    log = WRITER(args.file)
+    print("recovered to {} records, {} bytes of partial record dropped".format(
+        log.records, log.recovered))
+    log.close()
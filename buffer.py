@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+"""
+Growable sample buffer backed by a preallocated numpy array
+
+The monitors used to keep samples as a list of [time, value] lists, about
+130 bytes per sample in Python objects, and converted the whole list with
+np.array() before every analysis step.  SAMPLES stores the rows in one
+float64 array (16 bytes per sample), doubles the allocation when it fills
+so appends stay amortized O(1), and view() hands out the filled rows
+without copying.  It still indexes like the old list, data[i][0] is the
+time of sample i and data[-1] the last row.
+
+The buffer also carries the sample rate when it is known (rate, samples
+per second, None when the timestamps are irregular).  before() and
+nearest() turn a time into a sample index, with plain arithmetic on a
+known rate and a searchsorted on the timestamps otherwise.  resample()
+puts samples with jitter or gaps onto a uniform grid so the rate holds.
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import time
+import tracemalloc
+
+
+class SAMPLES:
+
+    def __init__(self, capacity=1024, columns=2, rate=None):
+        """
+        capacity (int): rows allocated up front, grows by doubling
+        columns (int): values per sample, [time, value] by default
+        rate (float): samples per second on a uniform time base, None if
+                      the timestamps are irregular or not known
+        """
+        self.buf = np.empty((max(capacity, 1), columns))
+        self.n = 0
+        self.rate = rate
+        self.version = 0  # bumped on every change, cache key for derived data
+
+    @classmethod
+    def wrap(cls, rows, rate=None):
+        """ buffer holding a copy of existing rows (list or np.array) """
+        rows = np.asarray(rows, dtype=float)
+        if rows.size == 0:
+            return cls(rate=rate)
+        buffer = cls(len(rows), rows.shape[1], rate)
+        buffer.extend(rows)
+        return buffer
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        return self.buf[:self.n][key]
+
+    def __iter__(self):
+        return iter(self.buf[:self.n])
+
+    def __array__(self, dtype=None, copy=None):
+        return self.view() if dtype is None else self.view().astype(dtype)
+
+    @property
+    def capacity(self):
+        return len(self.buf)
+
+    def view(self):
+        """ filled rows as an np.array, no copy - valid until the next append """
+        return self.buf[:self.n]
+
+    def grow(self, rows):
+        """ make room for at least rows samples """
+        if rows > len(self.buf):
+            size = len(self.buf)
+            while size < rows:
+                size *= 2
+            buf = np.empty((size, self.buf.shape[1]))
+            buf[:self.n] = self.buf[:self.n]
+            self.buf = buf
+
+    def append(self, point):
+        """ add one [time, value] sample """
+        if self.n == len(self.buf):
+            self.grow(self.n + 1)
+        self.buf[self.n] = point
+        self.n += 1
+        self.version += 1
+
+    def extend(self, rows):
+        """ add many samples at once """
+        rows = np.asarray(rows, dtype=float)
+        self.grow(self.n + len(rows))
+        self.buf[self.n:self.n + len(rows)] = rows
+        self.n += len(rows)
+        self.version += 1
+
+    def keep(self, rows):
+        """ drop all but the last rows samples, in place """
+        rows = min(rows, self.n)
+        self.buf[:rows] = self.buf[self.n - rows:self.n]
+        self.n = rows
+        self.version += 1
+
+    def clear(self):
+        self.n = 0
+        self.version += 1
+
+    def nbytes(self):
+        return self.buf.nbytes
+
+
+def rate_of(data):
+    """ sample rate carried by data, None for plain arrays and lists """
+    return getattr(data, 'rate', None)
+
+
+def before(times, t, rate=None):
+    """
+    Index of the last sample at or before time t
+
+    times (np.array): sample times, ascending
+    rate (float): samples per second if times is a uniform grid, the index
+                  is then computed directly instead of searched
+    """
+    if rate:
+        i = int(np.floor((t - times[0]) * rate + 1e-6))
+    else:
+        i = int(np.searchsorted(times, t, side='right')) - 1
+    return min(max(i, 0), len(times) - 1)
+
+
+def nearest(times, t, rate=None):
+    """ index of the sample closest to time t, see before() """
+    if rate:
+        i = int(round((t - times[0]) * rate))
+    else:
+        i = int(np.searchsorted(times, t))
+        if 0 < i < len(times) and t - times[i - 1] <= times[i] - t:
+            i -= 1
+    return min(max(i, 0), len(times) - 1)
+
+
+def resample(rows, rate, gap=None):
+    """
+    Samples moved onto a uniform time grid
+
+    rows (np.array): [time, value, ...] rows with jitter or missing samples
+    rate (float): samples per second of the grid
+    gap (float): seconds, grid points inside a longer gap between samples
+                 are set to nan instead of being interpolated across
+
+    Returns:
+    SAMPLES: grid from the first sample time on, every column linearly
+             interpolated, rate set
+    """
+    rows = np.asarray(rows, dtype=float)
+    if len(rows) == 0:
+        return SAMPLES(rate=rate)
+    t = rows[:, 0]
+    count = int(np.floor((t[-1] - t[0]) * rate + 1e-6)) + 1
+    grid = t[0] + np.arange(count) / rate
+    out = np.empty((count, rows.shape[1]))
+    out[:, 0] = grid
+    for column in range(1, rows.shape[1]):
+        out[:, column] = np.interp(grid, t, rows[:, column])
+    if gap is not None and len(t) > 1:
+        # grid points between two samples further apart than gap
+        k = np.clip(np.searchsorted(t, grid), 1, len(t) - 1)
+        inside = (t[k] - t[k - 1] > gap) & (grid > t[k - 1]) & (grid < t[k])
+        out[inside, 1:] = np.nan
+    return SAMPLES.wrap(out, rate)
+
+
+def as_samples(data):
+    """ a SAMPLES buffer (or np.array) for data, lists are converted once """
+    if isinstance(data, (SAMPLES, np.ndarray)):
+        return data
+    return SAMPLES.wrap(data)
+
+
+def as_array(data):
+    """ samples as an np.array, without a copy unless data is a list """
+    if isinstance(data, SAMPLES):
+        return data.view()
+    return np.asarray(data, dtype=float)
+
+
+if __name__ == "__main__":
+
+    # one hour of 50 Hz samples
+    count = 50 * 3600
+    t = np.arange(count) * 0.02
+    p = 5 + 20 * (np.sin(2 * np.pi * t / 3) > 0.3)
+
+    tracemalloc.start()
+    elapsed = time.perf_counter()
+    rows = []
+    for i in range(count):
+        rows.append([float(t[i]), float(p[i])])
+    list_time = time.perf_counter() - elapsed
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    elapsed = time.perf_counter()
+    np.array(rows)
+    convert = time.perf_counter() - elapsed
+    del rows
+
+    tracemalloc.start()
+    elapsed = time.perf_counter()
+    data = SAMPLES()
+    for i in range(count):
+        data.append((t[i], p[i]))
+    buffer_time = time.perf_counter() - elapsed
+    buffer_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    elapsed = time.perf_counter()
+    data.view()
+    view = time.perf_counter() - elapsed
+
+    print("{} samples".format(count))
+    print("list of lists: {:6.1f} bytes/sample, append {:1.2f}s, np.array {:1.1f} ms".format(
+        list_bytes / count, list_time, convert * 1000))
+    print("SAMPLES:       {:6.1f} bytes/sample, append {:1.2f}s, view {:1.3f} ms".format(
+        buffer_bytes / count, buffer_time, view * 1000))
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+"""
+Out-of-core analysis of long recordings in fixed size chunks
+
+MONITOR2.compute needs the whole window in memory and find_cycles drops
+the breath that straddles the end of the window.  CHUNKED streams the file
+through analysis.ANALYSIS.run, which reads a chunk at a time, carries the
+find_cycles state and the samples of any unfinished breath over to the
+next chunk, and runs contours on each breath once it is complete.  Memory is one chunk plus one breath no matter how
+long the recording is, and with the same threshold the stats are the same
+as analyzing the whole file at once.
+
+python3 chunked.py models/csv_raw/<pressure file>.csv
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import time
+import argparse
+import analysis
+
+
+class CHUNKED:
+
+    chunk = 5000  # samples read per chunk
+    span = (-100, 200)  # cm H2O covered by the trigger() percentile histogram
+    resolution = 0.01   # histogram step, the csv_raw precision
+    core = ''
+
+    def __init__(self, model_file='', threshold=10, chunk=5000, rate=50):
+        """
+        model_file (str): csv_raw pressure file
+        threshold (float): trigger level, must be fixed for the whole file
+        chunk (int): samples read per chunk
+        rate (float): samples per second of csv_raw files
+        """
+        self.source = analysis.REPLAY(model_file, rate=rate)
+        self.core = analysis.ANALYSIS(self.source, 'monitor2', threshold)
+        self.chunk = chunk
+
+    @property
+    def threshold(self):
+        return self.core.threshold
+
+    def read_chunk(self):
+        """ next chunk of [time, value] samples, shorter at end of file """
+        return self.source.read(self.chunk)
+
+    def trigger(self, factor=1.25, percentile=0):
+        """
+        Pre-pass over the file for the MONITOR2.compute threshold rule
+        (analysis.trigger), sets and returns the threshold
+
+        Memory stays one chunk: the lowest sample is kept chunk by chunk and
+        a percentile comes from a fixed histogram of span cm H2O in steps of
+        resolution, exact for csv_raw values (two decimals) inside the span.
+        """
+        low, high = self.span
+        bins = int(round((high - low) / self.resolution)) + 1
+        counts = np.zeros(bins, dtype=np.int64)
+        lowest = np.inf
+        while True:
+            rows = self.read_chunk()
+            if len(rows) > 0:
+                pressure = rows[:, 1]
+                lowest = min(lowest, np.amin(pressure))
+                if percentile:
+                    at = np.round((pressure - low) / self.resolution).astype(np.int64)
+                    counts += np.bincount(np.clip(at, 0, bins - 1), minlength=bins)
+            if len(rows) < self.chunk:
+                break
+        self.source.rewind()
+        if lowest == np.inf:
+            threshold = 0
+        elif percentile:
+            # order statistics either side of the rank, interpolated as
+            # np.percentile does
+            rank = (counts.sum() - 1) * percentile / 100
+            below = int(np.floor(rank))
+            found = np.searchsorted(np.cumsum(counts), [below, below + 1], 'right')
+            found = np.minimum(found, bins - 1)
+            # rounded to the step so a value reads back as the csv float
+            digits = max(int(round(-np.log10(self.resolution))), 0)
+            a, b = np.round(low + found * self.resolution, digits)
+            threshold = analysis.trigger(a + (b - a) * (rank - below), factor)
+        else:
+            threshold = analysis.trigger(lowest, factor)
+        self.core.threshold = threshold
+        return threshold
+
+    def run(self, callback=None):
+        """
+        Analyze the whole file chunk by chunk with ANALYSIS.run
+
+        callback (function): called with each stats dictionary as breaths
+                             complete, stats are also kept in cycle_stats
+
+        Returns:
+        list: stats dictionary of every breath, same as MONITOR2.cycle_stats,
+              the sample index each starts at is in core.cycle_start
+        """
+        return self.core.run(chunk=self.chunk, callback=callback)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Analyze a csv_raw pressure file in fixed size chunks',
+        epilog='Memory use does not grow with the recording length')
+    parser.add_argument('file', type=str, help="Input Filename with path")
+    parser.add_argument('--threshold', type=float, default=0,
+                        help="trigger level for breath cycles, 0 estimates it "
+                             "from PEEP in a pre-pass")
+    parser.add_argument('--percentile', type=float, default=0,
+                        help="PEEP floor percentile of the estimate, 0 for the "
+                             "lowest sample as compute()")
+    parser.add_argument('--chunk', type=int, default=5000,
+                        help="samples per chunk")
+    args = parser.parse_args()
+
+    analyzer = CHUNKED(args.file, threshold=args.threshold, chunk=args.chunk)
+    if args.threshold == 0:
+        elapsed = time.perf_counter()
+        analyzer.trigger(percentile=args.percentile)
+        print("pre-pass: threshold {:1.2f} in {:1.2f}s".format(
+            analyzer.threshold, time.perf_counter() - elapsed))
+    elapsed = time.perf_counter()
+    stats = analyzer.run()
+    elapsed = time.perf_counter() - elapsed
+    print("{} breaths in {:1.2f}s".format(len(stats), elapsed))
@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+"""
+Labelled synthetic corpus of pressure recordings, built in parallel
+
+Each shard is a .vpa archive (archive.WRITER, channel 'press') and a csv of
+labels with one row per breath: Start, End (s from the start of the
+shard), Source, Ppeak, Pplat and PEEP.  A shard is made of blocks of
+"block" seconds, each block either
+
+    Source 0 - model.BREATH.synthesize() on one of the two templates with
+               bpm, peak and PEEP drawn per breath, the labels are the
+               exact synthesized values and Pplat is the template value at
+               the start of its expiratory fall, scaled like the breath
+    Source 1 - a run of consecutive real breaths cut with find_cycles from a
+               csv_raw recording resampled to the corpus rate, the breath
+               boundaries are exact and the pressures are the MONITOR2
+               contours of the donor recording; breaths shorter than 1 s
+               or that contours could not analyze end a run
+
+so the corpus mixes perfectly known waveforms with real ones.  Blocks are
+written as they are made, memory stays about one block whatever the shard
+size, and shards are independent so they run on a Pool.  Every shard draws
+from its own child of one numpy SeedSequence: the same seed gives the same
+corpus for any number of workers.
+
+python3 corpus.py --output corpus --shards 8 --minutes 60 --jobs 4
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import io
+import os
+import time
+import contextlib
+import warnings
+import argparse
+from multiprocessing import Pool
+from pathlib import Path
+import model
+import archive
+import buffer
+import analysis
+import asynchrony
+import artifacts
+
+TEMPLATES = ("./models/b30-peep0-20s-lowpeak.csv", "./models/b40-peep0-30s.csv")
+COLUMNS = ("Start", "End", "Source", "Ppeak", "Pplat", "PEEP")
+
+donors = {}  # per process cache of csv_raw breaths, see donor()
+
+
+def plateau(template, factor=10):
+    """
+    Plateau of a template as a fraction of its peak above the floor
+
+    The expiratory fall is the last run of samples falling faster than
+    1/factor of the steepest fall, the plateau is the value where it starts.
+    """
+    times, values = template[:, 0], template[:, 1]
+    slope = np.diff(values) / np.diff(times)
+    steep = slope < np.amin(slope) / factor
+    j = np.flatnonzero(steep)[-1]
+    while j > 0 and steep[j - 1]:
+        j -= 1
+    floor = np.amin(values)
+    return (values[j] - floor) / (np.amax(values) - floor)
+
+
+def donor(filename, rate=50, factor=1.25, shortest=1.0):
+    """
+    Breaths of a csv_raw pressure file with their contours, cached
+
+    The recording is resampled to rate first, so labels and samples share
+    the time base of the archive being written.
+
+    rate (float): samples per second of the corpus
+    shortest (float): seconds, shorter breaths (over 60 bpm) are glitches
+                      across the threshold and not usable
+
+    Returns:
+    pressure, cycles, labels, usable: samples, (breaths, 2) [start, end]
+                                      indices, (breaths, 3) Ppeak, Pplat,
+                                      PEEP and whether each breath is long
+                                      enough and was analyzed by contours
+    """
+    key = (filename, rate)
+    if key not in donors:
+        pressure = buffer.resample(asynchrony.load(filename), rate).view()
+        threshold = analysis.trigger(pressure[:, 1], factor, 5) if len(pressure) else 0
+        core = analysis.ANALYSIS(None, 'monitor2', threshold)
+        core.data.extend(pressure)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # degenerate breaths of the recording
+            stats = core.compute()
+        cycles = analysis.find_cycles(pressure[:, 1], threshold)[0] if len(pressure) \
+            else np.empty((0, 2), dtype=int)
+        found = {item["Start"]: item for item in stats}
+        labels = np.full((len(cycles), 3), np.nan)
+        for i, (start, end) in enumerate(cycles):
+            item = found.get(round(pressure[start, 0], 2))
+            if item is not None:
+                labels[i] = [item["Ppeak"], item["Pplat"], item["PEEP"]]
+        usable = np.all(np.isfinite(labels), axis=1) & \
+            (cycles[:, 1] - cycles[:, 0] >= shortest * rate)
+        donors[key] = (pressure[:, 1], cycles, labels, usable)
+    return donors[key]
+
+
+def synthetic(rng, seconds, rate, random):
+    """
+    Source 0 block, whole breaths of a randomly chosen and scaled template
+
+    Returns:
+    values, labels: pressure samples and (breaths, 6) rows of COLUMNS
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        br = model.BREATH(TEMPLATES[rng.integers(len(TEMPLATES))])
+    bpm, peak, peep = rng.uniform(12, 30), rng.uniform(25, 40), rng.uniform(4, 12)
+    data, breaths = br.synthesize(seconds, rate, random, int(rng.integers(2 ** 32)),
+                                  bpm, peak, peep)
+    whole = breaths["End"] <= seconds
+    if not np.any(whole):
+        whole[0] = True
+    end = breaths["End"][whole][-1]
+    count = int(np.ceil(end * rate - 1e-9))  # samples up to the last whole breath
+    ppeak, peeps = breaths["Ppeak"][whole], breaths["PEEP"][whole]
+    labels = np.column_stack((breaths["Start"][whole], breaths["End"][whole],
+                              np.zeros(len(ppeak)), ppeak,
+                              peeps + plateau(br.template) * (ppeak - peeps), peeps))
+    return data[:count, 1], labels
+
+
+def spliced(rng, seconds, rate, files):
+    """
+    Source 1 block, consecutive usable breaths of a random csv_raw recording
+
+    The run starts on a random usable breath and stops before the first
+    breath that is not usable (see donor()) or that would overrun the block.
+
+    Returns:
+    values, labels: pressure samples and (breaths, 6) rows of COLUMNS, or
+                    None when the recording has no usable breath
+    """
+    pressure, cycles, labels, usable = donor(files[rng.integers(len(files))], rate)
+    good = np.flatnonzero(usable)
+    if len(good) == 0:
+        return None
+    first = int(good[rng.integers(len(good))])
+    bad = np.flatnonzero(~usable[first:])
+    stop = first + (int(bad[0]) if len(bad) else len(cycles) - first)
+    # as many breaths as fit in the block, one at least
+    lengths = cycles[first:stop, 1] - cycles[first:stop, 0]
+    last = first + max(int(np.sum(np.cumsum(lengths) <= seconds * rate)), 1)
+    start = cycles[first, 0]
+    rows = np.column_stack(((cycles[first:last] - start) / rate,
+                            np.ones(last - first), labels[first:last]))
+    return pressure[start:cycles[last - 1, 1]], rows
+
+
+def shard(args):
+    """
+    Worker - write one shard
+
+    args (tuple): (archive filename, seconds, SeedSequence, options dict)
+
+    Returns:
+    tuple: (archive filename, samples, breaths, seconds spent)
+    """
+    filename, seconds, seed, options = args
+    elapsed = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    rate = options["rate"]
+    files = [pres for pres, flow in asynchrony.pairs(options["directory"])
+             if os.path.getsize(pres) > 0]
+    noise = None
+    if options["noise"]:
+        noise = artifacts.ARTIFACTS(rate, noise=options["noise"],
+                                    seed=int(rng.integers(2 ** 32)))
+    writer = archive.WRITER(filename, ['press'], rate)
+    labels = []
+    done = 0  # samples written
+    while done < seconds * rate:
+        block = min(options["block"], seconds - done / rate)
+        made = None
+        if files and rng.random() < options["real"]:
+            made = spliced(rng, block, rate, files)
+        if made is None:
+            made = synthetic(rng, block, rate, options["random"])
+        values, rows = made
+        if noise is not None:
+            values = noise.apply(np.column_stack((np.arange(len(values)) / rate,
+                                                  values)))[:, 1]
+        writer.append(values.reshape(-1, 1))
+        rows[:, :2] += done / rate
+        labels.append(rows)
+        done += len(values)
+    with contextlib.redirect_stdout(io.StringIO()):
+        writer.close()
+    labels = np.concatenate(labels) if labels else np.empty((0, len(COLUMNS)))
+    np.savetxt(label_file(filename), labels, delimiter=',', fmt='%.4f',
+               header=",".join(COLUMNS), comments='')
+    return filename, done, len(labels), time.perf_counter() - elapsed
+
+
+def label_file(filename):
+    """ labels csv next to a shard archive """
+    return str(Path(filename).with_suffix('.csv'))
+
+
+def build(output='corpus', shards=4, minutes=60, seed=0, jobs=None, rate=50,
+          block=300, real=0.5, random=[10, 10, 10], noise=0,
+          directory='./models/csv_raw'):
+    """
+    Write shards corpus-<n>.vpa and corpus-<n>.csv into output
+
+    minutes (float): length of each shard
+    block (float): seconds per template or spliced block
+    real (float): fraction of blocks spliced from the recordings
+    random: [bpm, peak, peep] percent variation between synthesized breaths
+    noise (float): gaussian noise added after labelling, cmH2O
+
+    Returns:
+    list: (archive filename, samples, breaths, seconds) per shard
+    """
+    Path(output).mkdir(parents=True, exist_ok=True)
+    options = dict(rate=rate, block=block, real=real, random=random,
+                   noise=noise, directory=directory)
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    work = [(str(Path(output) / "corpus-{}.vpa".format(n)), minutes * 60, seeds[n], options)
+            for n in range(shards)]
+    with Pool(jobs) as pool:
+        return pool.map(shard, work)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Parallel labelled corpus of template and spliced real breaths',
+        epilog='shards are .vpa archives with a csv of labels each')
+    parser.add_argument('--output', type=str, default='corpus')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--minutes', type=float, default=60, help="per shard")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="worker processes, default one per core")
+    parser.add_argument('--real', type=float, default=0.5,
+                        help="fraction of blocks spliced from csv_raw")
+    parser.add_argument('--noise', type=float, default=0)
+    parser.add_argument('--rate', type=float, default=50)
+    parser.add_argument('--directory', type=str, default='./models/csv_raw')
+    args = parser.parse_args()
+
+    elapsed = time.perf_counter()
+    results = build(args.output, args.shards, args.minutes, args.seed, args.jobs,
+                    args.rate, real=args.real, noise=args.noise, directory=args.directory)
+    elapsed = time.perf_counter() - elapsed
+    samples = sum(item[1] for item in results)
+    size = sum(os.path.getsize(item[0]) + os.path.getsize(label_file(item[0]))
+               for item in results)
+    print("{} shards, {} samples ({:1.1f} h), {} breaths, {:1.1f} MB in {:1.1f}s "
+          "({:1.2f} M samples/s) on {} workers".format(
+              len(results), samples, samples / args.rate / 3600,
+              sum(item[2] for item in results), size / 1e6, elapsed,
+              samples / elapsed / 1e6, args.jobs or os.cpu_count()))
+
+    # synthesized labels against the first shard read back
+    vpa = archive.ARCHIVE(results[0][0])
+    pressure = vpa.read()[:, 0]
+    labels = np.loadtxt(label_file(results[0][0]), delimiter=',', skiprows=1, ndmin=2)
+    bounds = np.round(labels[:, :2] * vpa.rate).astype(int)
+    template = labels[:, 2] == 0
+    peak = np.array([np.amax(pressure[s:max(e, s + 1)]) for s, e in bounds[template]])
+    floor = np.array([np.amin(pressure[s:max(e, s + 1)]) for s, e in bounds[template]])
+    if len(peak):
+        print("{}: {} breaths, {} synthesized, median |Ppeak error| {:1.3f}, "
+              "|PEEP error| {:1.3f} cmH2O".format(
+                  Path(results[0][0]).name, len(labels), len(peak),
+                  np.median(np.abs(peak - labels[template, 3])),
+                  np.median(np.abs(floor - labels[template, 5]))))
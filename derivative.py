@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+"""
+Vectorized smoothed derivative of a sampled waveform
+
+The contours methods find inhalation and exhalation by looking for where
+the slope flattens to a fraction of its peak.  A raw first difference is
+noisy enough that single samples cross that fraction early, so the slope
+can optionally be smoothed with a moving average or computed directly as a
+Savitzky-Golay derivative (a local quadratic fit).
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import time
+
+
+def savgol_coeffs(window=7, order=2, deriv=1):
+    """
+    Savitzky-Golay filter coefficients (no scipy needed)
+
+    window (int): odd number of samples in the fit
+    order (int): polynomial order of the fit
+    deriv (int): derivative order, 0 smooths the signal itself
+
+    Returns:
+    np.array: coefficients to correlate with the samples, multiply by
+              1/dt**deriv for the derivative in units per second
+    """
+    half = window // 2
+    x = np.arange(-half, half + 1, dtype=float)
+    vander = np.vander(x, order + 1, increasing=True)
+    # row deriv of the pseudo inverse is the fitted coefficient for x**deriv
+    coeffs = np.linalg.pinv(vander)[deriv]
+    return coeffs * np.prod(np.arange(1, deriv + 1))
+
+
+def slope(t, y, smooth=None, window=7, order=2):
+    """
+    Slope dy/dt of every sample
+
+    t, y (np.array): sample times (s) and values
+    smooth (str): None for the raw difference, 'ma' for a moving average of
+                  it or 'savgol' for a Savitzky-Golay derivative
+    window (int): samples in the smoothing window (odd for savgol)
+    order (int): polynomial order for savgol
+
+    Returns:
+    np.array: same length as y, the first sample takes the slope of the
+              second rather than a slope measured from time 0
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    diff = np.zeros(n)
+    if n < 2:
+        return diff
+
+    if smooth == 'savgol' and n >= window:
+        coeffs = savgol_coeffs(window, order, 1)
+        half = window // 2
+        padded = np.pad(y, half, mode='edge')
+        # sample spacing across each window, time is extended linearly past
+        # the ends so the result only depends on neighbouring samples
+        tpad = np.pad(t, half, mode='reflect', reflect_type='odd')
+        dt = (tpad[window - 1:] - tpad[:n]) / (window - 1)
+        return np.correlate(padded, coeffs, mode='valid') / dt
+
+    diff[1:] = np.diff(y) / np.diff(t)
+    diff[0] = diff[1]
+    if smooth == 'ma' and window > 1 and n >= window:
+        half = window // 2
+        padded = np.pad(diff, (half, window - 1 - half), mode='edge')
+        diff = np.convolve(padded, np.ones(window) / window, mode='valid')
+    return diff
+
+
+class DERIVATIVE:
+    """
+    Slope of a buffer computed once and shared by every consumer
+
+    The cache is keyed on the buffer, its length and its version (see
+    buffer.SAMPLES), so appending samples, refilling the buffer or swapping
+    it recomputes on the next request.
+    """
+
+    smooth = None
+    window = 7
+    order = 2
+
+    def __init__(self, smooth=None, window=7, order=2):
+        self.smooth = smooth
+        self.window = window
+        self.order = order
+        self.key = None
+        self.buffer = None
+        self.diff = np.empty(0)
+
+    def get(self, buffer, datanp=None):
+        """
+        buffer: sample buffer ([time, value] rows) used as the cache key
+        datanp (np.array): the buffer already as an array, if available
+
+        Returns:
+        np.array: slope of every sample in buffer
+        """
+        key = (len(buffer), getattr(buffer, 'version', None), self.smooth,
+               self.window, self.order)
+        # hold on to the buffer itself, an id() could be reused once freed
+        if buffer is not self.buffer or key != self.key:
+            if datanp is None:
+                datanp = np.array(buffer)
+            self.diff = slope(datanp[:, 0], datanp[:, 1], self.smooth,
+                              self.window, self.order)
+            self.buffer = buffer
+            self.key = key
+        return self.diff
+
+
+class SLOPE:
+    """
+    Running slope of a live stream, O(window) per sample
+
+    The smoothed slope is centred so it lags the stream by window // 2
+    samples, update() returns the slope for that delayed sample.
+    """
+
+    def __init__(self, window=7, order=2, dt=0.02, smooth='savgol'):
+        self.window = window
+        self.dt = dt
+        if smooth == 'savgol':
+            self.coeffs = savgol_coeffs(window, order, 1) / dt
+        else:
+            # moving average of the first difference
+            self.coeffs = np.zeros(window)
+            self.coeffs[0] = -1 / ((window - 1) * dt)
+            self.coeffs[-1] = 1 / ((window - 1) * dt)
+        # each sample is written twice so the last window samples are
+        # always one contiguous slice, no copy needed
+        self.ring = np.zeros(2 * window)
+        self.count = 0
+
+    def update(self, value):
+        """ add one sample, returns slope window // 2 samples back or None """
+        pos = self.count % self.window
+        self.ring[pos] = value
+        self.ring[pos + self.window] = value
+        self.count += 1
+        if self.count < self.window:
+            return None
+        return float(np.dot(self.coeffs, self.ring[pos + 1:pos + 1 + self.window]))
+
+
+if __name__ == "__main__":
+
+    # 1 hour of noisy 50 Hz pressure
+    t = np.arange(0, 3600, 0.02)
+    p = 5 + 20 * (np.sin(2 * np.pi * t / 3) > 0.3) + np.random.normal(0, 0.3, len(t))
+
+    for smooth in [None, 'ma', 'savgol']:
+        elapsed = time.perf_counter()
+        diff = slope(t, p, smooth=smooth)
+        elapsed = time.perf_counter() - elapsed
+        print("{:>7}: {} samples {:1.1f} ms, noise std {:1.2f}".format(
+            str(smooth), len(t), elapsed * 1000, np.std(diff[:50])))
+
+    stream = SLOPE()
+    elapsed = time.perf_counter()
+    for value in p[:50000]:
+        stream.update(value)
+    elapsed = time.perf_counter() - elapsed
+    print("stream: {:1.2f} us/sample".format(elapsed / 50000 * 1e6))
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+"""
+Downsampled plotting for long recordings
+
+matplotlib slows to a crawl when handed hours of 50 Hz samples, yet a plot
+window is only a couple of thousand pixels wide.  Keeping the min and max
+of each pixel wide bucket draws the same picture from ~2 points per pixel.
+LINE redraws on every zoom/scroll so zoomed in views return to full
+resolution once the visible range has fewer samples than pixels.
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import time
+
+
+def minmax(x, y, buckets):
+    """
+    Min/max per bucket decimation, visually lossless for line plots
+
+    x, y (np.array): samples, x sorted, a nan in y breaks the line
+    buckets (int): number of buckets (roughly the pixel width)
+
+    Returns:
+    x, y (np.array): at most 2 * buckets points in time order, plus the
+                     first nan of every bucket that has one
+    """
+    n = len(y)
+    if n <= 2 * buckets:
+        return x, y
+    size = n // buckets
+    m = size * buckets
+    low = high = y
+    missing = np.isnan(y)
+    if missing.any():
+        # argmin/argmax would pick the nan of a bucket over its values
+        low = np.where(missing, np.inf, y)
+        high = np.where(missing, -np.inf, y)
+    offset = np.arange(buckets) * size
+    lo = np.argmin(low[:m].reshape(buckets, size), axis=1) + offset
+    hi = np.argmax(high[:m].reshape(buckets, size), axis=1) + offset
+    # keep the pair in time order so the line doesn't zig-zag backwards
+    idx = np.empty(2 * buckets, dtype=np.intp)
+    idx[0::2] = np.minimum(lo, hi)
+    idx[1::2] = np.maximum(lo, hi)
+    if m < n:
+        # remainder that doesn't fill a whole bucket
+        tail = np.arange(m, n)
+        idx = np.concatenate((idx, [tail[np.argmin(low[m:])],
+                                    tail[np.argmax(high[m:])]]))
+        idx[-2:] = np.sort(idx[-2:])
+    if low is not y:
+        # keep a nan per bucket between its min and max so the break shows
+        gaps = np.flatnonzero(missing)
+        first = np.unique(np.minimum(gaps // size, buckets), return_index=True)[1]
+        idx = np.sort(np.concatenate((idx, gaps[first])))
+    return x[idx], y[idx]
+
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets decimation
+
+    Keeps the shape of the waveform with fewer points than minmax, at the
+    cost of a python loop over buckets (not samples).
+
+    Returns:
+    x, y (np.array): points samples
+    """
+    n = len(y)
+    if points >= n or points < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    idx = np.zeros(points, dtype=np.intp)
+    idx[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # average of the next bucket is the third triangle point
+        nlo, nhi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        cx = x[nlo:max(nhi, nlo + 1)].mean()
+        cy = y[nlo:max(nhi, nlo + 1)].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+
+class LINE:
+    """ matplotlib line that re-decimates the visible range on zoom """
+
+    def __init__(self, ax, x, y, *args, pixels=None, method='minmax', **kwargs):
+        """
+        ax: matplotlib axes to draw on
+        x, y (np.array): full resolution samples, x sorted
+        pixels (int): buckets, defaults to the axes width in pixels
+        method (str): 'minmax' or 'lttb'
+        remaining args are passed to ax.plot
+        """
+        self.ax = ax
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.method = method
+        if pixels is None:
+            pixels = int(ax.get_window_extent().width) or 1000
+        self.pixels = pixels
+        dx, dy = self.decimate(self.x[0], self.x[-1]) if len(self.x) else (x, y)
+        self.line, = ax.plot(dx, dy, *args, **kwargs)
+        ax.callbacks.connect('xlim_changed', self.update)
+
+    def decimate(self, lo, hi):
+        """ samples visible between lo and hi at screen resolution """
+        start = max(np.searchsorted(self.x, lo, 'left') - 1, 0)
+        end = min(np.searchsorted(self.x, hi, 'right') + 1, len(self.x))
+        x = self.x[start:end]
+        y = self.y[start:end]
+        if self.method == 'lttb':
+            return lttb(x, y, 2 * self.pixels)
+        return minmax(x, y, self.pixels)
+
+    def update(self, ax):
+        lo, hi = ax.get_xlim()
+        x, y = self.decimate(lo, hi)
+        self.line.set_data(x, y)
+
+
+def plot(ax, x, y, *args, **kwargs):
+    """ ax.plot replacement for long series, returns the LINE """
+    return LINE(ax, x, y, *args, **kwargs)
+
+
+if __name__ == "__main__":
+
+    # one hour of 50 Hz samples
+    t = np.arange(0, 3600, 0.02)
+    p = 5 + 20 * (np.sin(2 * np.pi * t / 3) > 0.3) + np.random.normal(0, 0.3, len(t))
+
+    elapsed = time.perf_counter()
+    fig = plt.figure()
+    ax1 = fig.add_subplot(1, 1, 1)
+    plot(ax1, t, p)
+    fig.canvas.draw()
+    print("{} samples drawn in {:1.3f}s".format(len(t), time.perf_counter() - elapsed))
+    plt.show()
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+"""
+Breath detector accuracy and speed over the whole csv_raw corpus
+
+Uses the ventilator's own BS/BE breath markers (the N-mark-*.npz sidecars
+written by models/convert.py, see markers.py) as ground truth and runs the
+MONITOR2 detectors over every recording in parallel.  For each file it
+reports precision/recall of breath starts, start/end timing errors and
+throughput so a detector change shows accuracy and speed side by side.
+
+python3 evaluate.py --threshold 0 --factor 1.25 --method cycles
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import time
+import io
+import contextlib
+import argparse
+from multiprocessing import Pool
+from pathlib import Path
+import monitor2
+import analysis
+import model2
+import markers
+
+
+def match(truth, detected, tol=0.5):
+    """
+    One to one matching of detected breath starts to ground truth
+
+    truth, detected (np.array): sorted start times in seconds
+    tol (float): largest error in seconds that still counts as a match
+
+    Returns:
+    truth_idx, detected_idx (np.array): indices of matched pairs
+    """
+    if len(truth) == 0 or len(detected) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    # nearest detected start for every true start
+    right = np.clip(np.searchsorted(detected, truth), 1, len(detected) - 1)
+    left = right - 1
+    pick = np.where(np.abs(detected[left] - truth) <= np.abs(detected[right] - truth),
+                    left, right)
+    if len(detected) == 1:
+        pick = np.zeros(len(truth), dtype=int)
+    error = np.abs(detected[pick] - truth)
+    ok = error <= tol
+    truth_idx = np.nonzero(ok)[0]
+    detected_idx = pick[ok]
+    # one detection can only match one breath, keep the closest
+    order = np.lexsort((error[truth_idx], detected_idx))
+    truth_idx = truth_idx[order]
+    detected_idx = detected_idx[order]
+    first = np.ones(len(detected_idx), dtype=bool)
+    first[1:] = detected_idx[1:] != detected_idx[:-1]
+    return truth_idx[first], detected_idx[first]
+
+
+def evaluate(args):
+    """
+    Worker - run one detector over one recording
+
+    args (tuple): (pressure csv filename, options dict)
+
+    Returns:
+    dict: counts, timing errors and throughput for the file
+    """
+    filename, options = args
+    result = {"File": Path(filename).name, "Error": None}
+    try:
+        truth = markers.MARKERS(str(markers.sidecar_name(filename)))
+    except IOError:
+        result["Error"] = "no marker sidecar"
+        return result
+
+    data = np.loadtxt(filename, delimiter=',', ndmin=2)
+    if len(data) == 0:
+        result["Error"] = "empty"
+        return result
+    mon = monitor2.MONITOR2.__new__(monitor2.MONITOR2)  # no model file needed
+    mon.cycle_stats = []
+    mon.threshold_factor = options["factor"]
+    mon.threshold_percentile = options["percentile"]
+    threshold = options["threshold"]
+    if threshold == 0:
+        # the rule compute() uses with these threshold_factor/percentile
+        threshold = analysis.trigger(data[:, 1], mon.threshold_factor,
+                                     mon.threshold_percentile)
+    mon.slope_factor = options["slope"]
+    elapsed = time.perf_counter()
+    if options["method"] == 'count':
+        mon.models = model2.BREATH2(filename=filename)
+        with contextlib.redirect_stdout(io.StringIO()):  # count_breaths summary
+            detected = np.array(mon.count_breaths(timeout=3600,
+                                                  threshold=threshold))
+        starts = detected[:, 0] if len(detected) else np.empty(0)
+        ends = detected[:, 1] if len(detected) else np.empty(0)
+    else:
+        mon.data = data
+        mon.datanp = data
+        mon.find_cycles(threshold)
+        idx = np.array(mon.captured_idx, dtype=int)
+        starts = data[idx[0::2], 0]
+        ends = data[idx[1::2], 0]
+        if options["contours"]:
+            for i in range(len(starts)):
+                mon.contours(i, threshold, plot=False, quiet=True)
+    elapsed = time.perf_counter() - elapsed
+
+    rate = truth.rate
+    true_start = truth.start / rate
+    true_end = truth.end / rate
+    ti, di = match(true_start, starts, options["tol"])
+    start_err = starts[di] - true_start[ti]
+    end_err = ends[di] - true_end[ti]
+
+    result.update({
+        "Threshold": threshold,
+        "Truth": len(true_start),
+        "Detected": len(starts),
+        "Matched": len(ti),
+        "StartErr": start_err,
+        "EndErr": end_err,
+        "Samples": len(data),
+        "Seconds": elapsed,
+    })
+    return result
+
+
+def summary(errors):
+    """ median / 95th percentile of absolute errors in ms """
+    if len(errors) == 0:
+        return "    -/-   "
+    errors = np.abs(errors) * 1000
+    return "{:4.0f}/{:5.0f}".format(np.median(errors), np.percentile(errors, 95))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Breath detection accuracy against ventilator markers',
+        epilog='Needs csv_raw files converted with their N-mark-*.npz sidecars')
+    parser.add_argument('--dir', type=str, default='./models/csv_raw',
+                        help="folder with converted csv_raw files")
+    parser.add_argument('--method', type=str, default='cycles',
+                        choices=['cycles', 'count'],
+                        help="find_cycles over the whole file or streaming count_breaths")
+    parser.add_argument('--threshold', type=float, default=0,
+                        help="trigger level, 0 estimates it from PEEP per file")
+    parser.add_argument('--factor', type=float, default=1.25,
+                        help="threshold_factor applied to PEEP when threshold is 0")
+    parser.add_argument('--percentile', type=float, default=5,
+                        help="threshold_percentile, PEEP floor percentile, 0 for the lowest sample")
+    parser.add_argument('--slope', type=float, default=10,
+                        help="slope_factor divisor used by contours")
+    parser.add_argument('--contours', action='store_true',
+                        help="also run contours on every cycle (timing only)")
+    parser.add_argument('--tol', type=float, default=0.5,
+                        help="seconds a start may be off and still match")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="worker processes, default one per core")
+    args = parser.parse_args()
+
+    options = {
+        "method": args.method,
+        "threshold": args.threshold,
+        "factor": args.factor,
+        "percentile": args.percentile,
+        "slope": args.slope,
+        "contours": args.contours,
+        "tol": args.tol,
+    }
+    files = sorted(str(name) for name in Path(args.dir).glob("*-pres-*.csv"))
+    print("Evaluating {} recordings with {}".format(len(files), options))
+
+    elapsed = time.perf_counter()
+    with Pool(args.jobs) as pool:
+        results = pool.map(evaluate, [(name, options) for name in files])
+    elapsed = time.perf_counter() - elapsed
+
+    print("{:>40} {:>6} {:>6} {:>6} {:>6} {:>11} {:>11} {:>9}".format(
+        "file", "truth", "found", "prec", "recall", "start ms", "end ms", "ksmp/s"))
+    totals = {"Truth": 0, "Detected": 0, "Matched": 0, "Samples": 0,
+              "Seconds": 0}
+    start_err = []
+    end_err = []
+    for item in results:
+        if item["Error"] is not None:
+            print("{:>40} {}".format(item["File"][:40], item["Error"]))
+            continue
+        for key in totals:
+            totals[key] += item[key]
+        start_err.append(item["StartErr"])
+        end_err.append(item["EndErr"])
+        print("{:>40} {:6d} {:6d} {:6.3f} {:6.3f} {:>11} {:>11} {:9.0f}".format(
+            item["File"][:40], item["Truth"], item["Detected"],
+            item["Matched"] / max(item["Detected"], 1),
+            item["Matched"] / max(item["Truth"], 1),
+            summary(item["StartErr"]), summary(item["EndErr"]),
+            item["Samples"] / item["Seconds"] / 1000))
+
+    if totals["Truth"] > 0:
+        print("{:>40} {:6d} {:6d} {:6.3f} {:6.3f} {:>11} {:>11} {:9.0f}".format(
+            "ALL", totals["Truth"], totals["Detected"],
+            totals["Matched"] / max(totals["Detected"], 1),
+            totals["Matched"] / totals["Truth"],
+            summary(np.concatenate(start_err)), summary(np.concatenate(end_err)),
+            totals["Samples"] / totals["Seconds"] / 1000))
+    print("Wall time {:1.2f}s (errors are median/95th percentile)".format(elapsed))
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+"""
+Per-breath pressure and flow integrals - PTP, PTPmin, work and power
+
+MONITOR2.contours reports PTP as the average pressure before the peak.
+The quantities below are integrals over the inspiration instead, and are
+taken for every breath of a recording at once: pressure, flow and
+pressure x flow are each integrated once with a cumulative trapezoid sum,
+after which the integral over any breath is the difference of two entries.
+
+    PTP     - pressure time product above PEEP, cmH2O*s
+              sum over inspiration of (P - PEEP) dt
+    PTPmin  - PTP * RR, cmH2O*s/min
+    Vt      - inspired volume, L (flow is L/min)
+    WOB     - inspiratory work, J, sum of P dV with 1 cmH2O*L = 0.0981 J
+    Power   - mechanical power, WOB * RR, J/min
+
+Breaths come from analysis.find_cycles on the pressure, PEEP is the lowest
+pressure of the breath as in contours, and inspiration ends at the first
+strongly negative flow after the first strongly positive one, as in
+asynchrony.py.  Breaths without inspiratory flow, or with a nan or inf
+sample, are marked not Valid and their integrals are nan; those samples
+count as 0 in the running sums so the breaths after them are unaffected.
+
+python3 integrals.py --directory models/csv_raw --jobs 4
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import os
+import time
+import argparse
+from multiprocessing import Pool
+import analysis
+import asynchrony
+
+JOULES = 0.0980665  # J per cmH2O*L
+KEYS = ("PEEP", "Ti", "RR", "PTP", "PTPmin", "Vt", "WOB", "Power", "Valid")
+
+
+def cumulative(t, y):
+    """
+    Running trapezoid integral of y over t
+
+    Returns:
+    np.array: same length as y, entry k is the integral from t[0] to t[k]
+    """
+    area = np.empty(len(y))
+    area[0] = 0
+    np.cumsum((y[1:] + y[:-1]) * 0.5 * np.diff(t), out=area[1:])
+    return area
+
+
+def integrals(t, pressure, flow, cycles, expire=5):
+    """
+    Integrals of every breath at once
+
+    t (np.array): sample times (s)
+    pressure (np.array): cmH2O
+    flow (np.array): L/min, same samples as pressure
+    cycles (np.array): (breaths, 2) [start, end] from analysis.find_cycles
+    expire (float): flow (L/min) above +expire starts and below -expire
+                    ends inspiration
+
+    Returns:
+    dict: np.array per name in KEYS, one entry per breath, Valid is False
+          for breaths without inspiratory flow or with non-finite samples
+    """
+    t = np.asarray(t, dtype=float)
+    pressure = np.asarray(pressure, dtype=float)
+    flow = np.asarray(flow, dtype=float)
+    cycles = np.asarray(cycles, dtype=int).reshape(-1, 2)
+    count = len(cycles)
+    if count == 0:
+        result = {key: np.empty(0) for key in KEYS}
+        result["Valid"] = np.zeros(0, dtype=bool)
+        return result
+    idx, breath, offsets = asynchrony.segments(cycles)
+    start, end = cycles[:, 0], cycles[:, 1]
+
+    # a nan would carry into every later running sum, count it as 0 and
+    # drop the breaths with one, samples start to end both included
+    finite = np.isfinite(pressure) & np.isfinite(flow)
+    pressure = np.where(finite, pressure, 0)
+    flow = np.where(finite, flow, 0)
+    bad = np.concatenate(([0], np.cumsum(~finite)))
+    valid = bad[end + 1] == bad[start]
+
+    peep = np.minimum.reduceat(pressure[idx], offsets)
+    values = flow[idx]
+    inspiration = asynchrony.first(values > expire, breath, count)
+    valid &= inspiration >= 0
+    after_in = np.arange(len(idx)) >= np.where(inspiration >= 0, inspiration,
+                                               len(idx))[breath]
+    pos = asynchrony.first((values < -expire) & after_in, breath, count)
+    inspired = np.where(pos >= 0, idx[np.maximum(pos, 0)], end)
+
+    # one pass each, any breath is then two lookups
+    p_area = cumulative(t, pressure)
+    volume = cumulative(t, flow / 60)             # L
+    work = cumulative(t, pressure * flow / 60)    # cmH2O*L
+
+    ti = t[inspired] - t[start]
+    rr = 60 / np.maximum(t[end] - t[start], 1e-9)
+    ptp = p_area[inspired] - p_area[start] - peep * ti
+    wob = (work[inspired] - work[start]) * JOULES
+    result = {
+        "PEEP": peep,
+        "Ti": ti,
+        "RR": rr,
+        "PTP": ptp,
+        "PTPmin": ptp * rr,
+        "Vt": volume[inspired] - volume[start],
+        "WOB": wob,
+        "Power": wob * rr,
+    }
+    for key in result:
+        if key != "RR":
+            result[key][~valid] = np.nan
+    result["Valid"] = valid
+    return result
+
+
+def recording(args):
+    """
+    Worker - integrals of every breath of one pres/flow pair
+
+    args (tuple): (pressure filename, flow filename, threshold factor)
+
+    Returns:
+    tuple: (pressure filename, integrals dict, seconds spent, loading not included)
+    """
+    pres_file, flow_file, factor = args
+    pressure = asynchrony.load(pres_file)
+    flow = asynchrony.load(flow_file)
+    count = min(len(pressure), len(flow))
+    if count == 0:
+        return pres_file, integrals([], [], [], []), 0
+    elapsed = time.perf_counter()
+    threshold = analysis.trigger(pressure[:count, 1], factor, 5)
+    cycles = analysis.find_cycles(pressure[:count, 1], threshold)[0]
+    result = integrals(pressure[:count, 0], pressure[:count, 1], flow[:count, 1], cycles)
+    return pres_file, result, time.perf_counter() - elapsed
+
+
+def corpus(directory='./models/csv_raw', factor=1.25, jobs=None):
+    """ integrals of every recording in directory on all cores """
+    with Pool(jobs) as pool:
+        return pool.map(recording, [(pres, flow, factor)
+                                    for pres, flow in asynchrony.pairs(directory)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='PTP, PTPmin, work of breathing and mechanical power per breath',
+        epilog='medians per recording of pres/flow csv_raw pairs')
+    parser.add_argument('--directory', type=str, default='./models/csv_raw')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="worker processes, default one per core")
+    args = parser.parse_args()
+
+    elapsed = time.perf_counter()
+    results = corpus(args.directory, jobs=args.jobs)
+    elapsed = time.perf_counter() - elapsed
+
+    print("{:>4} {:>7} {:>7} {:>7} {:>8} {:>6} {:>6} {:>7} {:>7}".format(
+        "file", "breaths", "invalid", "PTP", "PTPmin", "Vt", "WOB", "Power", "ms"))
+    total = 0
+    for name, result, seconds in results:
+        breaths = len(result["PTP"])
+        if breaths == 0:
+            continue
+        total += breaths
+        valid = result["Valid"]
+        if not np.any(valid):
+            continue
+        print("{:>4} {:>7} {:>7} {:>7.1f} {:>8.0f} {:>6.2f} {:>6.2f} {:>7.1f} {:>7.1f}".format(
+            os.path.basename(name).split("-")[0], breaths, int(np.sum(~valid)),
+            np.median(result["PTP"][valid]), np.median(result["PTPmin"][valid]),
+            np.median(result["Vt"][valid]), np.median(result["WOB"][valid]),
+            np.median(result["Power"][valid]), seconds * 1000))
+    print("{} recordings, {} breaths in {:1.2f}s on {} workers".format(
+        len(results), total, elapsed, args.jobs or os.cpu_count()))
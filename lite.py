@@ -0,0 +1,326 @@
+#!/usr/bin/python3
+"""
+Integer only breath analyzer for resource limited processors
+
+LITE is the MONITOR2 find_cycles/contours pipeline cut down to what a small
+controller can run: pure Python, no NumPy, pressure in fixed point integers
+(1 = 0.01 cm H2O, what an ADC reading scaled once would give), time as the
+sample count at a fixed rate, and every buffer an array preallocated in
+__init__.  add() is called once per sample and only updates the ring and
+the find_cycles state machine, the per breath stats are computed when the
+breath ends.  Memory is fixed by capacity (longest breath) and history
+(breaths kept) and never grows.
+
+Stats: PEEP, PEEPi, Ppeak, Pplat, dP (0.01 cm H2O) and RR (0.01 /min),
+located the same way as MONITOR2.contours with smooth=None.
+
+python3 lite.py models/csv_raw/<pressure file>.csv ...
+runs the LITE and the NumPy MONITOR2 path on each file in separate
+processes and prints time and Python ops per sample, peak RSS and the
+largest difference between the two.
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from array import array
+import sys
+import time
+import json
+import resource
+import argparse
+import subprocess
+
+SCALE = 100  # fixed point counts per cm H2O
+FIELDS = ("PEEP", "PEEPi", "Ppeak", "Pplat", "dP", "RR", "Start", "End")
+
+
+class LITE:
+
+    def __init__(self, threshold, rate=50, capacity=1024, history=64, factor=10):
+        """
+        threshold (int): trigger level in fixed point counts
+        rate (int): samples per second
+        capacity (int): ring size in samples, power of 2, longest breath
+        history (int): breaths of stats kept
+        factor (int): slope_factor, as MONITOR2.slope_factor
+        """
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of 2")
+        self.threshold = threshold
+        self.rate = rate
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.history = history
+        self.factor = factor
+        self.skip = (3 * rate + 5) // 10  # 0.3s past the slope peak
+        # contours measures PEEPi at the last sample 0.05s before the end
+        self.jump = max((5 * rate + 99) // 100, 1)
+
+        self.ring = array('i', [0]) * capacity   # pressure samples
+        self.diff = array('i', [0]) * capacity   # slope of the breath
+        self.stats = array('i', [0]) * (history * len(FIELDS))
+        self.reset()
+
+    def reset(self):
+        self.n = 0        # samples seen, absolute index of next sample
+        self.state = 0    # find_cycles state
+        self.start = 0    # absolute index of current breath start
+        self.breaths = 0  # breaths completed
+        self.dropped = 0  # breaths longer than the ring
+
+    def memory(self):
+        """ bytes held in buffers, fixed after __init__ """
+        return sum(buf.itemsize * len(buf) for buf in (self.ring, self.diff, self.stats))
+
+    def add(self, p):
+        """ one pressure sample in fixed point counts """
+        n = self.n
+        self.ring[n & self.mask] = p
+        self.n = n + 1
+        if n == 0:
+            return  # find_cycles starts on the second sample
+        x = p - self.threshold
+        state = self.state
+        if state == 0:
+            if x < 0:
+                self.state = 1
+        elif state == 1:
+            if x > 0:
+                self.start = n  # start of inhalation
+                self.state = 2
+        elif state == 2:
+            if x < 0:
+                self.state = 3
+        elif x > 0:
+            self.breath(self.start, n)  # end of cycle
+            self.state = 1
+
+    def breath(self, start, end):
+        """ stats of samples [start, end), the sample before start and end
+        itself must still be in the ring """
+        length = end - start
+        if length < 5 or end - start + 2 > self.capacity:
+            self.dropped += 1
+            return
+        ring = self.ring
+        diff = self.diff
+        mask = self.mask
+
+        peak = peep = ring[start & mask]
+        peak_idx = 0
+        for i in range(length):
+            p = ring[(start + i) & mask]
+            if p > peak:
+                peak = p
+                peak_idx = i
+            if p < peep:
+                peep = p
+            if start + i > 0:
+                diff[i] = p - ring[(start + i - 1) & mask]
+        if start == 0:
+            diff[0] = diff[1]
+
+        # steepest rise, constant sample spacing so counts are the slope
+        diff_max = diff[0]
+        idx_max = 0
+        for i in range(1, length):
+            if diff[i] > diff_max:
+                diff_max = diff[i]
+                idx_max = i
+        skip = self.skip
+        if idx_max + skip >= length:
+            skip = 0
+        # steepest fall after the rise
+        diff_min = diff[idx_max + skip]
+        idx_min = 0
+        find = 0
+        for i in range(idx_max + skip, length):
+            d = diff[i]
+            if d < diff_min:
+                diff_min = d
+            if d < find:
+                find = d
+                idx_min = i
+        # plateau: back from the fall to where the slope is under diff_min/factor
+        idx_min_start = idx_max
+        for i in range(idx_min, peak_idx, -1):
+            if diff[i] * self.factor >= diff_min:
+                idx_min_start = i
+                break
+
+        plat = ring[(start + idx_min_start) & mask]
+        slot = (self.breaths % self.history) * len(FIELDS)
+        stats = self.stats
+        stats[slot] = peep
+        stats[slot + 1] = ring[(end - self.jump) & mask] - peep
+        stats[slot + 2] = peak
+        stats[slot + 3] = plat
+        stats[slot + 4] = plat - peep
+        stats[slot + 5] = (60 * SCALE * self.rate + length // 2) // length
+        stats[slot + 6] = start
+        stats[slot + 7] = end
+        self.breaths += 1
+
+    def get(self, breath=-1):
+        """
+        Stats of a kept breath, -1 for the last
+
+        Returns:
+        dict: same keys as MONITOR2.stats, pressures in cm H2O, times in s
+        """
+        if breath < 0:
+            breath += self.breaths
+        if breath < 0 or breath < self.breaths - self.history:
+            return None
+        slot = (breath % self.history) * len(FIELDS)
+        values = self.stats[slot:slot + len(FIELDS)]
+        result = {FIELDS[i]: values[i] / SCALE for i in range(6)}
+        result["Start"] = values[6] / self.rate
+        result["End"] = values[7] / self.rate
+        return result
+
+
+def read_fixed(filename):
+    """ pressure column of a csv_raw file as fixed point counts """
+    values = array('i')
+    with open(filename) as fp:
+        for line in fp:
+            values.append(int(round(float(line.split(',')[1]) * SCALE)))
+    return values
+
+
+def count_ops(analyzer, values):
+    """ Python bytecodes executed per sample by add() and breath() """
+    codes = (LITE.add.__code__, LITE.breath.__code__)
+    ops = [0]
+
+    def local(frame, event, arg):
+        if event == 'opcode':
+            ops[0] += 1
+        return local
+
+    def start(frame, event, arg):
+        if frame.f_code in codes:
+            frame.f_trace_opcodes = True
+            frame.f_trace_lines = False
+            return local
+        return None
+
+    analyzer.reset()
+    sys.settrace(start)
+    for p in values:
+        analyzer.add(p)
+    sys.settrace(None)
+    return ops[0] / max(len(values), 1)
+
+
+def run_lite(filename, threshold, rate=50):
+    values = read_fixed(filename)
+    analyzer = LITE(int(round(threshold * SCALE)), rate=rate,
+                    history=max(len(values) // rate, 64))
+    elapsed = time.perf_counter()
+    for p in values:
+        analyzer.add(p)
+    elapsed = time.perf_counter() - elapsed
+    stats = [analyzer.get(i) for i in range(analyzer.breaths)]
+    ops = count_ops(analyzer, values[:20000])
+    return {"samples": len(values), "seconds": elapsed, "ops": ops,
+            "buffers": analyzer.memory(), "dropped": analyzer.dropped,
+            "stats": stats}
+
+
+def run_numpy(filename, threshold):
+    import numpy as np
+    import monitor2
+    data = np.loadtxt(filename, delimiter=',', ndmin=2)
+    mon = monitor2.MONITOR2.__new__(monitor2.MONITOR2)  # no model file needed
+    mon.cycle_stats = []
+    elapsed = time.perf_counter()
+    mon.data = data
+    mon.datanp = data
+    mon.find_cycles(threshold, plot=False)
+    for i in range(len(mon.captured_idx) // 2):
+        mon.contours(i, threshold, plot=False, quiet=True)
+        mon.store_stats()
+    elapsed = time.perf_counter() - elapsed
+    stats = [{key: float(item[key]) for key in FIELDS} for item in mon.cycle_stats]
+    return {"samples": len(data), "seconds": elapsed, "stats": stats}
+
+
+def threshold_of(filename, factor=1.25):
+    """
+    evaluate.py rule, analysis.trigger at the 5th percentile, rounded to
+    fixed point; for the CLI, the LITE side only needs the integer result
+    """
+    import numpy as np
+    import analysis
+    values = np.array(read_fixed(filename))
+    if len(values) == 0:
+        return 0
+    return round(analysis.trigger(values, factor, 5)) / SCALE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Integer only breath analyzer against the NumPy MONITOR2 path',
+        epilog='Each path runs in its own process so peak RSS is its own')
+    parser.add_argument('files', type=str, nargs='+', help="csv_raw pressure files")
+    parser.add_argument('--threshold', type=float, default=0,
+                        help="trigger level, 0 estimates it from PEEP per file")
+    parser.add_argument('--run', type=str, choices=['lite', 'numpy'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        if args.run == 'lite':
+            result = run_lite(args.files[0], args.threshold)
+        else:
+            result = run_numpy(args.files[0], args.threshold)
+        result["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        print(json.dumps(result))
+        exit(0)
+
+    print("{:>30} {:>6} {:>9} {:>7} {:>8} {:>8} {:>6}  {}".format(
+        "file", "path", "samples", "breaths", "ns/smp", "ops/smp", "RSS MB",
+        "max |lite - numpy| PEEP PEEPi Ppeak Pplat dP RR"))
+    for name in args.files:
+        threshold = args.threshold or threshold_of(name)
+        if threshold == 0:
+            continue
+        results = {}
+        for path in ['lite', 'numpy']:
+            out = subprocess.run([sys.executable, __file__, name, '--run', path,
+                                  '--threshold', str(threshold)],
+                                 stdout=subprocess.PIPE, check=True)
+            results[path] = json.loads(out.stdout.decode().splitlines()[-1])
+        # breaths are found by the same state machine, line them up on start
+        numpy_stats = {round(item["Start"], 2): item for item in results['numpy']["stats"]}
+        errors = [0] * 6
+        for item in results['lite']["stats"]:
+            other = numpy_stats.get(round(item["Start"], 2))
+            if other is None:
+                continue
+            for i in range(6):
+                errors[i] = max(errors[i], abs(item[FIELDS[i]] - other[FIELDS[i]]))
+        for path in ['lite', 'numpy']:
+            item = results[path]
+            print("{:>30} {:>6} {:9d} {:7d} {:8.0f} {:>8} {:6.1f}  {}".format(
+                name.split('/')[-1][:30], path, item["samples"], len(item["stats"]),
+                item["seconds"] / max(item["samples"], 1) * 1e9,
+                "{:1.0f}".format(item["ops"]) if "ops" in item else "-",
+                item["rss"] / 1e6,
+                " ".join("{:1.2f}".format(e) for e in errors) if path == 'lite' else
+                ""))
+        print("{:>30} lite buffers {} bytes, {} breaths over capacity".format(
+            "", results['lite']["buffers"], results['lite']["dropped"]))
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+"""
+Ventilator breath markers saved alongside converted csv_raw data
+
+The raw ventmode files mark every breath with "BS, S:<breath number>," and
+"BE" lines and drop in wall-clock timestamps.  convert.py keeps these as a
+small sidecar (.npz) next to the pressure/flow csv files:
+
+breath   - ventilator breath number
+start    - sample offset of the first sample of the breath
+end      - sample offset one past the last sample of the breath
+pres_pos - byte offset of the breath start in the pressure csv
+flow_pos - byte offset of the breath start in the flow csv
+anchor   - sample offset of each timestamp line
+clock    - wall-clock seconds (since 1970) of each timestamp line
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+import argparse
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_timestamp(line):
+    """
+    Ventmode timestamp {year}-{month}-{day}-{hour}-{minute}-{second}.{millis}
+    for example 2192-07-15-04-43-37.103707
+
+    Returns:
+    float: seconds since 1970 or None if the line isn't a timestamp
+    """
+    try:
+        stamp = datetime.strptime(line.strip(), "%Y-%m-%d-%H-%M-%S.%f")
+    except ValueError:
+        return None
+    return (stamp - EPOCH).total_seconds()
+
+
+def sidecar_name(filename):
+    """ marker file for a csv_raw pressure or flow file """
+    path = Path(filename)
+    name = path.name.replace("-pres-", "-mark-", 1).replace("-flow-", "-mark-", 1)
+    return path.with_name(name).with_suffix(".npz")
+
+
+class MARKERS:
+
+    rate = 50  # samples per second assumed between timestamps
+
+    def __init__(self, filename=''):
+        self.breath = np.empty(0, dtype=np.int64)
+        self.start = np.empty(0, dtype=np.int64)
+        self.end = np.empty(0, dtype=np.int64)
+        self.pres_pos = np.empty(0, dtype=np.int64)
+        self.flow_pos = np.empty(0, dtype=np.int64)
+        self.anchor = np.empty(0, dtype=np.int64)
+        self.clock = np.empty(0)
+        self.lookup = np.empty(0, dtype=np.int64)
+        self.first = 0
+        if filename != '':
+            self.load(filename)
+
+    def save(self, filename):
+        np.savez_compressed(filename, breath=self.breath, start=self.start,
+                            end=self.end, pres_pos=self.pres_pos,
+                            flow_pos=self.flow_pos, anchor=self.anchor,
+                            clock=self.clock, rate=self.rate)
+
+    def load(self, filename):
+        with np.load(filename) as data:
+            self.breath = data["breath"]
+            self.start = data["start"]
+            self.end = data["end"]
+            self.pres_pos = data["pres_pos"]
+            self.flow_pos = data["flow_pos"]
+            self.anchor = data["anchor"]
+            self.clock = data["clock"]
+            self.rate = float(data["rate"])
+        self.build()
+
+    def build(self):
+        """ breath number -> row lookup table, so find() is O(1) """
+        if len(self.breath) == 0:
+            return
+        self.first = int(self.breath.min())
+        self.lookup = np.full(int(self.breath.max()) - self.first + 1, -1,
+                              dtype=np.int64)
+        self.lookup[self.breath - self.first] = np.arange(len(self.breath))
+
+    def find(self, breath_number):
+        """ row of a ventilator breath number, -1 if it isn't recorded """
+        i = breath_number - self.first
+        if i < 0 or i >= len(self.lookup):
+            return -1
+        return int(self.lookup[i])
+
+    def to_markers(self):
+        """
+        Breaths as [start, stop, breath_number] in seconds, the same layout
+        MONITOR2.count_breaths returns so detection can be skipped
+        """
+        return [[self.start[i] / self.rate, self.end[i] / self.rate,
+                 int(self.breath[i])] for i in range(len(self.breath))]
+
+    def clock_time(self, offset):
+        """ wall-clock seconds of a sample offset from the nearest anchor """
+        if len(self.anchor) == 0:
+            return None
+        i = max(np.searchsorted(self.anchor, offset, 'right') - 1, 0)
+        return self.clock[i] + (offset - self.anchor[i]) / self.rate
+
+    def gaps(self, tol=0.5):
+        """
+        Compare samples recorded between timestamps with the wall clock
+
+        tol (float): seconds of disagreement ignored
+
+        Returns:
+        list: [sample offset, missing samples] for each interval where the
+              clock advanced more than the samples account for
+        """
+        if len(self.anchor) < 2:
+            return []
+        samples = np.diff(self.anchor)
+        elapsed = np.diff(self.clock)
+        missing = elapsed * self.rate - samples
+        flagged = np.nonzero(missing > tol * self.rate)[0]
+        return [[int(self.anchor[i]), int(round(missing[i]))] for i in flagged]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Show breath markers saved by convert.py',
+        epilog='Pass a csv_raw pressure/flow file or its marker .npz')
+    parser.add_argument('file', type=str, help="Input Filename with path")
+    args = parser.parse_args()
+
+    filename = args.file
+    if not filename.endswith(".npz"):
+        filename = sidecar_name(filename)
+    marks = MARKERS(str(filename))
+    print("{} breaths [{} - {}], {} timestamps".format(
+        len(marks.breath), marks.first, marks.first + len(marks.lookup) - 1,
+        len(marks.anchor)))
+    for offset, missing in marks.gaps():
+        print("Sample {}: ~{} samples missing".format(offset, missing))
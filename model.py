@@ -4,6 +4,13 @@ Generates numerical model for breath to simulate sensor data
 Data is modeled in a [time, pressure] 2d array
 Raw waveform models can be found in the ./models directory.
 
+synthesize() builds a whole waveform at once with the bpm, peak and peep
+drawn per breath: the template is indexed by the phase within each breath,
+so a new rate starts at the breath boundary instead of cutting the
+template mid stream.
+
+python3 model.py --hours 1 --random 10 5 5
+
 
 Copyright (C) 2020 Eric Baicy
 
@@ -24,6 +31,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from random import uniform
 import time
+import argparse
 
 
 class BREATH:
@@ -50,6 +58,7 @@ class BREATH:
 
     def load(self, filename):
         self.breath = genfromtxt(filename, delimiter=',')
+        self.template = self.breath.copy()  # unscaled, for synthesize()
         self.filename = filename
         max = np.amax(self.breath, axis=0)
         min = np.amin(self.breath, axis=0)
@@ -131,7 +140,8 @@ class BREATH:
         3% in peep value.
 
         NOTE: random bpm is not working now because the changes in sample 
-        window need to be padded to avoid discontinuities.
+        window need to be padded to avoid discontinuities, synthesize()
+        varies the bpm with continuous phase.
 
         The sample cycle may lag when a new waveform is generated.
         """
@@ -155,32 +165,129 @@ class BREATH:
         self.prev_sample = time  # track last point
         return xinterp
 
+    def synthesize(self, seconds, rate=100, random=[0, 0, 0], seed=None,
+                   bpm=None, peak=None, peep=None):
+        """
+        Whole waveform with randomized breaths, no per sample Python
+
+        Each breath draws its own bpm, peak and peep within +/- random% like
+        get_simulated_data, breath starts are the running sum of the breath
+        periods and every sample reads the unscaled template at its phase
+        within the breath.  The template starts and ends on its floor, so
+        only a peep change steps the waveform, at the breath boundary.
+
+        seconds (float): length of the waveform
+        rate (float): samples per second
+        random: [bpm, peak, peep] percentage variation per breath
+        seed (int): numpy random seed, the same seed gives the same waveform
+        bpm, peak, peep (float): centre values, None for the scale() settings
+
+        Returns:
+        data, breaths: (samples, 2) [time, pressure] array and a dict of
+                       np.arrays per breath - Start, End (s), BPM, Ppeak, PEEP
+        """
+        bpm = self.bpm_sim if bpm is None else bpm
+        peak = self.peak_sim if peak is None else peak
+        peep = self.peep_sim if peep is None else peep
+        rng = np.random.default_rng(seed)
+        spread = np.asarray(random, dtype=float) / 100
+
+        # enough breaths at the fastest rate the spread allows
+        count = int(np.ceil(seconds * bpm * (1 + spread[0]) / 60)) + 1
+        rates = bpm * rng.uniform(1 - spread[0], 1 + spread[0], count)
+        peaks = peak * rng.uniform(1 - spread[1], 1 + spread[1], count)
+        peeps = peep * rng.uniform(1 - spread[2], 1 + spread[2], count)
+        periods = 60 / rates
+        ends = np.cumsum(periods)
+        starts = ends - periods
+
+        t = np.arange(int(round(seconds * rate))) / rate
+        idx = np.searchsorted(ends, t, side='right')
+        phase = (t - starts[idx]) / periods[idx]  # 0 to 1 through each breath
+
+        # template shape from 0 at the floor to 1 at the peak
+        times = self.template[:, 0]
+        values = self.template[:, 1]
+        floor = np.amin(values)
+        shape = np.interp(phase * times[-1], times,
+                          (values - floor) / (np.amax(values) - floor))
+        pressure = shape * (peaks - peeps)[idx] + peeps[idx]
+
+        used = int(idx[-1]) + 1 if len(idx) else 0
+        breaths = {
+            "Start": starts[:used],
+            "End": ends[:used],
+            "BPM": rates[:used],
+            "Ppeak": peaks[:used],
+            "PEEP": peeps[:used],
+        }
+        return np.column_stack((t, pressure)), breaths
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Breath model, randomized waveform synthesis benchmark',
+        epilog='--live samples get_simulated_data in real time and plots it')
+    parser.add_argument('--model', type=str, default='./models/b30-peep0-20s-lowpeak.csv')
+    parser.add_argument('--hours', type=float, default=1)
+    parser.add_argument('--rate', type=float, default=100)
+    parser.add_argument('--random', type=float, nargs=3, default=[10, 5, 5],
+                        metavar=('BPM', 'PEAK', 'PEEP'), help="percent variation")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--plot', action='store_true', help="plot the first 30s")
+    parser.add_argument('--live', action='store_true')
+    args = parser.parse_args()
+
+    if args.live:
+        seconds = 9
+        delay = 0.010  # sample delay
+        timer = 0
+        data = []
+
+        br = BREATH()
+        br.scale()
+
+        # loop to sample data
+        print("Sampling sensor for {}s".format(seconds))
+        while timer < seconds:
+            time.sleep(delay)  # wait for sample
+            data.append([timer, br.get_simulated_data(timer, random=[0, 10, 10])])
+            timer = timer + delay
+        fig = plt.figure()
+        ax1 = fig.add_subplot(1, 1, 1)
 
-    seconds = 9
-    delay = 0.010  # sample delay
-    timer = 0
-    data = []
-
-    br = BREATH()
-    br.scale()
-
-    # loop to sample data
-    print("Sampling sensor for {}s".format(seconds))
-    while timer < seconds:
-        time.sleep(delay)  # wait for sample
-        data.append([timer, br.get_simulated_data(timer, random=[0, 10, 10])])
-        timer = timer + delay
-    fig = plt.figure()
-    ax1 = fig.add_subplot(1, 1, 1)
-
-    xar = []
-    yar = []
-    for eachLine in data:
-        if len(eachLine) > 1:
-            x, y = eachLine[0], eachLine[1]
-            xar.append(float(x))
-            yar.append(float(y))
-    ax1.plot(xar, yar)
-    plt.show()
+        xar = []
+        yar = []
+        for eachLine in data:
+            if len(eachLine) > 1:
+                x, y = eachLine[0], eachLine[1]
+                xar.append(float(x))
+                yar.append(float(y))
+        ax1.plot(xar, yar)
+        plt.show()
+    else:
+        import analysis
+        import monitor2
+
+        br = BREATH(args.model)
+        br.scale(20, 30, 10)
+        elapsed = time.perf_counter()
+        data, breaths = br.synthesize(args.hours * 3600, args.rate, args.random, args.seed)
+        elapsed = time.perf_counter() - elapsed
+        print("{} samples, {} breaths in {:1.3f}s, {:1.1f} M samples/s".format(
+            len(data), len(breaths["Start"]), elapsed, len(data) / elapsed / 1e6))
+        print("BPM {:1.1f} - {:1.1f}, largest step between samples {:1.2f} cm H2O".format(
+            np.amin(breaths["BPM"]), np.amax(breaths["BPM"]),
+            np.amax(np.abs(np.diff(data[:, 1])))))
+
+        elapsed = time.perf_counter()
+        cycles = analysis.find_cycles(data[:, 1], br.peep_sim * 1.25)[0]
+        markers = [[data[s, 0], data[e, 0], n + 1] for n, (s, e) in enumerate(cycles)]
+        flagged = monitor2.MONITOR2.find_irregular_cycles(markers, tol=args.random[0])
+        elapsed = time.perf_counter() - elapsed
+        print("find_cycles: {} breaths, find_irregular_cycles: {} flagged in {:1.3f}s".format(
+            len(cycles), len(flagged), elapsed))
+        if args.plot:
+            part = data[data[:, 0] < 30]
+            plt.plot(part[:, 0], part[:, 1])
+            plt.show()
@@ -6,6 +6,8 @@ csv data that has format of:
 
 time,value
 
+or .vpa archives (see archive.py) which are decoded a block at a time
+
 Currently only models pressure waveforms
 """
 import numpy as np
@@ -14,6 +16,7 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import argparse
 import time
+import archive
 
 
 class BREATH2:
@@ -22,15 +25,25 @@ class BREATH2:
     type = ''
     raw_file = False
     point = 0
+    archive = None  # archive.ARCHIVE when reading a .vpa file
+    rate = 50  # samples per second, raw files only have sample counts
 
-    def __init__(self, filename='', type='press'):
+    def __init__(self, filename='', type='press', rate=50):
         """
         Init plot class
         :param filename: input filename in csv format
         :param type: press is to plot the pressure, flow to plot flow rates
+        :param rate: sample rate of raw files, .vpa archives store their own
         """
+        self.rate = rate
         try:
-            self.fp = open(filename, "r", errors='ignore')
+            if str(filename).endswith(".vpa"):
+                self.archive = archive.ARCHIVE(filename)
+                self.channel = self.archive.channel(type)
+                self.rate = self.archive.rate
+                self.seek_sample(0)
+            else:
+                self.fp = open(filename, "r", errors='ignore')
         except IOError:
             print("Problem with IO")
             print("File {}: does not exist".format(filename))
@@ -46,10 +59,56 @@ class BREATH2:
         return data
 
     def rewind(self):
+        if self.archive is not None:
+            self.seek_sample(0)
+            return
         self.fp.seek(0)
 
+    def seek(self, pos):
+        """ jump to a byte offset of a csv file, see markers.py pres_pos/flow_pos """
+        self.fp.seek(pos)
+
+    def seek_breath(self, index, row):
+        """
+        jump to the start of a breath of a markers.MARKERS index, the byte
+        offset of a csv file or the sample number in a .vpa archive
+
+        index (markers.MARKERS): breath markers of this recording
+        row (int): row of the breath in index, see MARKERS.find
+        """
+        if self.archive is not None:
+            self.seek_sample(int(index.start[row]))
+        elif self.type == 'flow':
+            self.seek(int(index.flow_pos[row]))
+        else:
+            self.seek(int(index.pres_pos[row]))
+
+    def seek_sample(self, sample):
+        """ jump to a sample number in a .vpa archive, decodes one block """
+        self.block_num = sample // self.archive.block
+        self.block_pos = sample % self.archive.block
+        self.block_data = np.empty(0)
+        if self.block_num < self.archive.blocks:
+            self.block_data = self.archive.read_block(self.block_num)[:, self.channel]
+
+    def _get_archive(self):
+        """ next sample from the decoded archive block """
+        if self.block_pos >= len(self.block_data):
+            if self.block_num + 1 >= self.archive.blocks:
+                return  # end of file
+            self.seek_sample((self.block_num + 1) * self.archive.block)
+        sample = self.block_num * self.archive.block + self.block_pos
+        p = float(self.block_data[self.block_pos])
+        self.block_pos += 1
+        time = self.archive.t0 + sample / self.archive.rate
+        self.prev_sample = time
+        self.prev_value = p
+        return [time, p]
+
     def _get_data(self):
         """ routine extract data from file"""
+        if self.archive is not None:
+            return self._get_archive()
 
         data_bad = True
         while data_bad:
@@ -104,7 +163,7 @@ class BREATH2:
             else:
                 p = x[0]
             self.points += 1
-            time = self.points / 50
+            time = self.points / self.rate
         else:
             p = x[1]
             time = x[0]
@@ -14,13 +14,22 @@ this program. If not, see <https://www.gnu.org/licenses/>.
 import numpy as np
 import glob
 import os
+import sys
 from pathlib import Path
 import argparse
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import markers
+import archive
+
 
 class Convert:
-    def __init__(self):
+    def __init__(self, archive=False, rate=50):
         # get file list and convert
+        # archive=True also writes a compact .vpa file, see archive.py
+        # rate is the ventilator sample rate, raw_vwd files only count samples
+        self.archive = archive
+        self.rate = rate
         i = 0
         glob_path = Path.cwd() / 'raw_vwd'
         for name in glob_path.rglob("*.csv"):
@@ -44,6 +53,17 @@ class Convert:
             print("unable to open: " + str(e))
             exit()
         count = 0
+        pos_pres = 0  # bytes written so far, for seeking to breaths
+        pos_flow = 0
+        marks = markers.MARKERS()
+        breath = []
+        start = []
+        end = []
+        pres_pos = []
+        flow_pos = []
+        anchor = []
+        clock = []
+        samples = []  # [pressure, flow] kept for the archive
         while True:
             try:
                 line = fp_in.readline()
@@ -54,33 +74,81 @@ class Convert:
             x = line.split(", ")
             if not line:
                 break
+
+            # Meta data
+            #
+            # is it one of the following?
+            # Time stamp
+            # {year}-{month}-{day}-{hour}-{minute}-{second}.{millis}
+            # 2192-07-15-04-43-37.103707
+            #
+            # Breath Start, S:<Breath Number>,
+            # BS, S:2244,
+            #
+            # Breath End
+            # BE
+            #
+            # kept in the marker sidecar against the sample count
+            if line.startswith("BS"):
+                if len(end) < len(start):
+                    end.append(count)  # previous breath had no BE
+                try:
+                    breath.append(int(line.split("S:")[1].strip(" ,\n")))
+                except (IndexError, ValueError):
+                    breath.append(breath[-1] + 1 if len(breath) else 0)
+                start.append(count)
+                pres_pos.append(pos_pres)
+                flow_pos.append(pos_flow)
+                continue
+            if line.startswith("BE"):
+                if len(end) < len(start):
+                    end.append(count)
+                continue
             if len(x) < 2:
+                stamp = markers.parse_timestamp(line)
+                if stamp is not None:
+                    anchor.append(count)
+                    clock.append(stamp)
                 continue
             x[1] = x[1].rstrip()
             try:
                 x[0] = float(x[0])
                 x[1] = float(x[1])
             except ValueError:
-                # Meta data
-                #
-                # is it one of the following?
-                # Time stamp
-                # {year}-{month}-{day}-{hour}-{minute}-{second}.{millis}
-                # 2192-07-15-04-43-37.103707
-                #
-                # Breath Start, S:<Breath Number>,
-                # BS, S:2244,
-                #
-                # Breath End
-                # BE
                 continue  # ignore it
-            # Assume a 50hz sample time based on specs.
+            # Assume the specified sample rate (50hz for these ventilators).
             # this is not entirely accurate because it's possible
-            # samples are missing
-            time_sample = count * 1 / 50  # 50hz sample time
-            fp_out_pres.write("{},{}\n".format(time_sample, x[1]))
-            fp_out_flow.write("{},{}\n".format(time_sample, x[0]))
+            # samples are missing, the marker timestamps can find them
+            time_sample = count / self.rate
+            pres = "{},{}\n".format(time_sample, x[1])
+            flow = "{},{}\n".format(time_sample, x[0])
+            fp_out_pres.write(pres)
+            fp_out_flow.write(flow)
+            pos_pres += len(pres)
+            pos_flow += len(flow)
+            if self.archive:
+                samples.append([x[1], x[0]])
             count += 1
+        if len(end) < len(start):
+            end.append(count)  # file ended mid breath
+
+        marks.breath = np.array(breath, dtype=np.int64)
+        marks.start = np.array(start, dtype=np.int64)
+        marks.end = np.array(end, dtype=np.int64)
+        marks.pres_pos = np.array(pres_pos, dtype=np.int64)
+        marks.flow_pos = np.array(flow_pos, dtype=np.int64)
+        marks.anchor = np.array(anchor, dtype=np.int64)
+        marks.clock = np.array(clock)
+        marks.rate = self.rate  # sample counts to seconds for the sidecar
+        marks.save(str(markers.sidecar_name(name1)))
+
+        if self.archive:
+            name3 = str(Path.cwd() / 'csv_raw' / "{}-{}".format(o_file, name))
+            writer = archive.WRITER(str(Path(name3).with_suffix(".vpa")),
+                                    channels=('press', 'flow'), rate=self.rate)
+            if len(samples):
+                writer.append(np.array(samples))
+            writer.close()
         fp_in.close()
         fp_out_pres.close()
         fp_out_flow.close()
@@ -98,4 +166,9 @@ if __name__ == "__main__":
         description=
         'Convert all raw_vmd files and put them into cvs_raw pressure and flow data',
         epilog='Run in partent directory to raw_vwd and csv_raw')
-    con = Convert()
+    parser.add_argument('-a', action='store_true',
+                        help='also write compact .vpa archives')
+    parser.add_argument('--rate', type=float, default=50,
+                        help='ventilator sample rate in Hz')
+    args = parser.parse_args()
+    con = Convert(archive=args.a, rate=args.rate)
@@ -19,7 +19,13 @@ this program. If not, see <https://www.gnu.org/licenses/>.
 import numpy as np
 import matplotlib.pyplot as plt
 import time
+from collections import deque
 import model
+import derivative
+import buffer
+import analysis
+import sampler
+import alarms
 
 #
 # Notes on Parameters
@@ -73,6 +79,42 @@ import model
 #
 
 
+def first_of(mask, default):
+    """ index of the first True in mask, default when there is none """
+    hits = np.flatnonzero(mask)
+    return int(hits[0]) if len(hits) else default
+
+
+def second_dips(diff, first, last, factor=10):
+    """
+    Deepest dip of the slope in the window [first, last) and the bracket of
+    samples around it where the slope is steeper than dip / factor
+
+    The window is clipped to diff and always holds at least one sample, so
+    the results are valid indices into diff.
+
+    diff (np.array): slope of the samples
+    first, last (int): window start and end (exclusive) indices
+    factor (int): divisor of the dip slope that counts as flattened
+
+    Returns:
+    dip, dip_start, dip_end: the minimum slope, the last flat sample before
+                             it (start of the slope) and the first flat
+                             sample after it (end of the slope, last
+                             sample if none)
+    """
+    b = min(max(int(last), 1), len(diff))
+    a = min(max(int(first), 0), b - 1)
+    values = diff[a:b]
+    k = int(np.argmin(values))
+    flat = values >= values[k] / factor
+    after = np.flatnonzero(flat[k:])
+    before = np.flatnonzero(flat[1:k + 1])
+    dip_end = a + k + after[0] if len(after) else b - 1
+    dip_start = a + 1 + before[-1] if len(before) else min(a + 1, a + k)
+    return values[k], int(dip_start), int(dip_end)
+
+
 class MONITOR:
 
     models = ''
@@ -88,6 +130,8 @@ class MONITOR:
     threshold = 0  # trigger level for breath cycle
     threshold_factor = 1.25
     random = [0, 0, 0]  # percentage range for random varation in simulations
+    sampling = {}  # sampler.SAMPLER.report() of the last live run
+    alarms = None  # alarms.ALARMS over-pressure and apnea engine of the tracking modes
 
     # Stats taken from:
     # The basics of respiratory mechanics: ventilator-derived parameters
@@ -112,10 +156,17 @@ class MONITOR:
     }
 
     cycle_stats = []  # array of all cycle stats computed for data
+    breaths = 0  # breaths analyzed by track_realtime, cycle_stats keeps the last
 
-    def __init__(self):
+    def __init__(self, rate=None):
+        """
+        rate (float): samples per second when get_sample() is called on a
+                      fixed time grid, None if the times are irregular
+        """
         print("Setting up model.")
         self.models = model.BREATH()
+        self.cycle_stats = []  # per instance, not the shared class list
+        self.data = buffer.SAMPLES(rate=rate)  # [time, pressure] samples
         self.scale_model()  # add in peep, bpm and peak pressure point
 
     def enable_random(self, random=[0, 0, 0]):
@@ -132,22 +183,17 @@ class MONITOR:
         fig = plt.figure()
         ax1 = fig.add_subplot(1, 1, 1)
 
-        xar = []
-        yar = []
-        for eachLine in self.data:
-            if len(eachLine) > 1:
-                x, y = eachLine[1], eachLine[0]
-                yar.append(float(y))
-                xar.append(float(x))
+        datanp = buffer.as_array(self.data)
         # waveform
-        ax1.plot(yar, xar)
+        ax1.plot(datanp[:, 0], datanp[:, 1])
         plt.show()
 
     def compute(self, plot=True):
         """
         Computes parameters of all cycle samples in self.data
         """
-        self.datanp = np.array(self.data)  # convert to numpy array quickly
+        self.data = buffer.as_samples(self.data)  # list assigned by a caller
+        self.datanp = buffer.as_array(self.data)  # view of the samples, no copy
 
         peak = np.amax(self.datanp, axis=0)  # peak value
         peak_idx = np.argmax(self.datanp, axis=0)  # index with peak value
@@ -173,7 +219,8 @@ class MONITOR:
 
         for i in range(0, int(len(self.captured) / 2)):
             self.contours(i, threshold, plot)  # find points in cycle i
-            self.cycle_stats.append(self.stats)  # build list of dictionary stats
+            if len(self.stats) > 0:  # empty when the cycle was skipped
+                self.cycle_stats.append(self.stats)  # build list of dictionary stats
         if plot:
             plt.ylim(bottom=-3)  # return the current ylim
             plt.show()
@@ -187,50 +234,25 @@ class MONITOR:
         The detection is simple threshold crossings based on the minimum
         value found in the data sample.
         """
-        # xar is shifted to threshold
-        xar = np.subtract(self.datanp[:, 1], threshold)
-        breath_cnt = (np.diff(np.sign(xar)) != 0).sum()  # count crossings
-
-        # floor divide - > 3 crossings indicate 1 full breath cycle captured
-        # not used, just for illustration
-        breath_cnt = breath_cnt // 3
-
-        # algorithm to seperate each full cycle from data
-        cycle = 0
-        captured = []
-        captured_idx = []
-        for i in range(1, len(xar)):
-            # Looking for patterns in Negative (N) and Positive (P) crossings
-            # searching for sequence of N->P, P->N, N->P = full cycle
-            if cycle == 0 and xar[i] < 0:
-                # find first negative region N
-                cycle = 1
-            elif cycle == 1 and xar[i] > 0:
-                # positive region N->P Found
-                captured.append(self.data[i])  # start of inhalation
-                captured_idx.append(i)  # index of event
-                cycle = 2
-            elif cycle == 2 and xar[i] < 0:
-                cycle = 3  # start of pause P->N Found
-            elif cycle == 3 and xar[i] > 0:
-                # end of pause and start of next inhalation N->P
-                captured.append(self.data[i])
-                captured_idx.append(i)  # index of event
-                cycle = 1
-        if (len(captured) % 2) != 0:
-            # incomplete cycle found
-            captured.pop()  # partial waveform found remove start point
-            captured_idx.pop()
+        # Looking for patterns in Negative (N) and Positive (P) crossings
+        # searching for sequence of N->P, P->N, N->P = full cycle, the
+        # state machine is shared with every other entry point, see
+        # analysis.find_cycles.  An unfinished last cycle is left out.
+        cycles = analysis.find_cycles(self.datanp[:, 1], threshold)[0]
+        captured_idx = cycles.ravel().tolist()  # index of events
+        captured = [self.datanp[i].tolist() for i in captured_idx]
         self.captured = captured  # start/end pairs
         self.captured_idx = captured_idx  # start/end indices
 
-    def contours(self, cycle=0, threshold=10, plot=True):
+    def contours(self, cycle=0, threshold=10, plot=True, quiet=False):
         """
         Computes assents, descents and plateaus in selected cycle of waveform
         and it extracts some key parameters for stats dictionary
 
         Note the point of detecting where slope flattens is based on finding
         where the value is 1/factor of peak slope, where factor = the divisor
+
+        quiet (bool): same signature as MONITOR2.contours, nothing is printed
         """
         
         factor = 10  # divisor of peak slope to determine when it is flattening
@@ -245,7 +267,8 @@ class MONITOR:
 
         # section off data for analysis, may need to widen start/stop points
         # for a bigger window
-        self.datanp = np.array(self.data)  # copy over cycle to analyze
+        self.data = buffer.as_samples(self.data)
+        self.datanp = buffer.as_array(self.data)  # view, compute already has it
         data_cycle = self.datanp[start:end, :]  # slice cycle
 
         peak = np.amax(data_cycle, axis=0)[1]
@@ -255,14 +278,8 @@ class MONITOR:
         if plot:
             # plot full waveform
             ax1 = self.fig.add_subplot(1, 1, 1)
-            xar = self.data[:1]
-            xar = []
-            yar = []
-            for eachLine in self.data:
-                if len(eachLine) > 1:
-                    x, y = eachLine[1], eachLine[0]
-                    yar.append(float(y))
-                    xar.append(float(x))
+            yar = self.datanp[:, 0]  # time
+            xar = self.datanp[:, 1]  # pressure
 
             # plot waveform - full dataset only on cycle 0
             if cycle == 0:
@@ -285,15 +302,7 @@ class MONITOR:
         # Use the differential to detect slope
         # this is a descrete calculation of just (x1-x0)/(y1-y0),
         # (x2-x1)/(y2-y1)...(xn-xn-1)/(yn - yn-1)
-        x0=0
-        y0=0
-        diff=[]
-        for x,y in data_cycle:
-            m=(y-y0)/(x-x0)
-            x0=x
-            y0=y
-            diff.append(m)
-        diff=np.array(diff)
+        diff = derivative.slope(data_cycle[:, 0], data_cycle[:, 1])
  
         # Analyze derivative for slope changes
         # drop one y-axis point for plotting differential
@@ -301,6 +310,11 @@ class MONITOR:
         diff_min = np.amin(diff)  # min value
         i = np.argmax(diff)  # index for max point (start inhalation)
         j = np.argmin(diff)  # index for min point (possible start exhalation)
+        if i >= j:
+            # steepest fall before the steepest rise, the cycle starts
+            # inside an exhalation and has no inhalation to bracket
+            self.stats = {}
+            return
 
         if plot:
             # show peak
@@ -308,17 +322,15 @@ class MONITOR:
             ax1.text(data_cycle[peak_idx][0], peak * 1.02, "Peak {:2.1f}".format(peak))
 
             # Show differential crossings cycle
-            yar.pop()    
+            yar = yar[:-1]
             # ax1.plot(yar[start:end], diff)
             # ax1.plot([yar[start],yar[-1]], [0,0])  # reference crossings
 
         # Find end of rising inhalation
         # search between max diff and min diff point for slope changes
-        # look for where the slope drops by a factor of the peak
-        for x in range(i, j):
-            if diff[x] < 0:  # look at points where slope starts to fall
-                if diff[x] <= diff_min / factor:  # slope slows by this factor
-                    break
+        # look for where the first falling slope reaches a factor of the
+        # steepest fall, the last sample before the steepest fall if none
+        x = first_of((diff[i:j] < 0) & (diff[i:j] <= diff_min / factor), j - 1 - i) + i
         j = x  # this might now be the start of exhalation or peak decay
 
         if plot:
@@ -327,9 +339,8 @@ class MONITOR:
 
         # search between max diff and min diff point for slope changes
         # look for where the slope drops by a factor of the peak
-        for x in range(i, j):
-            if diff[x] <= diff_max / factor:  # slope slows by this factor
-                break
+        if j > i:
+            x = first_of(diff[i:j] <= diff_max / factor, j - 1 - i) + i
         j2 = x  # possible end of exhalation cycle
 
         if plot:
@@ -338,9 +349,7 @@ class MONITOR:
 
         # search after min diff point for slope changes
         # look for where the slope drops by a factor of the peak
-        for x in range(j, len(data_cycle)):
-            if diff[x] >= diff_min / factor:  # slope slows by this factor
-                break
+        x = first_of(diff[j:] >= diff_min / factor, len(data_cycle) - 1 - j) + j
         diff_min_idx = x  # index of the end of the exhalation slope
         j2 = x
 
@@ -353,43 +362,15 @@ class MONITOR:
         x_spec = x  # bracket off remaining cycle from minimum
         if x + 10 < len(diff):
             x_spec = x + 10
-        diff_min_special = np.amin(diff[x_spec:])
-        diff_min_special_idx = np.argmin(diff[x_spec:]) + x_spec  # second dip found
+        # second dip, start and end of its slope, always inside the cycle
+        diff_min_special, dip_start, dip_end = second_dips(diff, x_spec, len(diff), factor)
 
-        use_special_case = False
         # is it similar in magnitude? +/- 0.3
         if diff_min_special != 0 and diff_min_special != diff_min:
             if (diff_min / diff_min_special) < 1.3 and (diff_min / diff_min_special) > 0.7:
-                use_special_case = True
                 # could also add time window check to see Ppeak close or equal to Pplat
-
-        # reverse from minimum and search for start of slope
-        # by finding where slope drops by a factor of the peak
-        for x in range(diff_min_special_idx, x_spec, -1):
-            if diff[x] >= diff_min_special / factor:  # slope slows by this factor
-                break
-        diff_min_special_idx = x   # index of the end of the exhalation slope
-
-        # look for where the slope drops by a factor of the peak
-        for x in range(x_spec, len(data_cycle)):
-            if diff[x] >= diff_min_special / factor:  # slope slows by this factor
-                break
-        diff_min_special_idx2 = x + x_spec  # index of the end of the exhalation slope
-
-        if use_special_case:
-            j = diff_min_special_idx
-            j2 = diff_min_special_idx2
-
-        # second minimum limit checks
-        # will plot exhale lines to end of cycle if error occurs
-        # this is for checking this condition and checking algorithm sanity
-        if j>len(data_cycle):
-            print("{} j too big".format(j))
-            j=len(data_cycle) - 10
-        if j2>len(data_cycle):
-            print("{} j2 too big".format(j2))
-            j2=len(data_cycle) - 1
-            
+                j = dip_start
+                j2 = dip_end
 
         if plot:
             ax1.plot([data_cycle[j][0], data_cycle[j][0]], [0, peak],
@@ -397,9 +378,9 @@ class MONITOR:
             ax1.plot([data_cycle[j2][0], data_cycle[j2][0]], [0, peak],
                      'g-')  # second minium found -- end
 
-        # Plot Plateau
-        ax1.plot(data_cycle[j][0], data_cycle[j][1], 'r*')
-        ax1.text(data_cycle[j][0], data_cycle[j][1], "Pplat {:2.1f}".format(data_cycle[j][1]))
+            # Plot Plateau
+            ax1.plot(data_cycle[j][0], data_cycle[j][1], 'r*')
+            ax1.text(data_cycle[j][0], data_cycle[j][1], "Pplat {:2.1f}".format(data_cycle[j][1]))
 
         # inspiry time -- trigger time to peak time
         # self.datanp[peak_idx][0] - self.datanp[i][0]
@@ -415,19 +396,20 @@ class MONITOR:
 
         # Find P01 100ms into inhalation
         # linear interpolation to find value
-        P01 = np.interp(self.data[start][0] + 0.1,
+        P01 = np.interp(self.datanp[start][0] + 0.1,
                         data_cycle[:, 0], data_cycle[:, 1])
+        times = self.datanp[:, 0]
+        rate = buffer.rate_of(self.data)  # None searches the timestamps
         if plot:
-            ydelta = (self.data[start+4][0] - self.data[start][0])/5
-            jump = int(0.1/ydelta)  # estimate index @ 0.1s for plotting
-            ax1.plot([self.data[start+jump][0]], [P01], 'ro')
-            ax1.text(self.data[start+jump][0], P01, "P0.1 {:2.1f}".format(P01))
+            jump = buffer.nearest(times, times[start] + 0.1, rate)  # sample @ 0.1s
+            ax1.plot([self.datanp[jump][0]], [P01], 'ro')
+            ax1.text(self.datanp[jump][0], P01, "P0.1 {:2.1f}".format(P01))
 
         # Find PTP for cycle
         PTPavg = np.average(data_cycle[0:peak_idx], axis=0)[1]
         if plot:
             text = "PTP={:2.1f}".format(PTPavg)
-            ax1.text(self.data[int(start+peak_idx/2)][0], peep_min, text,
+            ax1.text(self.datanp[int(start+peak_idx/2)][0], peep_min, text,
                      verticalalignment='top')
 
         # I:E ratio
@@ -436,7 +418,7 @@ class MONITOR:
         denom1 = denom1/nomin1
         ie_text = "1:{:1.1f}".format(denom1)
         if plot:
-            ax1.text(self.data[int(start+peak_idx)][0], 0, ie_text,
+            ax1.text(self.datanp[int(start+peak_idx)][0], 0, ie_text,
                      verticalalignment='top')
 
         # PEEPi
@@ -444,13 +426,12 @@ class MONITOR:
         # of the next inhalation cycle at the threshold point
         # Also high PEEPi values might interfere with threshold
         # estimations which are based off peep_min
-        ydelta = (self.data[end][0] - self.data[end-4][0])/5
-        jump = int(0.05/ydelta)  # estimate index @ 0.05s for plotting
-        peepi = self.data[end-jump][1] - peep_min
+        jump = buffer.before(times, times[end] - 0.05, rate)  # last sample 0.05s before end
+        peepi = self.datanp[jump][1] - peep_min
         text = "PEEPi={:2.1f}".format(peepi)
         if plot:
-            ax1.plot(self.data[end-jump][0], self.data[end-jump][1], "g*")
-            ax1.text(self.data[end][0], -5, text,
+            ax1.plot(self.datanp[jump][0], self.datanp[jump][1], "g*")
+            ax1.text(self.datanp[end][0], -5, text,
                      verticalalignment='bottom')
             
         # Populate stats dictionary
@@ -464,14 +445,14 @@ class MONITOR:
         self.stats["Epause"] = round(data_cycle[-1][0] - data_cycle[j2][0], 2)
         self.stats["I:E"] = ie_text
         self.stats["Pplat"] = round(data_cycle[j][1], 2)
-        self.stats["Start"] = round(self.data[start][0], 2)
-        self.stats["End"] = round(self.data[end][0], 2)
+        self.stats["Start"] = round(self.datanp[start][0], 2)
+        self.stats["End"] = round(self.datanp[end][0], 2)
         self.stats["Vt"] = 0      # not done
         self.stats["dP"] = round(data_cycle[j][1] - peep_min, 2)
         self.stats["Pl"] = 0      # not done
         self.stats["P01"] = round(P01, 2)
         self.stats["PTP"] = round(PTPavg, 2)
-        self.stats["RR"] = round((1 / (self.data[end][0] - self.data[start][0])) * 60, 2)
+        self.stats["RR"] = round((1 / (self.datanp[end][0] - self.datanp[start][0])) * 60, 2)
             
     def get_sample(self, time):
         """ Retrivies single sample from model with specified time index """
@@ -492,60 +473,257 @@ class MONITOR:
     def track_breath(self, cycles=1, timeout=10,
                      sample_rate=0.01, max_peak=35):
         """ Tracks breath cycles in real time
- 
+
+        Samples are taken by a sampler.SAMPLER thread and read back here, so
+        the trigger logic and compute() never hold up sampling.
+
         Parameters:
         cycles (int): number of cycles (breaths) to track then analyze
-        timeout (int): seconds to search for pattern before aborting @TODO
+        timeout (int): seconds without a completed breath before aborting
         sample_rate (float): seconds between pressure samples
-        max_peak (float): if measured above this value generate alarm @TODO
+        max_peak (float): samples above this value raise a Pressure alarm
 
         Returns:
         bool: returns 0 for failure, 1 for success, data is moved into self.data
-        and self.cycle_stats
+        and self.cycle_stats, sampling counters into self.sampling
         """
 
-        buffer = []
-        sample_time = 0.0
+        samples = buffer.SAMPLES(rate=1 / sample_rate)  # sampler time base
         breath_cnt = 0
         state = 0  # no trigger
+        self.enable_alarms(max_peak, timeout)
+        thread = self.start_sampler(sample_rate)
+        deadline = time.monotonic() + timeout  # apnea / disconnect
 
-        # loop to sample data
+        # loop to read samples
         print("Sampling sensor {} cycles :: {} sample rate :: {} threshold"
               .format(cycles, sample_rate, self.threshold))
-        while breath_cnt < cycles:   # no timeout yet
-            time.sleep(sample_rate)  # wait for sample - @TODO use RTC elapsed
-            point = self.models.get_simulated_data(sample_time, self.random)  # simulated
-            buffer.append([sample_time, point])
-            sample_time = sample_time + sample_rate
-
-            if point > max_peak:
-                print("ALERT! Max Pressure Limit Exceeded!")
-                # @TODO
-                # alarm UI and adjust motor mechanism if necessary
-
-            # Test for threshold crossings
-            if state == 0:
-                # waiting for trigger positive
-                if len(buffer) > 10 and breath_cnt == 0:
+        while breath_cnt < cycles:
+            if time.monotonic() > deadline:
+                thread.stop()
+                self.sampling = thread.report()
+                print("*** WARNING no breath for {}s, tracking aborted".format(timeout))
+                return False
+            rows = thread.ring.read()
+            if len(rows) == 0:
+                time.sleep(sample_rate)  # wait for samples
+                continue
+            for sample_time, point in rows:
+                if breath_cnt >= cycles:
+                    break
+                samples.append([sample_time, point])
+                if state == 0 and len(samples) > 10 and breath_cnt == 0:
                     # slice of last 10 samples to try to place start cycle in
                     # same time window every so waveform looks triggered
-                    buffer = buffer[-10:]
-                if point > self.threshold:
-                    state = 1
-                    continue
-            if state == 1:
-                # rising, wait for fall
-                if point < self.threshold:
-                    state = 2
-                    continue
-            if state == 2:                # fallen, wait for start of next rise
-                if point > self.threshold:
-                    state = 0
-                    breath_cnt = breath_cnt + 1
-        self.data = buffer
+                    samples.keep(10)
+                self.check_sample(sample_time, point)
+                state, done = self.trigger(state, point)
+                if done:
+                    breath_cnt += 1
+                    deadline = time.monotonic() + timeout
+        thread.stop()
+        self.sampling = thread.report()
+        self.data = samples
         self.compute()  # process samples
         return True
 
+    def track_realtime(self, seconds=None, timeout=10, sample_rate=0.01,
+                       max_peak=35, callback=None, history=1000):
+        """ Tracks and analyzes every breath as it completes
+
+        Runs continuously instead of in bursts of cycles: each sample is
+        checked for over-pressure the moment it is read, each breath is
+        analyzed with contours() as soon as its end is triggered and only
+        that breath is kept in memory.  Apnea (no breath) and disconnect (no
+        samples) are detected against time.monotonic(), so they still fire
+        when the sensor stops delivering.
+
+        Parameters:
+        seconds (float): how long to run, None runs until interrupted
+        timeout (float): seconds without a breath before the Apnea alarm
+        sample_rate (float): seconds between pressure samples
+        max_peak (float): samples above this value raise a Pressure alarm
+        callback (function): called with every stats dictionary and every
+                             alarm event (dicts from alarms.ALARMS)
+        history (int): breaths kept in self.cycle_stats, older ones are
+                       dropped so memory stays fixed, the callback sees all
+
+        Returns:
+        dict: sampling counters plus per sample decision latency in ms
+              (time from when the sample was due to its trigger and alarm
+              decision) and how many decisions came over a period late,
+              also kept in self.sampling
+        """
+        samples = buffer.SAMPLES(rate=1 / sample_rate)  # sampler time base
+        self.cycle_stats = deque(maxlen=history)
+        self.breaths = 0
+        state = 0
+        latency = [0, 0.0, 0.0, 0]  # decisions, total, worst (s), over a period
+        self.enable_alarms(max_peak, timeout)
+        thread = self.start_sampler(sample_rate)
+        stop = None if seconds is None else time.monotonic() + seconds
+        # sampler clock (monotonic) to the alarm engine clock (perf_counter)
+        offset = time.perf_counter() - time.monotonic()
+
+        try:
+            while stop is None or time.monotonic() < stop:
+                rows = thread.ring.read()
+                if len(rows) == 0:
+                    if thread.started is not None:
+                        # no samples arriving, apnea on the wall clock
+                        for event in self.alarms.check_time(
+                                time.monotonic() - thread.started):
+                            self.alert(event, callback)
+                    time.sleep(sample_rate / 4)  # polling bounds the decision latency
+                    continue
+                for sample_time, point in rows:
+                    due = thread.started + sample_time
+                    samples.append([sample_time, point])
+                    if state == 0 and len(samples) > 10 and self.breaths == 0:
+                        samples.keep(10)  # first breath starts just before a trigger
+                    self.check_sample(sample_time, point, due + offset, callback)
+                    state, done = self.trigger(state, point)
+                    delay = time.monotonic() - due
+                    latency[0] += 1
+                    latency[1] += delay
+                    latency[2] = max(latency[2], delay)
+                    latency[3] += delay > sample_rate
+                    if done:
+                        self.breath(samples, callback)
+        except KeyboardInterrupt:
+            pass
+        thread.stop()
+        self.sampling = thread.report()
+        self.sampling["Breaths"] = self.breaths
+        self.sampling["Alarms"] = self.alarms.raised
+        self.sampling["LatencyMean"] = round(float(latency[1]) / max(latency[0], 1) * 1000, 3)
+        self.sampling["LatencyMax"] = round(float(latency[2]) * 1000, 3)
+        self.sampling["LatencyOver"] = int(latency[3])  # decided over a period late
+        return self.sampling
+
+    def breath(self, samples, callback=None):
+        """ contours of the breath that just ended at the last sample """
+        self.data = samples
+        self.datanp = samples.view()
+        cycles = analysis.find_cycles(self.datanp[:, 1], self.threshold)[0]
+        if len(cycles) == 0:
+            return
+        self.captured_idx = cycles[-1].tolist()
+        self.captured = [self.datanp[i].tolist() for i in self.captured_idx]
+        self.contours(0, self.threshold, plot=False)
+        if len(self.stats):
+            self.breaths += 1
+            self.cycle_stats.append(self.stats)
+            if callback is not None:
+                callback(self.stats)
+            for event in self.alarms.check_breath(self.stats):
+                self.alert(event, callback)
+        # keep a few samples before the next breath starts
+        samples.keep(len(samples) - cycles[-1][1] + 10)
+
+    def track_live(self, seconds=10, cycles=1, sample_rate=0.01, max_peak=35):
+        """ Samples and analyzes continuously on separate threads
+
+        A sampler.SAMPLER thread samples at sample_rate while a
+        sampler.ANALYZER thread runs the trigger logic and computes every
+        group of cycles as it completes, stats go to self.cycle_stats.
+        Analysis is done without plotting, matplotlib is not thread safe.
+
+        Parameters:
+        seconds (float): how long to run
+        cycles (int): breaths per compute
+        sample_rate (float): seconds between pressure samples
+        max_peak (float): samples above this value raise a Pressure alarm
+
+        Returns:
+        dict: sampling counters (samples, late, jitter, queue depth, overruns)
+        """
+        samples = buffer.SAMPLES(rate=1 / sample_rate)  # sampler time base
+        track = {"state": 0, "breaths": 0}
+        self.enable_alarms(max_peak, 0)
+
+        def analyze(rows):
+            for sample_time, point in rows:
+                samples.append([sample_time, point])
+                if track["state"] == 0 and track["breaths"] == 0 and len(samples) > 10:
+                    samples.keep(10)  # waveform starts just before a trigger
+                self.check_sample(sample_time, point)
+                track["state"], done = self.trigger(track["state"], point)
+                track["breaths"] += done
+                if track["breaths"] == cycles:
+                    self.data = buffer.SAMPLES.wrap(samples.view(), samples.rate)
+                    self.compute(plot=False)
+                    samples.keep(10)
+                    track["breaths"] = 0
+
+        thread = self.start_sampler(sample_rate)
+        analyzer = sampler.ANALYZER(thread.ring, analyze)
+        analyzer.start()
+        time.sleep(seconds)
+        thread.stop()
+        analyzer.stop()
+        self.sampling = thread.report()
+        if analyzer.error is not None:
+            print("*** WARNING analysis stopped: {}".format(analyzer.error))
+        return self.sampling
+
+    def start_sampler(self, sample_rate):
+        """ sampler thread reading the model at sample_rate """
+        thread = sampler.SAMPLER(
+            lambda t: self.models.get_simulated_data(t, self.random),
+            sample_rate, sampler.RING(int(60 / sample_rate)))  # 60s deep
+        thread.start()
+        return thread
+
+    def enable_alarms(self, max_peak=35, timeout=10, limits=None):
+        """
+        Over-pressure and apnea alarms for the tracking modes
+
+        max_peak (float): a single sample above this raises a Pressure alarm
+        timeout (float): seconds without a breath before Apnea, 0 disables
+        limits (dict): {parameter: [low, high, debounce]} breath rules
+        """
+        self.alarms = alarms.ALARMS(limits=limits, pressure_limit=[None, max_peak, 1],
+                                    apnea=timeout, threshold=self.threshold)
+
+    def check_sample(self, sample_time, point, arrival=None, callback=None):
+        """ alarm events raised by one sample, reported as they happen """
+        if self.alarms is None:
+            return []
+        events = self.alarms.check_sample(sample_time, point, arrival)
+        for event in events:
+            self.alert(event, callback)
+        return events
+
+    def alert(self, event, callback=None):
+        """ print an alarm event, or hand it to callback """
+        if callback is None:
+            print("ALERT! {} {} = {} limit {} @{:1.2f}s".format(
+                event["Priority"], event["Alarm"], event["Value"],
+                event["Limit"], event["Time"]))
+        else:
+            callback(event)
+
+    def trigger(self, state, point):
+        """ Threshold crossing state machine of track_breath
+
+        Returns:
+        state, done: next state and 1 when a breath cycle just completed
+        """
+        # Test for threshold crossings
+        if state == 0:
+            # waiting for trigger positive
+            if point > self.threshold:
+                return 1, 0
+        elif state == 1:
+            # rising, wait for fall
+            if point < self.threshold:
+                return 2, 0
+        elif state == 2:  # fallen, wait for start of next rise
+            if point > self.threshold:
+                return 0, 1
+        return state, 0
+
     def print(self):
         i = 0
         for item in self.cycle_stats:
@@ -26,6 +26,13 @@ import matplotlib.pyplot as plt
 import time
 from pathlib import Path
 import model2
+import alarms
+import trends
+import breathlog
+import downsample
+import derivative
+import buffer
+import analysis
 
 #
 # Notes on Parameters
@@ -93,7 +100,14 @@ class MONITOR2:
     max_time = 0
     threshold = 0  # trigger level for breath cycle
     threshold_factor = 1.25
+    threshold_percentile = 0  # PEEP floor percentile for the threshold, 0 lowest sample
+    slope_factor = 10  # divisor of peak slope to determine when it is flattening
     random = [0, 0, 0]  # percentage range for random varation in simulations
+    alarms = None  # alarms.ALARMS engine checked after every breath
+    trends = None  # trends.TRENDS rollups updated after every breath
+    log = None  # breathlog.WRITER every computed breath is appended to
+    smooth = None  # slope smoothing None, 'ma' or 'savgol' see derivative.py
+    smooth_window = 7  # samples in slope smoothing window
 
     # Stats taken from:
     # The basics of respiratory mechanics: ventilator-derived parameters
@@ -122,6 +136,48 @@ class MONITOR2:
     def __init__(self, model_file=''):
         print("Setting up model.")
         self.models = model2.BREATH2(filename=model_file)
+        self.data = buffer.SAMPLES(rate=self.models.rate)  # [time, pressure] samples
+
+    @property
+    def derivative(self):
+        """
+        Slope of self.data computed once and shared by contours/plot_diff,
+        rebuilt when smooth or smooth_window are changed
+        """
+        cache = self.__dict__.get("_slopes")
+        settings = (self.smooth, self.smooth_window)
+        if cache is None or (cache.smooth, cache.window) != settings:
+            cache = derivative.DERIVATIVE(self.smooth, self.smooth_window)
+            self._slopes = cache
+        return cache
+
+    def enable_alarms(self, limits=None, apnea=20):
+        """
+        Check every computed breath against alarm limits
+
+        limits (dict): {parameter: [low, high, debounce]} see alarms.py
+        apnea (float): seconds without a breath before alarming
+        """
+        self.alarms = alarms.ALARMS(limits=limits, apnea=apnea)
+
+    def enable_trends(self, minutes=1440, hours=720):
+        """
+        Keep per-minute and per-hour rollups of every computed breath
+
+        minutes (int): minute buckets kept (1440 = 24h)
+        hours (int): hour buckets kept
+        """
+        self.trends = trends.TRENDS(minutes=minutes, hours=hours)
+
+    def enable_log(self, filename, batch=50, interval=10):
+        """
+        Append every computed breath to a crash safe log, see breathlog.py
+
+        filename (str): .vbl log, an existing log is recovered and appended to
+        batch (int): breaths between fsyncs
+        interval (float): most seconds between fsyncs
+        """
+        self.log = breathlog.WRITER(filename, batch=batch, interval=interval)
 
     def plot(self, title=''):
         """
@@ -130,18 +186,11 @@ class MONITOR2:
         fig = plt.figure()
         ax1 = fig.add_subplot(1, 1, 1)
 
-        xar = []
-        yar = []
-        for eachLine in self.data:
-            if len(eachLine) > 1:
-                x, y = eachLine[1], eachLine[0]
-                yar.append(float(y))
-                xar.append(float(x))
-
+        datanp = buffer.as_array(self.data)
         if title != '':
             ax1.set_title(title)
-        # waveform
-        ax1.plot(yar, xar)
+        # waveform - decimated to screen resolution for long recordings
+        downsample.plot(ax1, datanp[:, 0], datanp[:, 1])
         plt.show()
 
     def plot_diff(self, title=''):
@@ -152,38 +201,25 @@ class MONITOR2:
         ax1 = plt.subplot(211)
         ax2 = plt.subplot(212, sharex=ax1)
 
-        xar = []
-        yar = []
-        for eachLine in self.data:
-            if len(eachLine) > 1:
-                x, y = eachLine[1], eachLine[0]
-                yar.append(float(y))
-                xar.append(float(x))
-
-        x0 = 0
-        y0 = 0
-        diff = []
-        for x, y in self.data:
-            m = (y - y0) / (x - x0)
-            x0 = x
-            y0 = y
-            diff.append(m)
-        diff = np.array(diff)
-                
+        datanp = buffer.as_array(self.data)
+        diff = self.derivative.get(self.data, datanp)
+
         if title != '':
             ax1.set_title(title)
         # waveforms
-        ax1.plot(yar, xar)
-        ax2.plot(yar, diff)
+        downsample.plot(ax1, datanp[:, 0], datanp[:, 1])
+        downsample.plot(ax2, datanp[:, 0], diff)
         plt.show()
 
-    def compute(self, plot=True, title=''):
+    def compute(self, plot=True, title='', quiet=False):
         """
         Computes parameters of all cycle samples in self.data
 
         Uses: find_cycles -> contours
+        quiet (bool): skip the per cycle warnings, for batch callers
         """
-        self.datanp = np.array(self.data)  # convert to numpy array quickly
+        self.data = buffer.as_samples(self.data)  # list assigned by a caller
+        self.datanp = buffer.as_array(self.data)  # view of the samples, no copy
 
         peak = np.amax(self.datanp, axis=0)  # peak value
         peak_idx = np.argmax(self.datanp, axis=0)  # index with peak value
@@ -196,7 +232,9 @@ class MONITOR2:
         self.max_time = peak[0]
 
         if self.threshold == 0:
-            threshold = self.peep_min * self.threshold_factor  # factor for trigger
+            # factor for trigger, see analysis.trigger
+            threshold = analysis.trigger(self.datanp[:, 1], self.threshold_factor,
+                                         self.threshold_percentile)
         else:
             threshold = self.threshold
 
@@ -207,20 +245,45 @@ class MONITOR2:
 
             if title != '':
                 self.ax1.set_title(title)
+            self.diff_t = []  # differential of each cycle, plotted at once
+            self.diff_v = []
 
         self.threshold = threshold
         self.find_cycles(threshold)  # find start/end points of each cycle
 
         for i in range(0, int(len(self.captured) / 2)):
-            self.contours(i, threshold, plot)  # find points in cycle i
-            self.cycle_stats.append(self.stats)  # build list of dictionary stats
-                    
+            self.contours(i, threshold, plot, quiet)  # find points in cycle i
+            self.store_stats()
+
         if plot:
+            # differential of all cycles as one decimated line, a nan after
+            # each cycle keeps the line from joining one cycle to the next
+            self.ax2.set_title("Differential")
+            if len(self.diff_t) > 0:
+                downsample.plot(self.ax2,
+                                np.concatenate([np.append(t, t[-1]) for t in self.diff_t]),
+                                np.concatenate([np.append(v, np.nan) for v in self.diff_v]))
+            self.ax2.axhline(0, color='C1')  # reference crossings
             # rescale and display
             self.ax1.set_ylim(bottom=-5, top=self.peak*1.3)
             self.ax2.autoscale(axis='y')
             plt.show()
 
+    def store_stats(self):
+        """ Keep stats of the cycle just analyzed by contours """
+        if len(self.stats) == 0:
+            return  # cycle was skipped
+        self.cycle_stats.append(self.stats)  # build list of dictionary stats
+        if self.trends is not None:
+            self.trends.add(self.stats)
+        if self.log is not None:
+            self.log.append(self.stats)
+        if self.alarms is not None:
+            for event in self.alarms.check_breath(self.stats):
+                print("ALERT! {} {} = {} limit {}".format(
+                    event["Priority"], event["Alarm"], event["Value"],
+                    event["Limit"]))
+
     def find_cycles(self, threshold, plot=True):
         """
         Sweeps through captured data and finds breath cycles
@@ -230,53 +293,29 @@ class MONITOR2:
         The detection is simple threshold crossings based on the minimum
         value found in the data sample.
         """
-        # xar is shifted to threshold
-        xar = np.subtract(self.datanp[:, 1], threshold)
-        breath_cnt = (np.diff(np.sign(xar)) != 0).sum()  # count crossings
-
-        # floor divide - > 3 crossings indicate 1 full breath cycle captured
-        # not used, just for illustration
-        breath_cnt = breath_cnt // 3
-
-        # algorithm to seperate each full cycle from data
-        state = 0
-        captured = []
-        captured_idx = []
-        for i in range(1, len(xar)):
-            # Looking for patterns in Negative (N) and Positive (P) crossings
-            # searching for sequence of N->P, P->N, N->P = full cycle
-            if state == 0 and xar[i] < 0:
-                # find first negative region N
-                state = 1
-            elif state == 1 and xar[i] > 0:
-                # positive region N->P Found
-                captured.append(self.data[i])  # start of inhalation
-                captured_idx.append(i)  # index of event
-                state = 2
-            elif state == 2 and xar[i] < 0:
-                state = 3  # start of pause P->N Found
-            elif state == 3 and xar[i] > 0:                # end of pause and start of next inhalation N->P
-                captured.append(self.data[i])
-                captured_idx.append(i)  # index of event
-                state = 1
-
-        if (len(captured) % 2) != 0:
-            # incomplete cycle found
-            captured.pop()  # partial waveform found remove start point
-            captured_idx.pop()
+        # Looking for patterns in Negative (N) and Positive (P) crossings
+        # searching for sequence of N->P, P->N, N->P = full cycle, the
+        # state machine is shared with every other entry point, see
+        # analysis.find_cycles.  An unfinished last cycle is left out.
+        cycles = analysis.find_cycles(self.datanp[:, 1], threshold)[0]
+        captured_idx = cycles.ravel().tolist()  # index of events
+        captured = [self.datanp[i].tolist() for i in captured_idx]
         self.captured = captured  # start/end pairs
         self.captured_idx = captured_idx  # start/end indices
 
-    def contours(self, cycle=0, threshold=10, plot=True):
+    def contours(self, cycle=0, threshold=10, plot=True, quiet=False):
         """
         Computes assents, descents and plateaus in selected cycle of waveform
         and it extracts some key parameters for stats dictionary
 
         Note the point of detecting where slope flattens is based on finding
         where the value is 1/factor of peak slope, where factor = the divisor
+
+        quiet (bool): skip the per cycle warnings, for batch callers
         """
         
-        factor = 10  # divisor of peak slope to determine when it is flattening
+        factor = self.slope_factor  # divisor of peak slope to determine when it is flattening
+        warn = (lambda *args: None) if quiet else print
 
         if len(self.captured) % 2 > cycle:
             # requested cycle doesn't exist in waveform
@@ -285,27 +324,15 @@ class MONITOR2:
         cycle = cycle * 2  # cycles are in pairs start, end
         start = self.captured_idx[cycle]
         end = self.captured_idx[cycle + 1]
-
-        # section off data for analysis, may need to widen start/stop points
-        # for a bigger window
-        self.datanp = np.array(self.data)  # copy over cycle to analyze
-        data_cycle = self.datanp[start:end, :]  # slice cycle
-
-        peak = np.amax(data_cycle, axis=0)[1]
-        peak_idx = np.argmax(data_cycle, axis=0)[1]
-        peep_min = np.amin(data_cycle, axis=0)[1]
+        self.data = buffer.as_samples(self.data)
+        self.datanp = buffer.as_array(self.data)  # view, compute already has it
 
         if plot:
-            if cycle == 0: # only plot if starting on cycle 0
-                self.xar = []
-                self.yar = []
-                for eachLine in self.data:
-                    if len(eachLine) > 1:
-                        x, y = eachLine[1], eachLine[0]
-                        self.yar.append(float(y))
-                        self.xar.append(float(x))
-
-                self.ax1.plot(self.yar, self.xar)
+            if cycle == 0: # only plot if starting on cycle 0, short or not
+                self.yar = self.datanp[:, 0]  # time
+                self.xar = self.datanp[:, 1]  # pressure
+
+                downsample.plot(self.ax1, self.yar, self.xar)
                 self.ax1.plot([self.yar[0], self.yar[-1]], [threshold, threshold], 'r:')
                 self.ax1.text(self.yar[int(len(self.yar) / 2)], threshold, "Threshold {:1.1f}".format(threshold))
                 for i in range(0, len(self.captured), 2):
@@ -313,6 +340,20 @@ class MONITOR2:
                     self.ax1.text(self.captured[i + 1][0],
                              0,"E", horizontalalignment='right')  # End cycle
 
+        if end - start < 5:
+            # glitch across the threshold, too short to analyze
+            warn("*** WARNING @{}s cycle of {} samples skipped".format(self.datanp[start][0], end - start))
+            self.stats = {}
+            return
+
+        # section off data for analysis, may need to widen start/stop points
+        # for a bigger window
+        data_cycle = self.datanp[start:end, :]  # slice cycle
+
+        peak = np.amax(data_cycle, axis=0)[1]
+        peak_idx = np.argmax(data_cycle, axis=0)[1]
+        peep_min = np.amin(data_cycle, axis=0)[1]
+
         # Inhalation and Exhalation Detection Method
         #
         # Take the derivative of the waveform
@@ -323,43 +364,37 @@ class MONITOR2:
 
         # Use the differential to detect slope
         # this is a descrete calculation of just (x1-x0)/(y1-y0),
-        # (x2-x1)/(y2-y1)...(xn-xn-1)/(yn - yn-1)
-        x0 = 0
-        y0 = 0
-        diff = []
-        avg_time_samples = 0
-        for x, y in data_cycle:
-            m = (y - y0) / (x - x0)
-            avg_time_samples += (y - y0)  # compute average time spacing for samples
-            x0 = x
-            y0 = y
-            diff.append(m)
-        diff = np.array(diff)
-        avg_time_samples /= len(diff)
+        # (x2-x1)/(y2-y1)...(xn-xn-1)/(yn - yn-1) optionally smoothed,
+        # computed once for the whole buffer and sliced for this cycle
+        diff = self.derivative.get(self.data, self.datanp)[start:end]
+        times = data_cycle[:, 0]
+        rate = buffer.rate_of(self.data)  # None searches the timestamps
 
-        ##
-        # Samples to move past peak before seaching for minimum
-        ##
-        skip = int(round(0.3 / avg_time_samples, 0))
+        # slopes equal in the samples differ by float rounding of the time and
+        # pressure steps, compare within tol so ties go to the first sample
+        # like the integer lite.py path
+        tol = 1e-9 * np.amax(np.abs(diff))
 
         # find peak positive
         diff_max = np.amax(diff)  # max value
-        idx_max = np.argmax(diff)  # index for max point (start inhalation)
+        # index for max point (start inhalation)
+        idx_max = np.flatnonzero(diff >= diff_max - tol)[0]
+
+        ##
+        # Samples to move past peak before seaching for minimum
+        ##
+        spacing = 1 / rate if rate else np.mean(np.diff(times))  # average time spacing for samples
+        skip = int(round(0.3 / spacing, 0))
         # find peak minimum after maximum has occured
-        if idx_max + skip > len(diff):
-            print("*** Warning @{}s max occured near end of threashold cycle".format(data_cycle[idx_max][0]))
+        if idx_max + skip >= len(diff):
+            warn("*** Warning @{}s max occured near end of threashold cycle".format(data_cycle[idx_max][0]))
             skip = 0
         diff_min = np.amin(diff[idx_max + skip:])  # min value
-        # For some reason np.argmin doesn't work properly
-        # idx_min = np.argmin(diff[idx_max + skip:])
-        # do manual search for minimum
-        find=0
-        find_idx=0
-        for x in range(idx_max+skip, len(diff)):
-            if diff[x] < find:
-                find=diff[x]
-                find_idx=x
-        idx_min=find_idx
+        # first falling minimum after the skip, 0 when the slope never falls
+        idx_min = 0
+        if diff_min < -tol:
+            falling = np.flatnonzero(diff[idx_max + skip:] <= diff_min + tol)
+            idx_min = idx_max + skip + falling[0]
         
         # idx_max is index for peak max value
         # idx_min is now suspected center peak for exhale
@@ -369,7 +404,7 @@ class MONITOR2:
         for n in range(idx_max, -1, -1):
             # find start of inhalation
             # print(n, diff[n], diff_max/factor)
-            if diff[n] < diff_max/factor:
+            if diff[n] < diff_max/factor - tol:
                 idx_max_start = n
                 break
         if idx_max_start < 1:
@@ -382,22 +417,22 @@ class MONITOR2:
         # test from max to min location
         idx_max_end = idx_min  # initial value
         for n in range(idx_max, idx_min):
-            if diff[n] < diff_max/factor:
+            if diff[n] < diff_max/factor - tol:
                 idx_max_end = n
                 break
         if idx_max_end == idx_min:
-            print("*** WARNING {}s end of inhalation not detected".format(data_cycle[idx_max_end][0]))
+            warn("*** WARNING {}s end of inhalation not detected".format(data_cycle[idx_max_end][0]))
 
         # Find exhalation points
         # bracket exhalation slope down to start
         idx_min_start = idx_max  # initial value
         for n in range(idx_min, peak_idx, -1):
             # find start of exhalation
-            if diff[n] >= diff_min/factor:
+            if diff[n] >= diff_min/factor - tol:
                 idx_min_start = n
                 break
         if idx_min_start == 0:
-            print("*** WARNING {}s start of exhalation probably invalid".format(data_cycle[idx_min_start][0]))
+            warn("*** WARNING {}s start of exhalation probably invalid".format(data_cycle[idx_min_start][0]))
 
         # bracket exhalation slope up to end location
         # test from max to min location
@@ -405,12 +440,13 @@ class MONITOR2:
 
         for n in range(idx_min, len(diff)):
             # find end of exhalation
-            if diff[n] >= diff_min/factor:
+            if diff[n] >= diff_min/factor - tol:
                 idx_min_end = n
                 break
 
         if idx_min_end == len(diff):
-            print("*** WARNING {}s end of exhalation not detected".format(data_cycle[len(diff)][0]))
+            warn("*** WARNING {}s end of exhalation not detected".format(data_cycle[-1][0]))
+            idx_min_end = len(diff) - 1  # last sample of the cycle
 
         #    
         # print("max start {}, {}, max {}, {}, max end {}, {}\n".format(idx_max_start,data_cycle[idx_max_start][1],
@@ -426,9 +462,8 @@ class MONITOR2:
             self.ax1.text(data_cycle[peak_idx][0], peak * 1.02, "Peak {:2.1f}".format(peak))
 
             # Show differential crossings cycle
-            self.ax2.set_title("Differential")
-            self.ax2.plot(self.yar[start:end], diff)
-            self.ax2.plot([self.yar[start],self.yar[-1]], [0,0])  # reference crossings
+            self.diff_t.append(self.yar[start:end])
+            self.diff_v.append(diff)
         
         if plot:
             self.ax1.plot([data_cycle[idx_min_start][0], data_cycle[idx_min_start][0]], [0, peak],
@@ -448,19 +483,18 @@ class MONITOR2:
 
         # Find P01 100ms into inhalation
         # linear interpolation to find value
-        P01 = np.interp(self.data[start][0] + 0.1,
+        P01 = np.interp(self.datanp[start][0] + 0.1,
                         data_cycle[:, 0], data_cycle[:, 1])
         if plot:
-            ydelta = (self.data[start+4][0] - self.data[start][0])/5
-            jump = int(0.1/ydelta)  # estimate index @ 0.1s for plotting
-            self.ax1.plot([self.data[start+jump][0]], [P01], 'ro')
-            self.ax1.text(self.data[start+jump][0], P01, "P0.1 {:2.1f}".format(P01))
+            jump = buffer.nearest(times, times[0] + 0.1, rate)  # sample @ 0.1s
+            self.ax1.plot([data_cycle[jump][0]], [P01], 'ro')
+            self.ax1.text(data_cycle[jump][0], P01, "P0.1 {:2.1f}".format(P01))
 
         # Find PTP for cycle
         PTPavg = np.average(data_cycle[0:peak_idx], axis=0)[1]
         if plot:
             text = "PTP={:2.1f}".format(PTPavg)
-            self.ax1.text(self.data[int(start+peak_idx/2)][0], peep_min, text,
+            self.ax1.text(self.datanp[int(start+peak_idx/2)][0], peep_min, text,
                      verticalalignment='top')
 
         # PEEPi
@@ -468,19 +502,19 @@ class MONITOR2:
         # of the next inhalation cycle at the threshold point
         # Also high PEEPi values might interfere with threshold
         # estimations which are based off peep_min
-        ydelta = (data_cycle[-1][0] - data_cycle[-5][0])/5
-        jump = int(0.05/ydelta)  # estimate index @ 0.05s for plotting
-        peepi = data_cycle[-jump][1] - peep_min
+        # last sample 0.05s before the end of the cycle
+        jump = buffer.before(times, self.datanp[end][0] - 0.05, rate)
+        peepi = data_cycle[jump][1] - peep_min
         text = "PEEPi={:2.1f}".format(peepi)
         if plot:
-            self.ax1.plot(data_cycle[-jump][0], data_cycle[-jump][1], "g*")
+            self.ax1.plot(data_cycle[jump][0], data_cycle[jump][1], "g*")
             self.ax1.text(data_cycle[-1][0], -5, text,
                      verticalalignment='bottom')
 
         # I:E ratio
         # 1:(expiration time)/(inspiration time)
         # expire from plateau to where peepi is measured
-        exp1 =  data_cycle[-jump][0]-data_cycle[idx_min_start][0]
+        exp1 =  data_cycle[jump][0]-data_cycle[idx_min_start][0]
         # start of cycle to beginning of plateau
         ins1 =  data_cycle[idx_min_start][0]-data_cycle[0][0]
         denom = exp1 / ins1
@@ -500,14 +534,14 @@ class MONITOR2:
         self.stats["Epause"] = round(data_cycle[-1][0] - data_cycle[idx_min_end][0], 2)
         self.stats["I:E"] = ie_text
         self.stats["Pplat"] = round(data_cycle[idx_min_start][1], 2)
-        self.stats["Start"] = round(self.data[start][0], 2)
-        self.stats["End"] = round(self.data[end][0], 2)
+        self.stats["Start"] = round(self.datanp[start][0], 2)
+        self.stats["End"] = round(self.datanp[end][0], 2)
         self.stats["Vt"] = 0      # not done
         self.stats["dP"] = round(data_cycle[idx_min_start][1] - peep_min, 2)
         self.stats["Pl"] = 0      # not done
         self.stats["P01"] = round(P01, 2)
         self.stats["PTP"] = round(PTPavg, 2)
-        self.stats["RR"] = round((1 / (self.data[end][0] - self.data[start][0])) * 60, 2)
+        self.stats["RR"] = round((1 / (self.datanp[end][0] - self.datanp[start][0])) * 60, 2)
             
     def get_sample(self):
         """ Retrivies single sample from model """
@@ -536,7 +570,7 @@ class MONITOR2:
         and self.cycle_stats
         """
 
-        buffer = []
+        samples = buffer.SAMPLES(rate=self.models.rate)
         sample_time = 0.0
         breath_cnt = 0
         state = 0  # no trigger
@@ -547,15 +581,15 @@ class MONITOR2:
         while breath_cnt < cycles:   # no timeout yet
             # time.sleep(sample_rate)  # wait for sample - @TODO use RTC elapsed
             point = self.models.get_simulated_data()  # simulated
-            buffer.append(point)
+            samples.append(point)
 
             # Test for threshold crossings
             if state == 0:
                 # waiting for trigger positive
-                if len(buffer) > 10 and breath_cnt == 0:
+                if len(samples) > 10 and breath_cnt == 0:
                     # slice of last 10 samples to try to place start cycle in
                     # same time window every so waveform looks triggered
-                    buffer = buffer[-10:]
+                    samples.keep(10)
                 if point[1] > self.threshold:
                     state = 1
                     continue
@@ -568,7 +602,7 @@ class MONITOR2:
                 if point[1] > self.threshold:
                     state = 0
                     breath_cnt = breath_cnt + 1
-        self.data = buffer
+        self.data = samples
         self.compute()  # process samples
         return True
 
@@ -622,7 +656,8 @@ class MONITOR2:
         # print("Breath markers: {}".format(breath_markers))
         return breath_markers
 
-    def find_irregular_cycles(self, markers, tol=25):
+    @staticmethod
+    def find_irregular_cycles(markers, tol=25):
         """ Used for quick analysis to find irregular breaks in data 
 
             markers: [start, stop, breath_number] array to search for
@@ -659,7 +694,8 @@ class MONITOR2:
             prev_end = breath[1]
         return flagged
 
-    def plot_cycle(self, markers, breath_number = 0, start = 0, cycles=5, length=500):
+    def plot_cycle(self, markers, breath_number = 0, start = 0, cycles=5, length=500,
+                   index=None):
         """ Searches data file for either breath number or start time and grabs cycles
         of data and plots it and imports data for this captured section
 
@@ -670,6 +706,8 @@ class MONITOR2:
         start float specify specific start time if desired otherwise taken from markers
         stop float specify when to stop reading data
         cycles int number of cycles to read from data
+        index markers.MARKERS ventilator breath index, when markers came from
+              index.to_markers() the file is seeked to the breath directly
         """
 
         if breath_number != 0:
@@ -683,29 +721,33 @@ class MONITOR2:
         if start == 0:
             start = markers[0][0] # pick first breath number if nothing specified
         self.models.rewind()  # reset model to start
-
-        self.data = []
-        self.datanp = []
+        if index is not None and breath_number != 0:
+            row = index.find(breath_number)
+            if row > 0:
+                # jump to the previous ventilator breath with the offsets
+                # saved by convert.py instead of reading from the start
+                self.models.seek_breath(index, row - 1)
+
+        self.data = buffer.SAMPLES(rate=self.models.rate)
+        self.datanp = np.empty(0)
         samples = 0
         slice = True
-        #
-        # @TODO this currently stores all data until time
-        # is reached, this is unecessy and needs a lot of memory
-        # need to prescreen data before appending to memory
-        #
         while True:
             point = self.models.get_simulated_data()  # simulated
             samples += 1
             if point is None:
                 print("Finished reading model data")
                 break
-            self.data.append(point)  # record data  @TODO fix later see above
+            self.data.append(point)  # record data
             # Once triggered, slice off some leading data
-            if point[0] >= start:
-                if len(self.data)>10 and slice:
+            if len(self.data) > 10 and slice:
+                if point[0] >= start:
                     slice = False
                     # slice off all but previous 10 points
-                    self.data=self.data[-10:]
+                    self.data.keep(10)
+                elif len(self.data) == self.data.capacity:
+                    # only the last 10 before start are used, don't grow
+                    self.data.keep(10)
             if len(self.data ) > length and slice == False:
                 # started capturing waveform and done with points
                 break
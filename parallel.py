@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+"""
+Analyze one long recording on all cores
+
+find_cycles only needs a threshold comparison so its breath boundaries are
+found first in a quick pass over the whole recording (analysis.find_cycles).  The breaths are then
+cut into segments of N breaths, the samples are placed once in shared
+memory and worker processes run contours on their segments.  Each worker
+sees a slice with a few samples of margin either side so the slope is the
+same as on the whole buffer, and the stats come back in breath order,
+bit-identical to MONITOR2.compute on one core (--check compares the two,
+a small --breaths puts many segment edges on glitch cycles).
+
+python3 parallel.py models/csv_raw/<pressure file>.csv --jobs 8 --check
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import os
+import time
+import argparse
+from multiprocessing import Pool, shared_memory
+import monitor2
+import archive
+import analysis
+
+margin = 8  # samples either side of a segment, >= slope window // 2 + 1
+shared = {}  # worker side: shared memory block and the samples view in it
+
+
+def load(filename):
+    """ [time, pressure] samples of a csv_raw file or .vpa archive """
+    if str(filename).endswith(".vpa"):
+        vpa = archive.ARCHIVE(filename)
+        data = np.column_stack((vpa.times(), vpa.read()[:, vpa.channel('press')]))
+        vpa.close()
+        return data
+    return np.loadtxt(filename, delimiter=',', ndmin=2)
+
+
+def attach(name, shape, smooth, window, slope_factor):
+    """ Pool initializer - map the shared samples once per worker """
+    block = shared_memory.SharedMemory(name=name)
+    shared["block"] = block
+    shared["data"] = np.ndarray(shape, dtype=float, buffer=block.buf)
+    shared["options"] = (smooth, window, slope_factor)
+
+
+def segment(args):
+    """
+    Worker - contours on one segment of breaths
+
+    args (tuple): (cycles [start, end] array of the segment, threshold)
+
+    Returns:
+    list: stats dictionary of every breath in the segment
+    """
+    cycles, threshold = args
+    data = shared["data"]
+    smooth, window, slope_factor = shared["options"]
+    first = max(cycles[0, 0] - margin, 0)
+    last = min(cycles[-1, 1] + margin + 1, len(data))
+    mon = monitor2.MONITOR2.__new__(monitor2.MONITOR2)  # no model file needed
+    mon.cycle_stats = []
+    mon.smooth = smooth
+    mon.slope_factor = slope_factor
+    mon.smooth_window = window
+    mon.data = data[first:last]
+    mon.captured_idx = (cycles - first).ravel().tolist()
+    mon.captured = [mon.data[i].tolist() for i in mon.captured_idx]
+    for i in range(len(cycles)):
+        mon.contours(i, threshold, plot=False, quiet=True)
+        if len(mon.stats) > 0:
+            mon.cycle_stats.append(mon.stats)
+    return mon.cycle_stats
+
+
+def analyze(data, threshold=0, breaths=100, jobs=None,
+            smooth=None, window=7, slope_factor=10, threshold_factor=1.25,
+            threshold_percentile=0):
+    """
+    Stats of every breath of a recording using all cores
+
+    data (np.array): [time, pressure] samples
+    threshold (float): trigger level, 0 uses the compute() rule with
+                       threshold_factor and threshold_percentile
+    breaths (int): breaths per segment handed to a worker
+
+    Returns:
+    list: stats dictionaries in breath order, as MONITOR2.cycle_stats
+    """
+    if threshold == 0:
+        threshold = analysis.trigger(data[:, 1], threshold_factor,
+                                     threshold_percentile)
+    cycles = analysis.find_cycles(data[:, 1], threshold)[0]
+    if len(cycles) == 0:
+        return []
+    segments = [cycles[i:i + breaths] for i in range(0, len(cycles), breaths)]
+
+    block = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        samples = np.ndarray(data.shape, dtype=float, buffer=block.buf)
+        samples[:] = data
+        with Pool(jobs, initializer=attach,
+                  initargs=(block.name, data.shape, smooth, window,
+                            slope_factor)) as pool:
+            results = pool.map(segment, [(item, threshold) for item in segments])
+        del samples
+    finally:
+        block.close()
+        block.unlink()
+    return [stats for part in results for stats in part]
+
+
+def serial(data, threshold=0, smooth=None, window=7, slope_factor=10):
+    """ MONITOR2.compute on one core, the reference for analyze() """
+    mon = monitor2.MONITOR2.__new__(monitor2.MONITOR2)
+    mon.cycle_stats = []
+    mon.smooth = smooth
+    mon.slope_factor = slope_factor
+    mon.smooth_window = window
+    mon.threshold = threshold
+    mon.data = data
+    mon.compute(plot=False, quiet=True)
+    return mon.cycle_stats
+
+
+def same(a, b):
+    """ bit for bit equal lists of stats, nan matches nan """
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        for key in x:
+            if not (x[key] == y[key] or (x[key] != x[key] and y[key] != y[key])):
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Analyze one recording in parallel segments of breaths',
+        epilog='--check also runs the serial path and compares the stats')
+    parser.add_argument('file', type=str, help="csv_raw pressure file or .vpa")
+    parser.add_argument('--threshold', type=float, default=0,
+                        help="trigger level, 0 estimates it from PEEP")
+    parser.add_argument('--percentile', type=float, default=0,
+                        help="PEEP floor percentile of the estimate, 0 for the "
+                             "lowest sample as compute()")
+    parser.add_argument('--breaths', type=int, default=100,
+                        help="breaths per segment")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="worker processes, default one per core")
+    parser.add_argument('--smooth', type=str, default=None,
+                        choices=['ma', 'savgol'])
+    parser.add_argument('--check', action='store_true',
+                        help="compare against MONITOR2.compute")
+    args = parser.parse_args()
+
+    data = load(args.file)
+    threshold = args.threshold
+    if threshold == 0:
+        # same rule as analyze()
+        threshold = analysis.trigger(data[:, 1], percentile=args.percentile)
+    elapsed = time.perf_counter()
+    cycles = analysis.find_cycles(data[:, 1], threshold)[0]
+    print("pre-pass: {} breaths in {:1.1f} ms".format(
+        len(cycles), (time.perf_counter() - elapsed) * 1000))
+
+    elapsed = time.perf_counter()
+    stats = analyze(data, threshold, args.breaths, args.jobs, args.smooth)
+    parallel_time = time.perf_counter() - elapsed
+    print("parallel: {} breaths in {:1.2f}s on {} workers".format(
+        len(stats), parallel_time, args.jobs or os.cpu_count()))
+
+    if args.check:
+        elapsed = time.perf_counter()
+        reference = serial(data, threshold, args.smooth)
+        serial_time = time.perf_counter() - elapsed
+        print("serial:   {} breaths in {:1.2f}s, speedup {:1.1f}x, identical: {}".format(
+            len(reference), serial_time, serial_time / parallel_time,
+            same(reference, stats)))
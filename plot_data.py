@@ -1,12 +1,16 @@
 #!/usr/bin/python3
 """
 Plots either raw_vwd or csv_raw files.
+
+With -z the whole recording is shown at once from a cached min/max
+pyramid (see pyramid.py) and can be zoomed and scrolled to any breath.
 """
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import argparse
+import pyramid
 
 
 class PlotData:
@@ -18,6 +22,7 @@ class PlotData:
     value = ''
     type = ''
     raw_file = False
+    filename = ''
 
     def __init__(self, filename='', type='press'):
         """
@@ -25,6 +30,7 @@ class PlotData:
         :param filename: input filename in csv format
         :param type: press is to plot the pressure, flow to plot flow rates
         """
+        self.filename = filename
         try:
             self.fp = open(filename, "r", errors='ignore')
         except IOError:
@@ -59,6 +65,53 @@ class PlotData:
         ani = animation.FuncAnimation(self.fig, self.animate, interval=1)
         plt.show()
 
+    def zoom(self, pixels=2000):
+        """
+        Whole recording view, zoom/pan with the toolbar or
+        left/right arrows to scroll and up/down to zoom in/out
+        """
+        matplotlib.use('tkagg')
+        plt.style.use('dark_background')
+        self.pyr = pyramid.PYRAMID.cached(self.filename, self.type)
+        self.pixels = pixels
+        self.fig, self.ax = plt.subplots()
+        if self.type == 'press':
+            plt.title("Pressure")
+            plt.ylabel("cm H2O")
+        else:
+            plt.title("Flow")
+            plt.ylabel("ml/s ?")
+        plt.xlabel("s")
+        start = self.pyr.t0
+        end = self.pyr.t0 + self.pyr.duration()
+        t, y, level = self.pyr.view(start, end, self.pixels)
+        self.line, = self.ax.plot(t, y, 'r-', linewidth=0.8)
+        self.ax.set_xlim(start, end)
+        self.ax.callbacks.connect('xlim_changed', self.redraw)
+        self.fig.canvas.mpl_connect('key_press_event', self.key)
+        plt.show()
+
+    def redraw(self, ax):
+        """ only the pyramid level matching the visible range is read """
+        start, end = ax.get_xlim()
+        t, y, level = self.pyr.view(start, end, self.pixels)
+        self.line.set_data(t, y)
+
+    def key(self, event):
+        start, end = self.ax.get_xlim()
+        span = end - start
+        if event.key == 'right':
+            self.ax.set_xlim(start + span / 2, end + span / 2)
+        elif event.key == 'left':
+            self.ax.set_xlim(start - span / 2, end - span / 2)
+        elif event.key == 'up':
+            self.ax.set_xlim(start + span / 4, end - span / 4)
+        elif event.key == 'down':
+            self.ax.set_xlim(start - span / 2, end + span / 2)
+        else:
+            return
+        self.fig.canvas.draw_idle()
+
     def animate(self, i):
         """ routine to animate plot sweep """
         item = i
@@ -140,6 +193,8 @@ if __name__ == "__main__":
         epilog='Demonstration of data plots')
     parser.add_argument('-p', action='count', default=0, help='plot pressure')
     parser.add_argument('-f', action='count', default=0, help='plot flow rate')
+    parser.add_argument('-z', action='count', default=0,
+                        help='zoomable view of the whole recording (csv_raw or .vpa)')
     parser.add_argument('file', type=str, help="Input Filename with path")
     args = parser.parse_args()
     type = 'press'
@@ -149,4 +204,7 @@ if __name__ == "__main__":
         type = 'press'
 
     convert = PlotData(filename=args.file, type=type)
-    convert.plot()
+    if args.z > 0:
+        convert.zoom()
+    else:
+        convert.plot()
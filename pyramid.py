@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+Multi-resolution min/max pyramid of a recording
+
+Level 0 is the samples themselves, every level above keeps the min and max
+of "factor" buckets of the level below.  A viewer asks for a time range and
+a pixel width and only the level with roughly one bucket per pixel is read,
+so the whole recording and a single breath draw equally fast.  Pyramids are
+built once and cached next to the recording (<file>.<channel>.pyr.npz).
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import os
+import time
+import argparse
+import archive
+
+
+def load_samples(filename, type='press'):
+    """
+    Samples of one channel from a csv_raw file or .vpa archive
+
+    Returns:
+    t0, rate, values: time of first sample, samples per second, np.array
+    """
+    if str(filename).endswith(".vpa"):
+        vpa = archive.ARCHIVE(filename)
+        values = vpa.read()[:, vpa.channel(type)]
+        return vpa.t0, vpa.rate, values
+    data = np.loadtxt(filename, delimiter=',', ndmin=2)
+    if len(data) < 2:
+        return 0, 50, data[:, 1] if len(data) else np.empty(0)
+    rate = 1 / np.median(np.diff(data[:, 0]))
+    return data[0, 0], rate, data[:, 1]
+
+
+class PYRAMID:
+
+    factor = 4  # samples per bucket between levels
+
+    def __init__(self, values=None, t0=0, rate=50, factor=4):
+        """
+        values (np.array): samples, level 0
+        t0 (float): time of first sample
+        rate (float): samples per second
+        """
+        self.t0 = t0
+        self.rate = rate
+        self.factor = factor
+        self.mins = []
+        self.maxs = []
+        if values is not None:
+            self.build(values)
+
+    def build(self, values):
+        """ all levels down to a single bucket, O(n) total """
+        lo = np.asarray(values, dtype=np.float32)
+        hi = lo
+        self.mins = [lo]
+        self.maxs = [hi]
+        while len(lo) > 1:
+            n = len(lo)
+            pad = (-n) % self.factor
+            if pad:
+                # repeat the last bucket so partial buckets still cover it
+                lo = np.concatenate((lo, np.repeat(lo[-1:], pad)))
+                hi = np.concatenate((hi, np.repeat(hi[-1:], pad)))
+            lo = lo.reshape(-1, self.factor).min(axis=1)
+            hi = hi.reshape(-1, self.factor).max(axis=1)
+            self.mins.append(lo)
+            self.maxs.append(hi)
+
+    @classmethod
+    def cached(cls, filename, type='press', factor=4):
+        """ load the cached pyramid of a recording, building it if stale """
+        cache = "{}.{}.pyr.npz".format(filename, type)
+        stamp = np.array([os.path.getmtime(filename), os.path.getsize(filename)])
+        if os.path.exists(cache):
+            with np.load(cache) as saved:
+                if np.array_equal(saved["stamp"], stamp) and saved["factor"] == factor:
+                    pyr = cls(None, float(saved["t0"]), float(saved["rate"]), factor)
+                    levels = int(saved["levels"])
+                    pyr.mins = [saved["min{}".format(i)] for i in range(levels)]
+                    # level 0 is the recording itself, min and max are the same
+                    pyr.maxs = [pyr.mins[0]] + [saved["max{}".format(i)]
+                                                for i in range(1, levels)]
+                    return pyr
+        t0, rate, values = load_samples(filename, type)
+        pyr = cls(values, t0, rate, factor)
+        arrays = {"stamp": stamp, "factor": factor, "t0": t0, "rate": rate,
+                  "levels": len(pyr.mins)}
+        for i in range(len(pyr.mins)):
+            arrays["min{}".format(i)] = pyr.mins[i]
+            if i:
+                arrays["max{}".format(i)] = pyr.maxs[i]
+        np.savez(cache, **arrays)
+        return pyr
+
+    def duration(self):
+        return len(self.mins[0]) / self.rate if len(self.mins) else 0
+
+    def level_for(self, samples, pixels):
+        """ coarsest level that still has about one bucket per pixel """
+        level = 0
+        while level + 1 < len(self.mins) and samples / self.factor ** (level + 1) >= pixels:
+            level += 1
+        return level
+
+    def view(self, start, end, pixels=1000):
+        """
+        Envelope of [start, end) seconds at screen resolution
+
+        Returns:
+        t, y (np.array): min/max pairs interleaved in time order, ready
+                         for a line plot, and the level used
+        """
+        first = int(max((start - self.t0) * self.rate, 0))
+        last = int(min(np.ceil((end - self.t0) * self.rate), len(self.mins[0])))
+        level = self.level_for(max(last - first, 1), pixels)
+        width = self.factor ** level
+        lo = first // width
+        hi = -(-last // width)
+        mins = self.mins[level][lo:hi]
+        if level == 0:
+            t = self.t0 + np.arange(lo, hi) / self.rate
+            return t, mins, level
+        maxs = self.maxs[level][lo:hi]
+        t = self.t0 + (np.arange(lo, hi) * width) / self.rate
+        tt = np.repeat(t, 2)
+        tt[1::2] += width / self.rate / 2
+        y = np.empty(2 * len(mins), dtype=mins.dtype)
+        y[0::2] = mins
+        y[1::2] = maxs
+        return tt, y, level
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Build and cache the min/max pyramid of a recording')
+    parser.add_argument('file', type=str, help="csv_raw or .vpa file")
+    parser.add_argument('-f', action='count', default=0, help='flow channel of a .vpa')
+    args = parser.parse_args()
+
+    elapsed = time.perf_counter()
+    pyr = PYRAMID.cached(args.file, type='flow' if args.f else 'press')
+    print("{} levels over {:1.0f}s in {:1.3f}s".format(
+        len(pyr.mins), pyr.duration(), time.perf_counter() - elapsed))
+    for span in [pyr.duration(), 600, 10]:
+        elapsed = time.perf_counter()
+        t, y, level = pyr.view(0, span, 1500)
+        print("{:>8.0f}s view: level {} {} points {:1.3f} ms".format(
+            span, level, len(y), (time.perf_counter() - elapsed) * 1000))
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+"""
+Query per-breath stats across every csv_raw recording
+
+--build runs the chunked analysis (chunked.py) over all recordings in
+parallel once and saves one row per breath in an index (breaths.npz).
+Queries are then numpy masks over the columns so range filters, top-k and
+group-by-recording answer in milliseconds.  Every hit points back to the
+file, breath number and sample offset, and markers() returns hits in the
+[start, stop, breath number] layout MONITOR2.plot_cycle takes.
+
+python3 query.py --build
+python3 query.py "PEEPi>2" "Ppeak>35" --top Ppeak 10 --group
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import os
+import re
+import time
+import argparse
+from multiprocessing import Pool
+from pathlib import Path
+import chunked
+
+columns = ["PEEP", "PEEPi", "Ppeak", "Pplat", "dP", "P01", "PTP", "RR",
+           "Start", "End"]
+
+
+def index_file(args):
+    """
+    Worker - analyze one recording
+
+    args (tuple): (pressure csv filename, threshold, threshold factor,
+                   threshold percentile, rate)
+
+    Returns:
+    np.array: one row per breath of columns, breath number and sample offset
+    """
+    filename, threshold, factor, percentile, rate = args
+    if os.path.getsize(filename) == 0:
+        return np.empty((0, len(columns) + 2))
+    analyzer = chunked.CHUNKED(filename, threshold=threshold, rate=rate)
+    if threshold == 0:
+        # MONITOR2.compute rule with threshold_percentile = percentile,
+        # analysis.trigger in the streaming pre-pass
+        analyzer.trigger(factor, percentile)
+    stats = analyzer.run()  # contours run quiet
+    rows = np.empty((len(stats), len(columns) + 2))
+    for i in range(len(stats)):
+        rows[i, :len(columns)] = [stats[i][key] for key in columns]
+    rows[:, -2] = np.arange(1, len(stats) + 1)  # breath number in file
+    rows[:, -1] = analyzer.core.cycle_start  # sample find_cycles started it at
+    return rows
+
+
+def build(directory='./models/csv_raw', out='breaths.npz', threshold=0,
+          factor=1.25, percentile=5, rate=50, jobs=None):
+    """
+    Analyze every pressure file in directory and save the index, an empty
+    index when there are none
+    """
+    files = sorted(str(name) for name in Path(directory).glob("*-pres-*.csv"))
+    results = [np.empty((0, len(columns) + 2))]
+    if files:
+        with Pool(jobs) as pool:
+            results = pool.map(index_file, [(name, threshold, factor, percentile,
+                                             rate) for name in files])
+    rows = np.concatenate(results)
+    file_id = np.concatenate([np.full(len(results[i]), i)
+                              for i in range(len(results))]).astype(np.int32)
+    arrays = {key: rows[:, n] for n, key in enumerate(columns)}
+    np.savez(out, files=np.array(files), recording=file_id,
+             breath=rows[:, -2].astype(np.int64),
+             sample=rows[:, -1].astype(np.int64), **arrays)
+    return len(rows), len(files)
+
+
+class QUERY:
+
+    def __init__(self, filename='breaths.npz'):
+        with np.load(filename) as data:
+            self.files = [str(name) for name in data["files"]]
+            self.file = data["recording"]
+            self.breath = data["breath"]
+            self.sample = data["sample"]
+            self.cols = {key: data[key] for key in columns}
+        self.rows = len(self.file)
+
+    def where(self, **ranges):
+        """
+        Rows inside every range
+
+        ranges: parameter=(low, high), None leaves that side open, bounds
+                are excluded unless a third item says which are included,
+                'left', 'right', 'both' or 'neither' as pandas between()
+                e.g. where(PEEPi=(2, None, 'left'), Ppeak=(35, None))
+
+        Returns:
+        np.array: matching row indices
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for key, bounds in ranges.items():
+            low, high = bounds[:2]
+            inclusive = bounds[2] if len(bounds) > 2 else 'neither'
+            if inclusive not in ('left', 'right', 'both', 'neither'):
+                raise ValueError("unknown inclusive {}".format(inclusive))
+            values = self.cols[key]
+            if low is not None:
+                mask &= values >= low if inclusive in ('left', 'both') else values > low
+            if high is not None:
+                mask &= values <= high if inclusive in ('right', 'both') else values < high
+        return np.nonzero(mask)[0]
+
+    def top(self, key, k=10, rows=None, largest=True):
+        """ k rows with the largest (or smallest) key, sorted """
+        if rows is None:
+            rows = np.arange(self.rows)
+        values = self.cols[key][rows]
+        values = np.where(np.isnan(values), -np.inf if largest else np.inf, values)
+        if not largest:
+            values = -values
+        k = min(k, len(rows))
+        if k == 0:
+            return rows[:0]
+        best = np.argpartition(values, -k)[-k:]
+        return rows[best[np.argsort(-values[best])]]
+
+    def group(self, rows, key=None):
+        """
+        Per recording count and, if key is given, mean/max of key
+
+        Returns:
+        dict: {filename: [count, mean, max]}
+        """
+        count = np.bincount(self.file[rows], minlength=len(self.files))
+        result = {}
+        if key is not None:
+            values = self.cols[key][rows]
+            total = np.bincount(self.file[rows], weights=values,
+                                minlength=len(self.files))
+            peak = np.full(len(self.files), -np.inf)
+            np.maximum.at(peak, self.file[rows], values)
+        for i in np.nonzero(count)[0]:
+            if key is None:
+                result[self.files[i]] = [int(count[i])]
+            else:
+                result[self.files[i]] = [int(count[i]), float(total[i] / count[i]),
+                                         float(peak[i])]
+        return result
+
+    def hits(self, rows):
+        """ list of dictionaries with file, breath number, sample and stats """
+        return [dict({"File": self.files[self.file[i]],
+                      "BN": int(self.breath[i]),
+                      "Sample": int(self.sample[i])},
+                     **{key: float(self.cols[key][i]) for key in columns})
+                for i in rows]
+
+    def markers(self, rows, filename):
+        """
+        Hits in one file as [start, stop, breath number] for plot_cycle,
+        mon.plot_cycle(q.markers(rows, name), breath_number=bn)
+        """
+        rows = rows[self.file[rows] == self.files.index(filename)]
+        return [[float(self.cols["Start"][i]), float(self.cols["End"][i]),
+                 int(self.breath[i])] for i in rows]
+
+
+def parse(conditions):
+    """
+    ["PEEPi>=2", "Ppeak<40"] ->
+        {"PEEPi": (2, None, 'left'), "Ppeak": (None, 40, 'neither')}
+    """
+    bounds = {}
+    for text in conditions:
+        found = re.fullmatch(r"\s*(\w+)\s*([<>]=?)\s*([-+\d.eE]+)\s*", text)
+        if found is None or found.group(1) not in columns:
+            print("Can't parse condition {}".format(text))
+            exit(1)
+        key, op, value = found.group(1), found.group(2), float(found.group(3))
+        low, high, left, right = bounds.get(key, (None, None, False, False))
+        if op[0] == '>':
+            low, left = value, op == '>='
+        else:
+            high, right = value, op == '<='
+        bounds[key] = (low, high, left, right)
+    names = {(False, False): 'neither', (True, False): 'left',
+             (False, True): 'right', (True, True): 'both'}
+    return {key: (low, high, names[left, right])
+            for key, (low, high, left, right) in bounds.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Query per-breath stats across all csv_raw recordings',
+        epilog='Conditions look like "PEEPi>2" "Ppeak>35"')
+    parser.add_argument('conditions', type=str, nargs='*', help="range filters")
+    parser.add_argument('--build', action='store_true', help="(re)build the index")
+    parser.add_argument('--dir', type=str, default='./models/csv_raw')
+    parser.add_argument('--index', type=str, default='breaths.npz')
+    parser.add_argument('--threshold', type=float, default=0,
+                        help="trigger level, 0 estimates it from PEEP per file")
+    parser.add_argument('--percentile', type=float, default=5,
+                        help="PEEP floor percentile of the estimate, 0 for the lowest sample")
+    parser.add_argument('--top', nargs=2, metavar=('PARAM', 'K'),
+                        help="show the K breaths with the largest PARAM")
+    parser.add_argument('--group', action='store_true', help="count hits per recording")
+    args = parser.parse_args()
+
+    if args.build or not os.path.exists(args.index):
+        elapsed = time.perf_counter()
+        breaths, files = build(args.dir, args.index, args.threshold,
+                                percentile=args.percentile)
+        print("Indexed {} breaths from {} recordings in {:1.1f}s".format(
+            breaths, files, time.perf_counter() - elapsed))
+
+    q = QUERY(args.index)
+    elapsed = time.perf_counter()
+    rows = q.where(**parse(args.conditions))
+    if args.top:
+        rows = q.top(args.top[0], int(args.top[1]), rows)
+    groups = q.group(rows, args.top[0] if args.top else None) if args.group else {}
+    elapsed = time.perf_counter() - elapsed
+
+    for hit in q.hits(rows[:50]):
+        print("{} BN={} sample={} Ppeak={:1.2f} PEEPi={:1.2f} PEEP={:1.2f} RR={:1.2f}".format(
+            Path(hit["File"]).name[:30], hit["BN"], hit["Sample"], hit["Ppeak"],
+            hit["PEEPi"], hit["PEEP"], hit["RR"]))
+    for name, value in groups.items():
+        print("{:>40} {}".format(Path(name).name[:40], value))
+    print("{} of {} breaths matched in {:1.2f} ms".format(
+        len(rows), q.rows, elapsed * 1000))
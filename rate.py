@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+"""
+Respiratory rate from the autocorrelation of a window of samples
+
+Finding RR through find_cycles and contours means segmenting and analyzing
+every breath.  When only a rate trend is needed the period can be read off
+the autocorrelation of the last "window" seconds of pressure or flow
+instead: the samples are decimated (block mean) to a few Hz, the
+autocorrelation is computed with one FFT per window and its highest peak
+in the allowed breathing range is the breath period.  The height of that
+peak (1.0 for a perfectly repeating signal) is the confidence, windows
+below the "confidence" level can be handed to the full contours path.
+
+RATE updates incrementally every "hop" seconds as samples are added,
+rates() does a whole recording at once with one batched FFT.
+
+python3 rate.py models/csv_raw/<pressure file>.csv --window 30 --hop 5
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import time
+import argparse
+import analysis
+
+
+def autocorr(windows):
+    """
+    Autocorrelation of every row, through the FFT
+
+    windows (np.array): (windows, samples)
+
+    Returns:
+    np.array: same shape, lag 0 to samples - 1, normalized so lag 0 is 1
+    """
+    x = windows - windows.mean(axis=-1, keepdims=True)
+    n = x.shape[-1]
+    size = 1 << (2 * n - 1).bit_length()  # zero pad, no circular wrap
+    spec = np.fft.rfft(x, size, axis=-1)
+    ac = np.fft.irfft(spec.real ** 2 + spec.imag ** 2, size, axis=-1)[..., :n]
+    return ac / np.maximum(ac[..., :1], 1e-12)
+
+
+def period(ac, lo, hi):
+    """
+    Breath period (in samples) and confidence of each autocorrelation row
+
+    ac (np.array): (windows, lags) from autocorr()
+    lo, hi (int): shortest and longest period allowed, in samples
+
+    Returns:
+    lag, confidence: np.arrays, lag is refined between samples with a
+                     parabola through the peak, confidence is the peak
+                     height corrected for the shrinking overlap at long lags
+    """
+    n = ac.shape[-1]
+    hi = min(hi, n - 2)
+    seg = ac[:, lo - 1:hi + 2]
+    mid = seg[:, 1:-1]
+    # only local maxima count, the slope down from lag 0 is not a period
+    peaks = (mid >= seg[:, :-2]) & (mid >= seg[:, 2:])
+    # biased height picks the first of the repeating peaks, not a multiple
+    k = np.argmax(np.where(peaks, mid, -np.inf), axis=1)
+    rows = np.arange(len(ac))
+    a, b, c = seg[rows, k], seg[rows, k + 1], seg[rows, k + 2]
+    lag = k + lo
+    # unbiased height, the overlap at lag k is only n - k samples
+    confidence = np.where(peaks[rows, k], np.clip(b * n / (n - lag), 0, 1), 0.0)
+    bend = a - 2 * b + c
+    shift = np.where(bend < 0, 0.5 * (a - c) / np.where(bend < 0, bend, 1), 0)
+    return lag + shift, confidence
+
+
+def decimate(values, factor):
+    """ block mean of every factor samples, a leftover partial block is dropped """
+    values = np.asarray(values, dtype=float)
+    whole = len(values) // factor * factor
+    return values[:whole].reshape(-1, factor).mean(axis=1)
+
+
+def rates(values, rate=50, window=30, hop=5, factor=5, low=4, high=60):
+    """
+    Rate of every window of a whole recording at once
+
+    values (np.array): pressure or flow samples
+    rate (float): samples per second
+    window, hop (float): seconds analyzed per estimate and between estimates
+    factor (int): decimation factor
+    low, high (float): breathing range in breaths per minute
+
+    Returns:
+    end, bpm, confidence: np.arrays, end is the time (s) each window ends
+    """
+    fs = rate / factor
+    size = int(round(window * fs))
+    step = max(int(round(hop * fs)), 1)
+    dec = decimate(values, factor)
+    if len(dec) < size:
+        return np.empty(0), np.empty(0), np.empty(0)
+    windows = np.lib.stride_tricks.sliding_window_view(dec, size)[::step]
+    lag, confidence = period(autocorr(windows),
+                             max(int(np.floor(60 * fs / high)), 1),
+                             int(np.ceil(60 * fs / low)))
+    end = (np.arange(len(windows)) * step + size) / fs
+    return end, 60 * fs / lag, confidence
+
+
+class RATE:
+
+    def __init__(self, rate=50, window=30, hop=5, factor=5, low=4, high=60,
+                 confidence=0.5, fallback=None):
+        """
+        rate (float): samples per second of the input
+        window (float): seconds in each estimate, a few breaths at least
+        hop (float): seconds between estimates
+        factor (int): decimation factor, 50 Hz / 5 = 10 Hz
+        low, high (float): breathing range in breaths per minute
+        confidence (float): estimates below this are handed to fallback
+        fallback (function): fallback(start, end) called with the window (s)
+                             of a low confidence estimate, e.g. to run
+                             find_cycles and contours on it
+        """
+        self.rate = rate
+        self.factor = factor
+        self.fs = rate / factor
+        self.size = int(round(window * self.fs))
+        self.step = max(int(round(hop * self.fs)), 1)
+        self.lo = max(int(np.floor(60 * self.fs / high)), 1)
+        self.hi = int(np.ceil(60 * self.fs / low))
+        self.confidence = confidence
+        self.fallback = fallback
+        self.reset()
+
+    def reset(self):
+        self.partial = []                 # samples not decimated yet, as added
+        self.waiting = 0                  # samples in partial
+        self.history = np.empty(0)        # last window of decimated samples
+        self.count = 0                    # decimated samples seen
+        self.next = self.size             # count at which the next window ends
+        self.estimates = []               # {"Start", "End", "RR", "Confidence"}
+        self.fallbacks = 0
+
+    def add(self, values):
+        """
+        Add samples, estimates every window that completed
+
+        Samples are only kept until the next window can end, so adding less
+        than a hop at a time costs a list append; each estimate costs about
+        0.1 ms of numpy calls on one short window whatever the chunk size,
+        rates() batches a whole recording.
+
+        Returns:
+        list: new estimates, also appended to self.estimates
+        """
+        self.partial.append(np.asarray(values, dtype=float))
+        self.waiting += len(self.partial[-1])
+        if self.count + self.waiting // self.factor < self.next:
+            return []  # no window ends yet
+        values = np.concatenate(self.partial)
+        whole = len(values) // self.factor * self.factor
+        self.partial = [values[whole:]]
+        self.waiting = len(values) - whole
+        dec = decimate(values[:whole], self.factor)
+        first = self.count - len(self.history)  # decimated index of history[0]
+        self.history = np.concatenate((self.history, dec))
+        self.count += len(dec)
+
+        ends = np.arange(self.next, self.count + 1, self.step)
+        new = []
+        if len(ends):
+            # every window ending in this block in one batched FFT
+            windows = np.stack([self.history[e - first - self.size:e - first] for e in ends])
+            lag, confidence = period(autocorr(windows), self.lo, self.hi)
+            for end, bpm, conf in zip(ends, 60 * self.fs / lag, confidence):
+                item = {
+                    "Start": round(float(end - self.size) / self.fs, 2),
+                    "End": round(float(end) / self.fs, 2),
+                    "RR": round(float(bpm), 2),
+                    "Confidence": round(float(conf), 3)
+                }
+                new.append(item)
+                if conf < self.confidence and self.fallback is not None:
+                    self.fallbacks += 1
+                    self.fallback(item["Start"], item["End"])
+            self.next = int(ends[-1]) + self.step
+        self.history = self.history[-self.size:]
+        self.estimates.extend(new)
+        return new
+
+    def last(self):
+        """ latest estimate or None """
+        return self.estimates[-1] if len(self.estimates) else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Respiratory rate by autocorrelation against full contours',
+        epilog='reads the file through BREATH2, press or flow channel')
+    parser.add_argument('file', type=str, help="csv_raw file or .vpa archive")
+    parser.add_argument('--type', type=str, default='press', choices=['press', 'flow'])
+    parser.add_argument('--window', type=float, default=30)
+    parser.add_argument('--hop', type=float, default=5)
+    parser.add_argument('--confidence', type=float, default=0.5)
+    parser.add_argument('--chunk', type=int, default=250,
+                        help="samples per add(), as they would arrive live")
+    args = parser.parse_args()
+
+    source = analysis.REPLAY(args.file, args.type)
+    blocks = []
+    while True:
+        rows = source.read(50000)
+        if len(rows) == 0:
+            break
+        blocks.append(rows)
+    data = np.concatenate(blocks) if blocks else np.empty((0, 2))
+    print("{}: {} samples ({:1.1f} min) at {} Hz".format(
+        args.type, len(data), len(data) / source.rate / 60, source.rate))
+
+    low = []
+    estimator = RATE(source.rate, args.window, args.hop, confidence=args.confidence,
+                     fallback=lambda start, end: low.append((start, end)))
+    elapsed = time.perf_counter()
+    for i in range(0, len(data), args.chunk):
+        estimator.add(data[i:i + args.chunk, 1])
+    rate_time = time.perf_counter() - elapsed
+    estimates = estimator.estimates
+    print("RATE: {} estimates in {:1.1f} ms ({:1.1f} us each), {} below confidence {}".format(
+        len(estimates), rate_time * 1000, rate_time / max(len(estimates), 1) * 1e6,
+        len(low), args.confidence))
+    elapsed = time.perf_counter()
+    rates(data[:, 1], source.rate, args.window, args.hop)
+    batch_time = time.perf_counter() - elapsed
+    print("rates(): whole recording in one batch {:1.1f} ms".format(batch_time * 1000))
+
+    if args.type == 'press' and len(estimates):
+        # full segmentation, the cost RATE avoids
+        threshold = analysis.trigger(data[:, 1], 1.25, 5)
+        core = analysis.ANALYSIS(None, 'monitor2', threshold)
+        core.data.extend(data)
+        elapsed = time.perf_counter()
+        stats = core.compute()
+        full_time = time.perf_counter() - elapsed
+        starts = np.array([item["Start"] for item in stats])
+        rr = np.array([item["RR"] for item in stats])
+        errors = []
+        for item in estimates:
+            inside = (starts >= item["Start"]) & (starts < item["End"])
+            if item["Confidence"] >= args.confidence and np.any(inside):
+                errors.append(abs(item["RR"] - np.median(rr[inside])))
+        print("contours: {} breaths in {:1.2f}s, RATE costs {:1.1f}%, rates() {:1.1f}%".format(
+            len(stats), full_time, rate_time / full_time * 100,
+            batch_time / full_time * 100))
+        if errors:
+            print("confident windows: median |RR error| {:1.2f} bpm, 90th percentile {:1.2f}".format(
+                np.median(errors), np.percentile(errors, 90)))
@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""
+Sampling thread and ring buffer for the live monitor path
+
+SAMPLER takes one sample per period on its own thread, scheduled against
+time.monotonic() deadlines so the rate does not drift with the work done
+per sample, and writes [time, value] rows into a RING.  The analysis reads
+from the ring on another thread whenever it is ready.  The sampler never
+waits for the reader: if the reader falls more than the ring capacity
+behind, the oldest samples are overwritten and counted as overruns, so a
+slow compute() or plot shows up in the report instead of as gaps in the
+sampling.
+
+Single producer / single consumer, the two sides only share the head and
+tail counters, no lock is taken per sample.
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import threading
+import time
+import argparse
+
+
+class RING:
+
+    def __init__(self, capacity=4096, columns=2):
+        """
+        capacity (int): samples held before the oldest are overwritten
+        columns (int): values per sample
+        """
+        self.buf = np.zeros((capacity, columns))
+        self.capacity = capacity
+        self.head = 0       # samples written, only the producer changes it
+        self.tail = 0       # samples consumed, only the consumer changes it
+        self.overruns = 0   # samples overwritten before they were read
+        self.max_depth = 0  # most samples waiting at a read
+
+    def write(self, row):
+        """ producer side, never blocks """
+        self.buf[self.head % self.capacity] = row
+        self.head += 1  # publish after the row is in place
+
+    def depth(self):
+        return self.head - self.tail
+
+    def read(self, limit=None):
+        """
+        consumer side, all samples written since the last read
+
+        Returns:
+        np.array: rows in time order, copied out of the ring
+        """
+        head = self.head
+        tail = self.tail
+        if head - tail > self.max_depth:
+            self.max_depth = head - tail
+        if head - tail > self.capacity:
+            # lapped, the oldest samples are gone
+            self.overruns += head - tail - self.capacity
+            tail = head - self.capacity
+        if limit is not None:
+            head = min(head, tail + limit)
+        first = tail % self.capacity
+        count = head - tail
+        if first + count <= self.capacity:
+            rows = self.buf[first:first + count].copy()
+        else:
+            rows = np.concatenate((self.buf[first:], self.buf[:first + count - self.capacity]))
+        # rows the producer overwrote while they were being copied
+        lost = self.head - self.capacity - tail
+        if lost > 0:
+            self.overruns += min(lost, count)
+            rows = rows[min(lost, count):]
+        self.tail = head
+        return rows
+
+
+class SAMPLER(threading.Thread):
+
+    def __init__(self, source, period=0.01, ring=None):
+        """
+        source (function): source(t) returns the value sampled at time t
+        period (float): seconds between samples
+        ring (RING): where samples are written, one is made if None
+        """
+        super().__init__(daemon=True)
+        self.source = source
+        self.period = period
+        self.ring = ring if ring is not None else RING()
+        self.running = threading.Event()
+        self.samples = 0
+        self.late = 0         # samples taken more than a period after due
+        self.max_jitter = 0   # worst lateness in seconds
+        self.started = None   # time.monotonic() of sample 0, sample t is due at started + t
+        self.error = None
+
+    def run(self):
+        self.running.set()
+        start = time.monotonic()
+        self.started = start
+        n = 0
+        while self.running.is_set():
+            due = start + n * self.period
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            jitter = time.monotonic() - due
+            if jitter > self.max_jitter:
+                self.max_jitter = jitter
+            if jitter > self.period:
+                self.late += 1
+            t = n * self.period  # sample time on the nominal time base
+            try:
+                value = self.source(t)
+            except Exception as err:
+                self.error = err
+                break
+            self.ring.write([t, value])
+            n += 1
+            self.samples = n
+
+    def stop(self):
+        self.running.clear()
+        if self.is_alive():
+            self.join()
+
+    def report(self):
+        """ dictionary of sampling health counters """
+        return {
+            "Samples": self.samples,
+            "Late": self.late,
+            "MaxJitter": round(self.max_jitter * 1000, 2),  # ms
+            "Depth": self.ring.depth(),
+            "MaxDepth": self.ring.max_depth,
+            "Overruns": self.ring.overruns,
+        }
+
+
+class ANALYZER(threading.Thread):
+
+    def __init__(self, ring, callback, poll=0.05):
+        """
+        ring (RING): filled by a SAMPLER
+        callback (function): called with every new block of rows
+        poll (float): seconds to wait when the ring is empty
+        """
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.callback = callback
+        self.poll = poll
+        self.running = threading.Event()
+        self.error = None
+
+    def run(self):
+        self.running.set()
+        while self.running.is_set():
+            rows = self.ring.read()
+            if len(rows) == 0:
+                time.sleep(self.poll)
+                continue
+            try:
+                self.callback(rows)
+            except Exception as err:
+                self.error = err
+                break
+        # whatever arrived before the stop
+        rows = self.ring.read()
+        if len(rows) and self.error is None:
+            self.callback(rows)
+
+    def stop(self):
+        self.running.clear()
+        if self.is_alive():
+            self.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Sampler thread with a slow consumer',
+        epilog='Shows that consumer stalls do not cost samples until the ring laps')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--period', type=float, default=0.01)
+    parser.add_argument('--stall', type=float, default=0.5,
+                        help="seconds the consumer blocks per block of rows")
+    parser.add_argument('--capacity', type=int, default=4096)
+    args = parser.parse_args()
+
+    received = []
+    sampler = SAMPLER(lambda t: np.sin(2 * np.pi * t / 2), args.period,
+                      RING(args.capacity))
+
+    def slow(rows):
+        received.append(rows)
+        time.sleep(args.stall)  # stand in for compute() / plotting
+
+    analyzer = ANALYZER(sampler.ring, slow)
+    sampler.start()
+    analyzer.start()
+    time.sleep(args.seconds)
+    sampler.stop()
+    analyzer.stop()
+    rows = np.concatenate(received) if received else np.empty((0, 2))
+    gaps = np.sum(np.diff(rows[:, 0]) > args.period * 1.5) if len(rows) else 0
+    print(sampler.report())
+    print("{} rows received, {} gaps in the time base".format(len(rows), gaps))
@@ -0,0 +1,16 @@
+"""
+pytest setup, the modules live at the top of the repository and read the
+models directory relative to it
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use('Agg')  # compute(plot=True) without a display
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(str(ROOT))
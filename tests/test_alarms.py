@@ -0,0 +1,58 @@
+"""
+ALARMS debounce, escalation and CLEAR
+"""
+
+import alarms
+
+
+def engine():
+    return alarms.ALARMS(limits={"Ppeak": [None, 35, 2]}, apnea=0, escalate=3)
+
+
+def breath(mon, n, ppeak):
+    return mon.check_breath({"Start": n * 3.0, "End": n * 3.0 + 3, "Ppeak": ppeak})
+
+
+def test_debounce_escalate_clear():
+    mon = engine()
+    assert breath(mon, 0, 40) == []  # one breath over is not enough
+    raised = breath(mon, 1, 40)
+    assert [(e["Alarm"], e["Priority"]) for e in raised] == [("Ppeak", "LOW")]
+    assert breath(mon, 2, 40) == [] and breath(mon, 3, 40) == []
+    assert [e["Priority"] for e in breath(mon, 4, 40)] == ["MEDIUM"]
+    cleared = breath(mon, 5, 30)
+    assert [(e["Alarm"], e["Priority"]) for e in cleared] == [("Ppeak", "CLEAR")]
+    assert mon.active == {} and mon.raised == 3
+
+
+def test_nan_does_not_clear_or_reset():
+    mon = engine()
+    breath(mon, 0, 40)
+    assert breath(mon, 1, float('nan')) == []
+    # the count was kept, the second violation raises
+    assert [e["Priority"] for e in breath(mon, 2, 40)] == ["LOW"]
+    assert breath(mon, 3, float('nan')) == []
+    assert mon.active == {"Ppeak": 0}
+
+
+def test_nan_sample_keeps_pressure_alarm():
+    mon = alarms.ALARMS(pressure_limit=[None, 40, 1], apnea=0)
+    assert [e["Priority"] for e in mon.check_sample(0.0, 45)] == ["LOW"]
+    assert mon.check_sample(0.02, float('nan')) == []
+    assert mon.active == {"Pressure": 0}
+    assert [e["Priority"] for e in mon.check_sample(0.04, 30)] == ["CLEAR"]
+
+
+def test_apnea_from_breaths():
+    mon = alarms.ALARMS(limits={}, apnea=10)
+    assert mon.check_breath({"Start": 0, "End": 3}) == []
+    raised = mon.check_breath({"Start": 15, "End": 18})
+    assert [(e["Alarm"], e["Priority"]) for e in raised] == \
+        [("Apnea", "LOW"), ("Apnea", "CLEAR")]
+
+
+def test_event_history_is_bounded():
+    mon = alarms.ALARMS(pressure_limit=[None, 40, 1], apnea=0, history=5)
+    for n in range(20):
+        mon.check_sample(n * 0.02, 45 if n % 2 == 0 else 30)
+    assert len(mon.events) == 5 and mon.raised == 20
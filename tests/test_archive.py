@@ -0,0 +1,69 @@
+"""
+.vpa archive round trip and BREATH2 reading it
+"""
+
+import numpy as np
+
+import archive
+import markers
+import model2
+
+
+def write(name, values, block=64, **options):
+    writer = archive.WRITER(str(name), block=block, **options)
+    writer.append(values)
+    writer.close()
+    return writer
+
+
+def test_round_trip_blocks_and_nan(tmp_path):
+    name = tmp_path / "r.vpa"
+    rng = np.random.default_rng(0)
+    values = np.round(rng.uniform(-50, 100, (1000, 2)), 2)
+    values[[0, 63, 64, 500], 0] = np.nan  # block edges and inside
+    write(name, values)
+    vpa = archive.ARCHIVE(str(name))
+    assert vpa.version == archive.VERSION
+    assert vpa.blocks == 16 and vpa.samples == 1000
+    np.testing.assert_allclose(vpa.read(), values, atol=1e-9)
+    np.testing.assert_allclose(vpa.read(60, 130), values[60:130], atol=1e-9)
+    vpa.close()
+
+
+def test_clipping(tmp_path, capsys):
+    values = np.array([[400.0, 0], [-400.0, 0], [1.0, 0]])
+    writer = write(tmp_path / "c.vpa", values)
+    assert writer.clipped == 2
+    assert "clipped" in capsys.readouterr().out
+    vpa = archive.ARCHIVE(str(tmp_path / "c.vpa"))
+    high = np.iinfo(np.int16).max * vpa.scale
+    low = (archive.MISSING + 1) * vpa.scale
+    np.testing.assert_allclose(vpa.read()[:, 0], [high, low, 1.0])
+    assert not np.isnan(vpa.read()).any()  # a clipped low is not MISSING
+
+
+def test_pack_csv_truncates_to_shorter(tmp_path):
+    pres = tmp_path / "1-pres-x.csv"
+    flow = tmp_path / "1-flow-x.csv"
+    t = np.arange(300) / 50
+    np.savetxt(str(pres), np.column_stack((t, t * 2)), delimiter=',', fmt='%.2f')
+    np.savetxt(str(flow), np.column_stack((t, -t))[:250], delimiter=',', fmt='%.2f')
+    vpa = archive.ARCHIVE(archive.pack_csv(str(pres), block=100))
+    assert vpa.samples == 250 and vpa.channels == ['press', 'flow']
+    np.testing.assert_allclose(vpa.read()[:, 1], np.round(-t[:250], 2))
+
+
+def test_seek_breath_archive(tmp_path):
+    name = tmp_path / "s.vpa"
+    values = np.column_stack((np.arange(500) * 0.01, np.zeros(500)))
+    write(name, values)
+    index = markers.MARKERS()
+    index.breath = np.array([7, 8])
+    index.start = np.array([100, 300])
+    index.end = np.array([300, 500])
+    index.pres_pos = np.zeros(2, dtype=np.int64)  # byte offsets, csv only
+    index.build()
+    models = model2.BREATH2(filename=str(name))
+    models.seek_breath(index, index.find(8))
+    time, value = models.get_simulated_data()
+    assert time == 300 / models.rate and value == 3.0
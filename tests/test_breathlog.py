@@ -0,0 +1,78 @@
+"""
+Breath log crash recovery and reopening
+"""
+
+import os
+
+import numpy as np
+
+import breathlog
+
+
+def breath(i):
+    return {"Start": i * 3.0, "End": i * 3.0 + 3, "PEEP": 5, "Ppeak": 30 + i,
+            "I:E": "1:2.0"}
+
+
+def write(name, count, close=True):
+    log = breathlog.WRITER(str(name), batch=1000, interval=1e9)
+    for i in range(count):
+        log.append(breath(i))
+    if close:
+        log.close()
+    else:
+        log.sync()  # as if the process died after an fsync
+        log.fp.close()
+    return log
+
+
+def test_closed_log_reads_back(tmp_path):
+    name = tmp_path / "a.vbl"
+    write(name, 200)
+    reader = breathlog.READER(str(name))
+    assert len(reader) == 200
+    assert reader.stats(7)["Ppeak"] == 37 and reader.stats(7)["I:E"] == 2.0
+    assert np.isnan(reader.stats(7)["PTP"])  # not in the stats
+    assert reader.find(300) == 100
+    reader.close()
+
+
+def test_torn_tail_is_cut_and_appended_to(tmp_path):
+    name = tmp_path / "b.vbl"
+    log = write(name, 10, close=False)
+    with open(str(name), "ab") as fp:
+        fp.write(b"\x01" * (log.dtype.itemsize // 2))  # half written record
+    reader = breathlog.READER(str(name))
+    assert len(reader) == 10  # a growing log hides the partial record
+    reader.close()
+
+    log = breathlog.WRITER(str(name))
+    assert log.records == 10 and log.recovered == log.dtype.itemsize // 2
+    log.append(breath(10))
+    log.close()
+    reader = breathlog.READER(str(name))
+    assert len(reader) == 11
+    assert list(reader.column("Start")) == [i * 3.0 for i in range(11)]
+    reader.close()
+
+
+def test_corrupt_last_record_is_dropped(tmp_path):
+    name = tmp_path / "c.vbl"
+    log = write(name, 10, close=False)
+    size = log.dtype.itemsize
+    with open(str(name), "r+b") as fp:
+        fp.seek(breathlog.header_size() + 9 * size + 12)
+        fp.write(b"\xff\xff")  # damage the last record's data
+    log = breathlog.WRITER(str(name))
+    assert log.records == 9 and log.recovered == size
+    log.close()
+    assert len(breathlog.READER(str(name))) == 9
+
+
+def test_reopen_strips_footer(tmp_path):
+    name = tmp_path / "d.vbl"
+    write(name, 100)
+    log = breathlog.WRITER(str(name))
+    assert log.records == 100
+    assert os.path.getsize(str(name)) == breathlog.header_size() + 100 * log.dtype.itemsize
+    log.close()
@@ -0,0 +1,68 @@
+"""
+CHUNKED against a whole buffer MONITOR2.compute
+"""
+
+import glob
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+import analysis
+import chunked
+import monitor2
+
+RECORDING = sorted(glob.glob("models/csv_raw/19-pres-*.csv"))[0]
+THRESHOLD = 14
+
+
+def recording(tmp_path, samples=6000):
+    """ first samples of a csv_raw recording in a file of their own """
+    data = np.loadtxt(RECORDING, delimiter=',', ndmin=2)[:samples]
+    name = tmp_path / "19-pres-short.csv"
+    np.savetxt(str(name), data, delimiter=',', fmt='%.2f')
+    return str(name), data
+
+
+def monitor(data, threshold):
+    mon = monitor2.MONITOR2.__new__(monitor2.MONITOR2)  # no model file needed
+    mon.cycle_stats = []
+    mon.threshold = threshold
+    mon.data = data
+    return mon
+
+
+def test_chunked_matches_compute(tmp_path):
+    name, data = recording(tmp_path)
+    mon = monitor(data, THRESHOLD)
+    mon.compute(plot=False)
+    for chunk in (500, 1337, 10000):
+        analyzer = chunked.CHUNKED(name, threshold=THRESHOLD, chunk=chunk)
+        stats = analyzer.run()
+        assert len(stats) == len(mon.cycle_stats) > 0
+        assert stats == mon.cycle_stats
+        assert np.all(data[analyzer.core.cycle_start, 0] ==
+                      [item["Start"] for item in stats])
+
+
+def test_trigger_matches_analysis(tmp_path):
+    name, data = recording(tmp_path)
+    for percentile in (0, 5):
+        analyzer = chunked.CHUNKED(name, chunk=700)
+        expected = analysis.trigger(data[:, 1], 1.25, percentile)
+        assert analyzer.trigger(percentile=percentile) == expected
+        assert len(analyzer.run()) > 0  # rewound after the pre-pass
+
+
+def test_plot_short_first_cycle(tmp_path):
+    _, data = recording(tmp_path, 2000)
+    data = data.copy()
+    start = analysis.find_cycles(data[:, 1], THRESHOLD)[0][0, 0]
+    data[start + 2:start + 4, 1] = THRESHOLD - 5  # 2 sample glitch
+    mon = monitor(data, THRESHOLD)
+    mon.datanp = data
+    mon.find_cycles(THRESHOLD)
+    assert mon.captured_idx[1] - mon.captured_idx[0] < 5
+    mon.compute(plot=True)
+    assert len(mon.yar) == len(data)
+    assert len(mon.cycle_stats) > 0
+    plt.close('all')
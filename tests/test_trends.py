@@ -0,0 +1,30 @@
+"""
+TRENDS ring buffers, late breaths and PTPmin from integrals
+"""
+
+import numpy as np
+
+import trends
+
+
+def test_late_breath_keeps_newer_bucket():
+    rollup = trends.TRENDS(minutes=10, hours=2)
+    rollup.add({"Start": 600, "Ppeak": 30})   # minute 10, slot 0
+    rollup.add({"Start": 5, "Ppeak": 99})     # minute 0, slot 0 as well
+    assert rollup.minutes.late == 1
+    result = rollup.query("Ppeak")
+    assert list(result["Max"][~np.isnan(result["Max"])]) == [30]
+    assert rollup.hours.late == 0  # still inside the hour ring
+
+
+def test_ptpmin_from_integrals():
+    rollup = trends.TRENDS()
+    starts = np.array([0.0, 3.0, 61.0])
+    for t in starts:
+        rollup.add({"Start": t, "PTP": 15})
+    rollup.add_integrals({"PTPmin": np.array([200.0, 300.0, np.nan]),
+                          "Valid": np.array([True, True, False])}, starts)
+    result = rollup.query("PTPmin", 0, 120)
+    assert list(result["Count"]) == [2, 0]
+    assert result["Mean"][0] == 250
+    assert list(rollup.query("RRmin", 0, 120)["Count"]) == [2, 1]
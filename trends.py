@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+"""
+Incremental per-minute and per-hour trend rollups of breath parameters
+
+Each breath updates one minute bucket and one hour bucket in place so the
+cost per breath is constant.  Buckets live in fixed size ring buffers
+(24h of minutes, 30 days of hours by default) and only hold count, sum,
+min, max and a small histogram for percentiles, so a 24h trend query reads
+1440 buckets instead of rescanning the raw samples.
+
+Copyright (C) 2020 Eric Baicy
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import math
+import time
+from random import uniform
+
+#
+# Notes on Rollups
+#
+# PTP - the MONITOR2 stat, the average pressure before the peak, is trended
+# like any other parameter.  It is not a pressure time product, so PTPmin is
+# not rolled up from it but taken from integrals.py (PTP above PEEP times RR
+# from pressure and flow) through add_integrals().
+#
+# Late breaths - a breath older than the oldest bucket the ring still holds
+# would land on the slot of a newer bucket, it is dropped and counted in
+# ROLLUP.late instead.
+#
+# Minute RR - the number of breaths that started in the minute, unlike the
+# per-breath RR which is computed from one cycle's duration.
+#
+# Percentiles come from a fixed histogram per bucket (see ranges), they are
+# accurate to one bin width which is plenty for trending.
+#
+
+# parameter: [low, high] histogram range, values outside are clipped
+ranges = {
+    "PEEP": [0, 30],
+    "PEEPi": [-5, 15],
+    "Ppeak": [0, 80],
+    "Pplat": [0, 80],
+    "dP": [0, 50],
+    "P01": [0, 60],
+    "PTP": [0, 80],
+    "RR": [0, 80],
+    "PTPmin": [0, 1000],
+}
+
+
+class ROLLUP:
+    """ ring buffer of fixed width time buckets for a set of parameters """
+
+    def __init__(self, params, width=60, size=1440, bins=64):
+        """
+        width (float): seconds covered by each bucket
+        size (int): number of buckets kept in the ring
+        bins (int): histogram bins per parameter for percentiles
+        """
+        self.params = params
+        self.width = width
+        self.size = size
+        self.bins = bins
+        n = len(params)
+        self.low = np.array([ranges.get(p, [0, 100])[0] for p in params],
+                            dtype=float)
+        self.high = np.array([ranges.get(p, [0, 100])[1] for p in params],
+                             dtype=float)
+        self.scale = bins / (self.high - self.low)
+
+        self.bucket = np.full(size, -1, dtype=np.int64)  # absolute bucket id
+        self.newest = -1  # newest bucket id added
+        self.late = 0     # breaths older than the ring, dropped
+        self.breaths = np.zeros(size, dtype=np.int32)
+        self.count = np.zeros((size, n), dtype=np.int32)
+        self.sum = np.zeros((size, n))
+        self.min = np.zeros((size, n))
+        self.max = np.zeros((size, n))
+        self.hist = np.zeros((size, n, bins), dtype=np.uint32)
+
+    def add(self, t, values, breath=True):
+        """
+        Add one breath, O(1)
+
+        t (float): time of breath in seconds
+        values (list): value per parameter, None or nan if missing
+        breath (bool): count it in the bucket's breaths, False when adding
+                       more values of a breath that was already added
+        """
+        bucket = int(t // self.width)
+        if bucket <= self.newest - self.size:
+            self.late += 1  # its slot holds a newer bucket
+            return
+        self.newest = max(self.newest, bucket)
+        slot = bucket % self.size
+        if self.bucket[slot] != bucket:
+            # recycle the oldest slot
+            self.bucket[slot] = bucket
+            self.breaths[slot] = 0
+            self.count[slot] = 0
+            self.sum[slot] = 0
+            self.min[slot] = np.inf
+            self.max[slot] = -np.inf
+            self.hist[slot] = 0
+        if breath:
+            self.breaths[slot] += 1
+        count = self.count[slot]
+        total = self.sum[slot]
+        low = self.min[slot]
+        high = self.max[slot]
+        hist = self.hist[slot]
+        for k in range(len(values)):
+            v = values[k]
+            if v is None or not math.isfinite(v):
+                continue
+            count[k] += 1
+            total[k] += v
+            if v < low[k]:
+                low[k] = v
+            if v > high[k]:
+                high[k] = v
+            b = int((v - self.low[k]) * self.scale[k])
+            if b < 0:
+                b = 0
+            elif b >= self.bins:
+                b = self.bins - 1
+            hist[k, b] += 1
+
+    def slots(self, start, end):
+        """ ring slots holding buckets in [start, end) seconds, in time order """
+        first = max(int(start // self.width),
+                    int(self.bucket.max()) - self.size + 1)
+        last = int(np.ceil(end / self.width))
+        ids = np.arange(first, max(first, last))
+        slots = ids % self.size
+        valid = self.bucket[slots] == ids
+        return ids[valid], slots[valid]
+
+    def percentile(self, hist, k, q):
+        """ estimate percentiles q (0-100) from histogram rows of parameter k """
+        hist = np.atleast_2d(hist)
+        cum = np.cumsum(hist, axis=1)
+        total = cum[:, -1:]
+        width = (self.high[k] - self.low[k]) / self.bins
+        out = np.full((hist.shape[0], len(q)), np.nan)
+        for n in range(len(q)):
+            target = total[:, 0] * q[n] / 100
+            b = (cum < target[:, None]).sum(axis=1)  # first bin reaching target
+            b = np.minimum(b, self.bins - 1)
+            below = np.where(b > 0, cum[np.arange(len(b)), b - 1], 0)
+            inbin = hist[np.arange(len(b)), b]
+            frac = np.divide(target - below, inbin,
+                             out=np.zeros(len(b)), where=inbin > 0)
+            out[:, n] = np.where(total[:, 0] > 0,
+                                 self.low[k] + (b + frac) * width, np.nan)
+        return out
+
+
+class TRENDS:
+
+    params = list(ranges.keys())
+    minutes = ''
+    hours = ''
+
+    def __init__(self, params=None, minutes=1440, hours=720, bins=64):
+        """
+        Setup trend rollups
+
+        params (list): stats keys to trend, defaults to all in ranges
+        minutes (int): minute buckets kept (1440 = 24h)
+        hours (int): hour buckets kept (720 = 30 days)
+        bins (int): histogram bins per parameter for percentiles
+        """
+        if params is not None:
+            self.params = params
+        self.minutes = ROLLUP(self.params, 60, minutes, bins)
+        self.hours = ROLLUP(self.params, 3600, hours, bins)
+
+    def add(self, stats, t=None):
+        """
+        Add one breath stats dictionary, O(1) per breath
+
+        stats (dict): stats from MONITOR/MONITOR2 contours
+        t (float): breath time in seconds, defaults to stats["Start"]
+        """
+        if t is None:
+            t = stats["Start"]
+        values = [stats.get(p) for p in self.params]
+        self.minutes.add(t, values)
+        self.hours.add(t, values)
+
+    def add_integrals(self, result, t):
+        """
+        Add PTPmin of breaths from integrals.integrals, the breaths are
+        expected to be added with add() as well and are not counted again
+
+        result (dict): integrals.integrals() of one or more breaths
+        t (np.array): breath times in seconds, one per breath
+        """
+        if "PTPmin" not in self.params:
+            return
+        k = self.params.index("PTPmin")
+        values = [None] * len(self.params)
+        for i in range(len(result["PTPmin"])):
+            values[k] = result["PTPmin"][i] if result["Valid"][i] else None
+            self.minutes.add(t[i], values, breath=False)
+            self.hours.add(t[i], values, breath=False)
+
+    def query(self, param, start=0, end=np.inf, level='minute',
+              q=(5, 50, 95)):
+        """
+        Trend of one parameter between start and end seconds
+
+        param (str): parameter name, or "RRmin" for the per minute breath
+                     count
+        level (str): 'minute' or 'hour' buckets
+        q (list): percentiles to report
+
+        Returns:
+        dict: arrays Time, Count, Mean, Min, Max and Pxx for each percentile
+        """
+        rollup = self.minutes if level == 'minute' else self.hours
+        if end == np.inf:
+            end = (rollup.bucket.max() + 1) * rollup.width
+        ids, slots = rollup.slots(start, end)
+        per_minute = rollup.width / 60
+        result = {"Time": ids * rollup.width}
+
+        if param == "RRmin":
+            result["Count"] = rollup.breaths[slots]
+            result["Mean"] = rollup.breaths[slots] / per_minute
+            return result
+
+        k = self.params.index(param)
+        count = rollup.count[slots, k]
+        result["Count"] = count
+        result["Mean"] = np.divide(rollup.sum[slots, k], count,
+                                   out=np.full(len(slots), np.nan),
+                                   where=count > 0)
+        result["Min"] = np.where(count > 0, rollup.min[slots, k], np.nan)
+        result["Max"] = np.where(count > 0, rollup.max[slots, k], np.nan)
+        pct = rollup.percentile(rollup.hist[slots, k], k, q)
+        # bin resolution can step outside the exact min/max
+        pct = np.clip(pct, result["Min"][:, None], result["Max"][:, None])
+        for n in range(len(q)):
+            result["P{}".format(q[n])] = pct[:, n]
+        return result
+
+    def summary(self, param, start=0, end=np.inf, level='minute',
+                q=(5, 50, 95)):
+        """ Single set of stats for param over the whole range """
+        rollup = self.minutes if level == 'minute' else self.hours
+        if end == np.inf:
+            end = (rollup.bucket.max() + 1) * rollup.width
+        ids, slots = rollup.slots(start, end)
+        k = self.params.index(param)
+        count = rollup.count[slots, k]
+        total = count.sum()
+        result = {"Count": int(total)}
+        if total == 0:
+            return result
+        used = count > 0
+        result["Mean"] = rollup.sum[slots, k].sum() / total
+        result["Min"] = rollup.min[slots, k][used].min()
+        result["Max"] = rollup.max[slots, k][used].max()
+        pct = rollup.percentile(rollup.hist[slots, k].sum(axis=0), k, q)
+        pct = np.clip(pct, result["Min"], result["Max"])
+        for n in range(len(q)):
+            result["P{}".format(q[n])] = pct[0, n]
+        return result
+
+
+if __name__ == "__main__":
+
+    # 24h of breaths at roughly 20 bpm
+    trends = TRENDS()
+    t = 0
+    breaths = 0
+    elapsed = time.perf_counter()
+    while t < 24 * 3600:
+        stats = {
+            "Start": t,
+            "PEEP": uniform(4, 6),
+            "PEEPi": uniform(0, 2),
+            "Ppeak": uniform(25, 35),
+            "Pplat": uniform(20, 25),
+            "dP": uniform(15, 20),
+            "P01": uniform(5, 15),
+            "PTP": uniform(10, 20),
+            "RR": uniform(18, 22)
+        }
+        trends.add(stats)
+        t += 3
+        breaths += 1
+    elapsed = time.perf_counter() - elapsed
+    print("{} breaths added, {:1.2f} us/breath".format(
+        breaths, elapsed / breaths * 1e6))
+
+    # PTPmin of the same breaths as integrals.integrals would report it
+    starts = np.arange(breaths) * 3.0
+    ptpmin = np.array([uniform(150, 300) for i in range(breaths)])
+    trends.add_integrals({"PTPmin": ptpmin, "Valid": ptpmin > 0}, starts)
+    trends.add({"Start": t, "Ppeak": 30})
+    trends.add({"Start": 30, "Ppeak": 99})  # older than the minute ring, dropped
+
+    elapsed = time.perf_counter()
+    ppeak = trends.query("Ppeak")
+    rrmin = trends.query("RRmin")
+    ptp = trends.query("PTPmin")
+    day = trends.summary("Ppeak")
+    elapsed = time.perf_counter() - elapsed
+    print("24h query of {} minutes in {:1.2f} ms".format(
+        len(ppeak["Time"]), elapsed * 1000))
+    print("Ppeak 24h: {}".format(day))
+    print("RRmin first minutes: {}".format(rrmin["Mean"][:5]))
+    print("PTPmin first minutes: {}".format(ptp["Mean"][:5]))
+    print("late breaths dropped: {}".format(trends.minutes.late))